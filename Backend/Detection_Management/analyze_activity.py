@@ -1,11 +1,60 @@
 # analyze_activity.py
+import os
+import sys
 import pandas as pd
 from datetime import datetime
 from model import classify
 from domain_map import get_app_name
 from save_detections_batch import save_detections_batch
 from session_lookup import get_roll_no_from_ip
-from db_client import web_filter
+from db_client import db, web_filter
+
+
+def _ensure_backend_root_on_path():
+    backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if backend_root not in sys.path:
+        sys.path.insert(0, backend_root)
+
+
+def _load_domain_policy(config, group=None):
+    """The compiled policy dnsmasq and the firewall use; compiled in memory if not written yet."""
+    _ensure_backend_root_on_path()
+    from domain_policy import (
+        DOMAIN_POLICY_FILE,
+        DomainPolicy,
+        compile_domain_policy,
+        group_policy_path,
+        load_domain_policy,
+        policy_entries_from_config,
+    )
+    from filter_groups import get_policy_groups, group_filter_config
+
+    policy = load_domain_policy(group_policy_path(group) if group else DOMAIN_POLICY_FILE)
+    if policy is None:
+        if group:
+            config = group_filter_config(config, get_policy_groups(config)[group])
+        policy = DomainPolicy(compile_domain_policy(policy_entries_from_config(config)))
+    return policy
+
+
+def _group_categories(config, groups, group):
+    if not group:
+        return (config or {}).get("categories", {})
+    from filter_groups import group_filter_config
+
+    return group_filter_config(config, groups[group]).get("categories", {})
+
+
+def _user_policy_group(roll_no, groups, cache):
+    """Filter group of a user (cached per batch); None when groups are not in use."""
+    if not groups:
+        return None
+    if roll_no not in cache:
+        from filter_groups import group_for_user
+
+        user = db["users"].find_one({"roll_no": roll_no}, {"user_type": 1, "policy_group": 1})
+        cache[roll_no] = group_for_user(user, groups)
+    return cache[roll_no]
 
 def analyze_packet(packet):
     """
@@ -51,6 +100,20 @@ def analyze_rows(rows):
     detections = []
     seen_activities = set()  # ✅ Track unique (roll_no, domain) pairs to avoid duplicates
 
+    # Filter config and domain policies are loaded once per batch, not per row.
+    config = None
+    policies = {}
+    groups = {}
+    user_groups = {}
+    try:
+        config = web_filter.find_one({"type": "config"})
+        policies[None] = _load_domain_policy(config)
+        from filter_groups import get_policy_groups
+
+        groups = get_policy_groups(config)
+    except Exception as e:
+        print(f"⚠️ Error loading web filter: {e}")
+
     try:
         for r in rows:
             try:
@@ -80,15 +143,22 @@ def analyze_rows(rows):
                 block_reason = None
                 
                 try:
-                    config = web_filter.find_one({"type": "config"})
                     if config:
-                        # 1. Check Manual Blocks
-                        if any(b in domain for b in config.get("manual_blocks", [])):
+                        # 1. Check blocked domains (same rules as dnsmasq and the firewall)
+                        group = _user_policy_group(roll_no, groups, user_groups)
+                        if group not in policies:
+                            policies[group] = _load_domain_policy(config, group)
+                        policy = policies.get(group)
+                        matched = policy.lookup(domain) if policy is not None else None
+                        if matched == "manual":
                             is_blocked = True
                             block_reason = "Manually Blocked Site"
+                        elif matched:
+                            is_blocked = True
+                            block_reason = f"Blocked Category: {matched}"
 
-                        # 2. Check Categories
-                        cats = config.get("categories", {})
+                        # 2. Check Categories (as toggled for the user's filter group)
+                        cats = _group_categories(config, groups, group)
                         
                         # Map model categories to config categories
                         cat_map = {
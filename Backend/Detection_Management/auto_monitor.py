@@ -1,7 +1,9 @@
 # auto_monitor.py
 from capture import start_capture_stream
 from analyze_activity import analyze_rows
+from dns_answer_learner import DnsAnswerLearner
 from ml_random_forest import main as run_ml_analysis
+import os
 import signal
 import sys
 import time
@@ -12,11 +14,17 @@ def signal_handler(sig, frame):
     print("\n⚠️ Monitoring stopped by user")
     sys.exit(0)
 
-def auto_monitor(interface="wlan0", interval_minutes=1, ml_interval_minutes=5):
+def auto_monitor(interface="wlan0", interval_minutes=1, ml_interval_minutes=5, learn_dns_answers=True):
     signal.signal(signal.SIGINT, signal_handler)
     print("🚀 Real-time monitoring started...")
     print(f"💾 Saving detections every {interval_minutes} minute(s)")
     print(f"🤖 Running ML analysis every {ml_interval_minutes} minute(s)")
+
+    learner = None
+    if learn_dns_answers:
+        learner = DnsAnswerLearner()
+        learner.start()
+        print("🧠 Learning blocked-domain IPs from captured DNS answers")
     print("Press Ctrl+C to stop\n")
 
     buffer = []
@@ -24,7 +32,7 @@ def auto_monitor(interface="wlan0", interval_minutes=1, ml_interval_minutes=5):
     next_ml_time = datetime.now() + timedelta(minutes=ml_interval_minutes)
 
     try:
-        for row in start_capture_stream(interface):
+        for row in start_capture_stream(interface, on_dns_answer=learner.observe if learner else None):
             buffer.append(row)
 
             # ✅ Check if it's time to save (every 1 minute)
@@ -64,6 +72,9 @@ def auto_monitor(interface="wlan0", interval_minutes=1, ml_interval_minutes=5):
             print("Attempting to save buffered data...")
             analyze_rows(buffer)
         sys.exit(1)
+    finally:
+        if learner:
+            learner.stop()
 
 if __name__ == "__main__":
     # Default to wlan0 (Linux WiFi interface)
@@ -79,6 +90,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Monitor network traffic")
     parser.add_argument("interface", nargs="?", default="wlan0", 
                         help="Network interface (default: wlan0, use 'list' to show all)")
+    parser.add_argument("--no-dns-learning", action="store_true",
+                        help="Don't feed captured DNS answers for blocked domains into the firewall")
     args = parser.parse_args()
     
     interface = args.interface
@@ -91,4 +104,5 @@ if __name__ == "__main__":
         sys.exit(0)
     
     print(f"📡 Using interface: {interface}")
-    auto_monitor(interface)
+    learn = not args.no_dns_learning and os.environ.get("DNS_ANSWER_LEARNING", "1") != "0"
+    auto_monitor(interface, learn_dns_answers=learn)
@@ -10,6 +10,7 @@ blocked_users = db["blocked_users"]
 anomalies = db["anomalies"]
 sessions_collection = db["active_sessions"]
 users_collection = db["users"]
+usage_daily = db["usage_daily"]
 
 
 def _ensure_backend_root_on_path():
@@ -50,17 +51,25 @@ def _sync_usage_before_block(roll_no, active_session, now):
     delta_total = max(0, delta_upload + delta_download)
 
     if delta_total > 0:
+        user_inc = {
+            "total_data_bytes": delta_total,
+            "total_upload_bytes": max(0, delta_upload),
+            "total_download_bytes": max(0, delta_download),
+        }
         users_collection.update_one(
             {"roll_no": roll_no},
             {
-                "$inc": {
-                    "total_data_bytes": delta_total,
-                    "total_upload_bytes": max(0, delta_upload),
-                    "total_download_bytes": max(0, delta_download),
-                },
+                "$inc": user_inc,
                 "$set": {"data_usage_updated_at": now},
             },
         )
+        try:
+            _ensure_backend_root_on_path()
+            from db import daily_usage_update
+
+            usage_daily.update_one(*daily_usage_update(roll_no, user_inc, now), upsert=True)
+        except Exception as error:
+            print(f"⚠️ Failed to update daily usage rollup for {roll_no}: {error}")
 
     sessions_collection.update_one(
         {"_id": active_session["_id"]},
@@ -112,7 +121,8 @@ def _force_logout_if_active(roll_no, reason):
         _ensure_backend_root_on_path()
         from bandwidth_manager import apply_bandwidth_for_active_users
 
-        apply_bandwidth_for_active_users()
+        # Runs from standalone detection scripts: wait, or the daemon reconcile thread dies with the process.
+        apply_bandwidth_for_active_users(wait=True)
     except Exception as e:
         print(f"⚠️ Failed to refresh bandwidth policies after blocking {roll_no}: {e}")
 
@@ -12,10 +12,19 @@ def _read_stderr(process, label="tshark"):
         if line:
             print(f"[{label} stderr] {line}")
 
-def start_capture_stream(interface="wlan0", retry=True, retry_delay=3):
+def _min_ttl(ttl_field):
+    ttls = [int(t) for t in ttl_field.split(";") if t.strip().isdigit()]
+    return min(ttls) if ttls else 0
+
+def start_capture_stream(interface="wlan0", retry=True, retry_delay=3, on_dns_answer=None):
     """
     Stream packets from tshark. Automatically retries if tshark exits.
     Shows tshark errors via stderr so issues are visible.
+
+    If on_dns_answer is given it is called as
+    on_dns_answer(domain, ips, ttl, client_ip, server_ip) for every DNS
+    response that carries A records (ttl is the lowest answer TTL,
+    server_ip the resolver that sent it).
     """
     while True:
         try:
@@ -28,7 +37,13 @@ def start_capture_stream(interface="wlan0", retry=True, retry_delay=3):
                 "-e", "dns.qry.name",
                 "-e", "http.host",
                 "-e", "tls.handshake.extensions_server_name",
-                "-E", "separator=,"
+                "-e", "ip.dst",
+                "-e", "dns.flags.response",
+                "-e", "dns.a",
+                "-e", "dns.resp.ttl",
+                "-E", "separator=,",
+                # Multi-valued fields (several A records/TTLs) must not reuse the separator.
+                "-E", "aggregator=;"
             ]
 
             process = subprocess.Popen(
@@ -58,6 +73,18 @@ def start_capture_stream(interface="wlan0", retry=True, retry_delay=3):
                     if not domain or domain.strip() == "":
                         continue
 
+                    if on_dns_answer and len(parts) >= 9 and parts[6] in ("1", "True") and parts[7]:
+                        try:
+                            on_dns_answer(
+                                parts[2].split(";")[0],
+                                [ip for ip in parts[7].split(";") if ip],
+                                _min_ttl(parts[8]),
+                                parts[5],
+                                parts[1],
+                            )
+                        except Exception as e:
+                            print(f"⚠️ DNS answer handler failed: {e}")
+
                     packet_count += 1
                     yield {
                         "timestamp": datetime.utcnow(),
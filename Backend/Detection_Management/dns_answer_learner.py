@@ -0,0 +1,166 @@
+# dns_answer_learner.py
+"""
+Learn blocked-domain IPs from DNS answers seen by the capture.
+
+Answers for blocked domains are pushed into the firewall's learned-blocks
+chain with an expiry of (answer TTL + grace), so the firewall tracks the
+addresses clients actually received without any extra DNS queries.
+Sinkhole answers (0.0.0.0 from our own dnsmasq) and non-public addresses
+are ignored.
+
+Scope: the gateway's dnsmasq (and the group DNS views on the same address)
+answers blocked names with 0.0.0.0 or NXDOMAIN, so answers it sends are
+skipped outright. What remains are answers from other resolvers - clients
+with hard-coded or encrypted-fallback DNS that got past the port 53 rules.
+This complements the resolver service's active resolution of blocked
+domains; it does not replace it.
+"""
+import ipaddress
+import os
+import sys
+import threading
+import time
+
+DNS_LEARN_MIN_TTL = int(os.environ.get("DNS_LEARN_MIN_TTL", "60"))
+DNS_LEARN_GRACE_SECONDS = int(os.environ.get("DNS_LEARN_GRACE_SECONDS", "300"))
+DNS_LEARN_FLUSH_SECONDS = float(os.environ.get("DNS_LEARN_FLUSH_SECONDS", "2"))
+# Only rewrite a rule when a new answer pushes its expiry out by more than this.
+DNS_LEARN_REFRESH_SLACK_SECONDS = int(os.environ.get("DNS_LEARN_REFRESH_SLACK_SECONDS", "60"))
+BLOCKED_DOMAINS_REFRESH_SECONDS = 60
+HOTSPOT_GATEWAY_IP = os.environ.get("HOTSPOT_GATEWAY_IP", "192.168.50.1")
+
+
+def _ensure_backend_root_on_path():
+    backend_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if backend_root not in sys.path:
+        sys.path.insert(0, backend_root)
+
+
+def _is_public_ipv4(ip):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return address.version == 4 and address.is_global
+
+
+class DnsAnswerLearner:
+    def __init__(self, flush_interval=DNS_LEARN_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending = {}      # ip -> expires_at waiting to be written
+        self._learned = {}      # ip -> expires_at we intend to keep
+        self._persisted = {}    # ip -> expires_at currently in the firewall
+        self._policy = None
+        self._domains_loaded_at = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        self.stats = {"answers": 0, "learned": 0, "expired": 0}
+
+    def _refresh_blocked_domains(self, now):
+        if now - self._domains_loaded_at < BLOCKED_DOMAINS_REFRESH_SECONDS:
+            return
+        self._domains_loaded_at = now
+        try:
+            _ensure_backend_root_on_path()
+            from domain_policy import get_domain_policy
+
+            self._policy = get_domain_policy()
+        except Exception as e:
+            print(f"⚠️ Could not load blocked domains: {e}")
+
+    def is_blocked_domain(self, domain):
+        """True when the shared domain policy blocks this name (subdomain/wildcard rules included)."""
+        return self._policy is not None and self._policy.is_blocked(domain)
+
+    def observe(self, domain, ips, ttl, client_ip=None, server_ip=None):
+        """Capture callback: remember public A records of blocked domains from third-party resolvers."""
+        if server_ip == HOTSPOT_GATEWAY_IP:
+            # Our own dnsmasq only ever sinkholes blocked names.
+            return
+        now = time.time()
+        self._refresh_blocked_domains(now)
+        if not self.is_blocked_domain(domain):
+            return
+
+        expires_at = now + max(DNS_LEARN_MIN_TTL, int(ttl or 0)) + DNS_LEARN_GRACE_SECONDS
+        with self._lock:
+            self.stats["answers"] += 1
+            for ip in ips:
+                if not _is_public_ipv4(ip):
+                    continue
+                if expires_at <= self._learned.get(ip, 0):
+                    continue
+                self._learned[ip] = expires_at
+                if expires_at > self._persisted.get(ip, 0) + DNS_LEARN_REFRESH_SLACK_SECONDS:
+                    self._pending[ip] = expires_at
+
+    def load_existing(self):
+        """Pick up learned IPs (and their expiry) left in the firewall by a previous run."""
+        _ensure_backend_root_on_path()
+        from linux_firewall_manager import get_learned_block_expiries
+
+        existing = get_learned_block_expiries() or {}
+        with self._lock:
+            self._learned.update(existing)
+            self._persisted.update(existing)
+        return len(existing)
+
+    def flush(self):
+        """Write pending IPs and remove expired ones in one firewall transaction."""
+        _ensure_backend_root_on_path()
+        from linux_firewall_manager import apply_learned_block_diff
+
+        now = time.time()
+        with self._lock:
+            pending = dict(self._pending)
+            self._pending.clear()
+            expired = [ip for ip, expires_at in self._learned.items() if expires_at <= now]
+            for ip in expired:
+                self._learned.pop(ip, None)
+        if not pending and not expired:
+            return
+
+        result = apply_learned_block_diff(pending, expired)
+        with self._lock:
+            if result.get("success"):
+                self._persisted.update(pending)
+                for ip in expired:
+                    self._persisted.pop(ip, None)
+                self.stats["learned"] += len(pending)
+                self.stats["expired"] += len(expired)
+            else:
+                # Try again on the next flush.
+                for ip, expires_at in pending.items():
+                    self._pending[ip] = max(expires_at, self._pending.get(ip, 0))
+                for ip in expired:
+                    self._learned.setdefault(ip, now)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️ DNS answer learner flush failed: {e}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        try:
+            restored = self.load_existing()
+            if restored:
+                print(f"🔁 Restored {restored} learned blocked IP(s)")
+        except Exception as e:
+            print(f"⚠️ Could not read learned blocks: {e}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="dns-answer-learner", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"⚠️ DNS answer learner flush failed: {e}")
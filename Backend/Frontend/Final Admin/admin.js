@@ -240,22 +240,22 @@ document.addEventListener("DOMContentLoaded", () => {
             }
 
             const data = await response.json();
-            const count = data.count || 0;
-
-            // Update badge
-            if (notificationBadge) {
-                if (count > 0) {
-                    notificationBadge.textContent = count > 99 ? '99+' : count;
-                    notificationBadge.classList.remove('hidden');
-                } else {
-                    notificationBadge.classList.add('hidden');
-                }
-            }
+            renderNotificationBadge(data.count || 0);
         } catch (error) {
             console.error('Error updating notification badge:', error);
         }
     }
 
+    function renderNotificationBadge(count) {
+        if (!notificationBadge) return;
+        if (count > 0) {
+            notificationBadge.textContent = count > 99 ? '99+' : count;
+            notificationBadge.classList.remove('hidden');
+        } else {
+            notificationBadge.classList.add('hidden');
+        }
+    }
+
     async function markAllNotificationsRead() {
         const token = localStorage.getItem('admin_token');
         if (!token) return;
@@ -281,17 +281,133 @@ document.addEventListener("DOMContentLoaded", () => {
     loadNotifications();
     updateNotificationBadge();
 
-    // Set up auto-refresh for notifications (every 30 seconds)
-    setInterval(() => {
-        // Only refresh if notification tray is NOT open (to avoid UI jarring)
-        if (!notificationTray.classList.contains('active')) {
-            loadNotifications();
+    // --- Live updates (Server-Sent Events, with polling fallback) ---
+    let adminStream = null;
+    let adminStreamFailures = 0;
+    const ADMIN_STREAM_MAX_RETRIES = 3;
+    let notificationPollInterval = null;
+    let lastNotificationCount = null;
+
+    function startNotificationPolling() {
+        if (notificationPollInterval) return;
+        // Set up auto-refresh for notifications (every 30 seconds)
+        notificationPollInterval = setInterval(() => {
+            // Only refresh if notification tray is NOT open (to avoid UI jarring)
+            if (!notificationTray.classList.contains('active')) {
+                loadNotifications();
+            }
+            updateNotificationBadge();
+        }, 30000);
+    }
+
+    function isAdminStreamLive() {
+        return adminStream !== null && adminStream.readyState !== EventSource.CLOSED;
+    }
+
+    function startAdminStream() {
+        const token = localStorage.getItem('admin_token');
+        if (!token || typeof EventSource === 'undefined') {
+            startNotificationPolling();
+            return;
         }
-        updateNotificationBadge();
-    }, 30000);
+
+        // EventSource cannot send headers, so trade the session token for a
+        // short-lived stream-only token that is safe to put in the URL.
+        fetch('/api/admin/stream-token', {
+            method: 'POST',
+            headers: { 'Authorization': 'Bearer ' + token }
+        })
+            .then(res => res.ok ? res.json() : Promise.reject(new Error('stream token ' + res.status)))
+            .then(data => openAdminStream(data.stream_token))
+            .catch(err => {
+                console.error(err);
+                startNotificationPolling();
+            });
+    }
+
+    function openAdminStream(streamToken) {
+        adminStream = new EventSource('/api/admin/stream?stream_token=' + encodeURIComponent(streamToken));
+
+        adminStream.addEventListener('open', () => {
+            adminStreamFailures = 0;
+        });
+
+        adminStream.addEventListener('stats', (event) => {
+            applyDashboardStats(JSON.parse(event.data));
+        });
+
+        adminStream.addEventListener('logs', (event) => {
+            prependDashboardLogs(JSON.parse(event.data).logs || []);
+        });
+
+        adminStream.addEventListener('notifications', (event) => {
+            const count = JSON.parse(event.data).count || 0;
+            renderNotificationBadge(count);
+            if (count !== lastNotificationCount && !notificationTray.classList.contains('active')) {
+                loadNotifications();
+            }
+            lastNotificationCount = count;
+        });
+
+        adminStream.onerror = () => {
+            // The browser retries on its own; it gives up once the stream token
+            // has expired, so fetch a fresh one a few times before falling back.
+            if (adminStream.readyState === EventSource.CLOSED) {
+                adminStream = null;
+                startNotificationPolling();
+                if (document.getElementById('dashboard-page')) initDashboard();
+                adminStreamFailures += 1;
+                if (adminStreamFailures <= ADMIN_STREAM_MAX_RETRIES) {
+                    setTimeout(startAdminStream, 5000);
+                }
+            }
+        };
+    }
+
+    startAdminStream();
 
     // --- Page Initializers (These run after a page is loaded) ---
 
+    function applyDashboardStats(stats) {
+        // Update Active Students count
+        const clientCountElement = document.getElementById("client-count");
+        if (clientCountElement) {
+            clientCountElement.textContent = stats.active_students || 0;
+        }
+
+        // Update Total Data usage
+        const dataCountElement = document.getElementById("data-count");
+        if (dataCountElement) {
+            dataCountElement.textContent = `${stats.total_data_gb || 0} GB`;
+        }
+
+        // Update Threats Blocked count
+        const threatCountElement = document.getElementById("threat-count");
+        if (threatCountElement) {
+            threatCountElement.textContent = stats.threats_blocked || 0;
+        }
+
+        // Update traffic chart with live backend data
+        if (document.getElementById('dashboard-page')) {
+            updateTrafficChart(stats.traffic_data);
+        }
+    }
+
+    function prependDashboardLogs(logs, replace = false) {
+        const logBody = document.getElementById("event-log-body");
+        if (!logBody) return;
+
+        if (replace) logBody.innerHTML = "";
+        logs.slice(0, 5).reverse().forEach(log => {
+            const tr = document.createElement('tr');
+            tr.innerHTML = `<td>${log.time}</td><td><span class="log-level-${log.level}">${log.level.toUpperCase()}</span></td><td>${log.user}</td><td>${log.action}</td>`;
+            logBody.insertBefore(tr, logBody.firstChild);
+        });
+        while (logBody.children.length > 5) {
+            logBody.removeChild(logBody.lastChild);
+        }
+    }
+
     function initDashboard() {
         // Clear any existing refresh interval
         if (window.dashboardRefreshInterval) {
@@ -317,28 +433,7 @@ document.addEventListener("DOMContentLoaded", () => {
                     return;
                 }
 
-                const stats = await statsResponse.json();
-
-                // Update Active Students count
-                const clientCountElement = document.getElementById("client-count");
-                if (clientCountElement) {
-                    clientCountElement.textContent = stats.active_students || 0;
-                }
-
-                // Update Total Data usage
-                const dataCountElement = document.getElementById("data-count");
-                if (dataCountElement) {
-                    dataCountElement.textContent = `${stats.total_data_gb || 0} GB`;
-                }
-
-                // Update Threats Blocked count
-                const threatCountElement = document.getElementById("threat-count");
-                if (threatCountElement) {
-                    threatCountElement.textContent = stats.threats_blocked || 0;
-                }
-
-                // Update traffic chart with live backend data
-                updateTrafficChart(stats.traffic_data);
+                applyDashboardStats(await statsResponse.json());
 
             } catch (error) {
                 console.error('Error loading dashboard data:', error);
@@ -352,15 +447,8 @@ document.addEventListener("DOMContentLoaded", () => {
 
                 if (logsResponse.ok) {
                     const logsData = await logsResponse.json();
-                    const logBody = document.getElementById("event-log-body");
-
-                    if (logBody && logsData.logs) {
-                        logBody.innerHTML = "";
-                        logsData.logs.slice(0, 5).forEach(log => {
-                            const tr = document.createElement('tr');
-                            tr.innerHTML = `<td>${log.time}</td><td><span class="log-level-${log.level}">${log.level.toUpperCase()}</span></td><td>${log.user}</td><td>${log.action}</td>`;
-                            logBody.appendChild(tr);
-                        });
+                    if (logsData.logs) {
+                        prependDashboardLogs(logsData.logs, true);
                     }
                 }
             } catch (error) {
@@ -370,7 +458,7 @@ document.addEventListener("DOMContentLoaded", () => {
 
         // Initialize the traffic chart
         const canvas = document.getElementById('traffic-chart-canvas');
-        if (canvas) {
+        if (canvas && !myTrafficChart) {
             const ctx = canvas.getContext('2d');
             myTrafficChart = renderTrafficChart(ctx);
         }
@@ -378,6 +466,9 @@ document.addEventListener("DOMContentLoaded", () => {
         // Load initial data
         loadDashboardData();
 
+        // The live stream pushes further updates; poll only without it.
+        if (isAdminStreamLive()) return;
+
         // Set up auto-refresh every 5 seconds
         window.dashboardRefreshInterval = setInterval(() => {
             // Only refresh if we're still on the dashboard page
@@ -678,6 +769,10 @@ document.addEventListener("DOMContentLoaded", () => {
         const logBody = document.getElementById("log-body");
         if (!logBody) return;
 
+        const filterForm = document.getElementById("log-filter-form");
+        const loadOlderBtn = document.getElementById("log-load-older");
+        let nextCursor = null;
+
         // Clear existing logs and show loading
         logBody.innerHTML = "<tr><td colspan='4'>Loading logs...</td></tr>";
 
@@ -688,34 +783,78 @@ document.addEventListener("DOMContentLoaded", () => {
             return;
         }
 
-        fetch('/api/admin/logs', {
-            headers: { 'Authorization': 'Bearer ' + token }
-        })
-            .then(res => res.json())
-            .then(data => {
-                const logs = data.logs || [];
-                logBody.innerHTML = "";
+        function buildLogsQuery(cursor) {
+            const params = new URLSearchParams();
+            const rollNo = (document.getElementById("log-filter-roll")?.value || '').trim();
+            const category = document.getElementById("log-filter-category")?.value || '';
+            const domain = (document.getElementById("log-filter-domain")?.value || '').trim();
 
-                if (logs.length === 0) {
-                    logBody.innerHTML = "<tr><td colspan='4'>No network activity logs found. Start monitoring to capture activity.</td></tr>";
-                    return;
-                }
+            if (rollNo) params.set('roll_no', rollNo);
+            if (category) params.set('category', category);
+            if (domain) params.set('domain', domain);
+            if (cursor) params.set('before', cursor);
 
-                logs.forEach(log => {
-                    const tr = document.createElement('tr');
-                    tr.innerHTML = `
-                    <td>${log.time || 'N/A'}</td>
-                    <td><span class="log-level-${log.level || 'info'}">${(log.level || 'info').toUpperCase()}</span></td>
-                    <td>${log.user || 'Unknown'} / ${log.ip || 'N/A'}</td>
-                    <td>${log.action || 'Unknown activity'}</td>
-                `;
-                    logBody.appendChild(tr);
-                });
+            const query = params.toString();
+            return query ? `?${query}` : '';
+        }
+
+        function loadLogsPage(cursor) {
+            if (loadOlderBtn) loadOlderBtn.disabled = true;
+
+            fetch('/api/admin/logs' + buildLogsQuery(cursor), {
+                headers: { 'Authorization': 'Bearer ' + token }
             })
-            .catch(err => {
-                console.error('Error fetching logs:', err);
-                logBody.innerHTML = "<tr><td colspan='4'>Error loading logs. Please try again.</td></tr>";
+                .then(res => res.json())
+                .then(data => {
+                    const logs = data.logs || [];
+                    if (!cursor) logBody.innerHTML = "";
+
+                    if (!cursor && logs.length === 0) {
+                        logBody.innerHTML = "<tr><td colspan='4'>No network activity logs found. Start monitoring to capture activity.</td></tr>";
+                    }
+
+                    logs.forEach(log => {
+                        const tr = document.createElement('tr');
+                        tr.innerHTML = `
+                        <td>${log.time || 'N/A'}</td>
+                        <td><span class="log-level-${log.level || 'info'}">${(log.level || 'info').toUpperCase()}</span></td>
+                        <td>${log.user || 'Unknown'} / ${log.ip || 'N/A'}</td>
+                        <td>${log.action || 'Unknown activity'}</td>
+                    `;
+                        logBody.appendChild(tr);
+                    });
+
+                    nextCursor = data.next_cursor || null;
+                    if (loadOlderBtn) {
+                        loadOlderBtn.style.display = data.has_more && nextCursor ? '' : 'none';
+                        loadOlderBtn.disabled = false;
+                    }
+                })
+                .catch(err => {
+                    console.error('Error fetching logs:', err);
+                    if (!cursor) {
+                        logBody.innerHTML = "<tr><td colspan='4'>Error loading logs. Please try again.</td></tr>";
+                    }
+                    if (loadOlderBtn) loadOlderBtn.disabled = false;
+                });
+        }
+
+        if (filterForm) {
+            filterForm.addEventListener('submit', (event) => {
+                event.preventDefault();
+                nextCursor = null;
+                logBody.innerHTML = "<tr><td colspan='4'>Loading logs...</td></tr>";
+                loadLogsPage(null);
             });
+        }
+
+        if (loadOlderBtn) {
+            loadOlderBtn.addEventListener('click', () => {
+                if (nextCursor) loadLogsPage(nextCursor);
+            });
+        }
+
+        loadLogsPage(null);
     }
 
     async function initSettings() {
@@ -1331,6 +1470,7 @@ document.addEventListener("DOMContentLoaded", () => {
             const type = document.getElementById('report-type').value;
             const range = document.getElementById('report-range').value;
             const format = document.getElementById('report-format').value;
+            const live = Boolean(document.getElementById('report-live')?.checked);
 
             // Show loading state
             const resultsArea = document.getElementById('report-results-area');
@@ -1345,13 +1485,52 @@ document.addEventListener("DOMContentLoaded", () => {
                 return;
             }
 
+            // The full audit can be millions of rows: fetch it as a file rather than
+            // rendering it. The token goes in the header, never in the URL.
+            if (type === 'Full Network Audit' && format === 'CSV') {
+                const params = new URLSearchParams({ format: 'csv', range });
+                if (resultsArea) {
+                    resultsArea.innerHTML = '<div class="card"><p>Preparing full audit export...</p></div>';
+                }
+                fetch(`/api/admin/reports/audit-export?${params.toString()}`, {
+                    headers: { 'Authorization': 'Bearer ' + token }
+                })
+                    .then(res => {
+                        if (!res.ok) throw new Error(`Export failed (${res.status})`);
+                        const disposition = res.headers.get('Content-Disposition') || '';
+                        const match = disposition.match(/filename="?([^";]+)"?/);
+                        return res.blob().then(blob => ({ blob, filename: match ? match[1] : 'network_audit.csv' }));
+                    })
+                    .then(({ blob, filename }) => {
+                        const url = URL.createObjectURL(blob);
+                        const link = document.createElement('a');
+                        link.href = url;
+                        link.download = filename;
+                        document.body.appendChild(link);
+                        link.click();
+                        link.remove();
+                        URL.revokeObjectURL(url);
+                        if (resultsArea) {
+                            resultsArea.innerHTML = '<div class="card"><p>Full audit export downloaded.</p></div>';
+                        }
+                        addLog('info', 'ADMIN', `Exported full network audit (${range})`);
+                    })
+                    .catch(err => {
+                        console.error(err);
+                        if (resultsArea) {
+                            resultsArea.innerHTML = `<div class="card"><p>Error: ${err.message}</p></div>`;
+                        }
+                    });
+                return;
+            }
+
             fetch('/api/admin/reports', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                     'Authorization': 'Bearer ' + token
                 },
-                body: JSON.stringify({ type, range })
+                body: JSON.stringify({ type, range, live })
             })
                 .then(res => res.json())
                 .then(data => {
@@ -2740,10 +2919,15 @@ function initCSVUpload() {
                     body: formData
                 });
 
-                const data = await response.json();
+                let data = await response.json();
                 console.log('Upload response:', data);
 
-                if (response.ok) {
+                // Large rosters are imported by a background job; poll it until done.
+                if (response.status === 202 && data.status_url) {
+                    data = await pollBulkUploadJob(data.status_url, token);
+                }
+
+                if (response.ok && data.status !== 'failed') {
                     let message = `✅ Upload completed!\n\n`;
                     message += `• Added: ${data.added} students\n`;
                     message += `• Skipped: ${data.skipped} students\n`;
@@ -2772,6 +2956,23 @@ function initCSVUpload() {
         };
     }
 
+    async function pollBulkUploadJob(statusUrl, token) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const res = await fetch(statusUrl, {
+                headers: { 'Authorization': 'Bearer ' + token }
+            });
+            const job = await res.json();
+            if (!res.ok) return { status: 'failed', error: job.error || 'Upload status unavailable' };
+
+            if (job.status !== 'running') return job;
+            const progressText = uploadLoading?.querySelector('.loading-sub-text');
+            if (progressText) {
+                progressText.textContent = `Imported ${job.processed || 0} of ${job.total || 0} students`;
+            }
+        }
+    }
+
     function showResult(type, message) {
         if (!resultMessage) return;
 
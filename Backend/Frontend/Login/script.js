@@ -1,4 +1,6 @@
 const SESSION_STATUS_POLL_MS = 15000;
+const GRANT_STATUS_POLL_MS = 500;
+const GRANT_STATUS_TIMEOUT_MS = 30000;
 let sessionGuardTimer = null;
 let forcedLogoutInProgress = false;
 
@@ -27,8 +29,16 @@ function loginUser() {
             localStorage.setItem("token", data.token);
             localStorage.setItem("roll_no", roll_no);
 
-            // ✅ Redirect after login success
-            window.location.href = "/home";
+            // ✅ Redirect once the firewall/bandwidth grant has been applied
+            document.getElementById("error").innerText = "Connecting...";
+            waitForGrant(data.grant_job_id).then(status => {
+                if (status === "failed") {
+                    document.getElementById("error").innerText =
+                        "Signed in, but network access could not be enabled. Please try again.";
+                    return;
+                }
+                window.location.href = "/home";
+            });
         } else {
             document.getElementById("error").innerText = data.msg || "Invalid credentials";
         }
@@ -43,6 +53,45 @@ function loginUser() {
     });
 }
 
+// ✅ Poll the queued access grant until it finishes ("done", "failed" or "skipped")
+function waitForGrant(jobId) {
+    if (!jobId) {
+        return Promise.resolve("done");
+    }
+    const deadline = Date.now() + GRANT_STATUS_TIMEOUT_MS;
+
+    return new Promise(resolve => {
+        const poll = () => {
+            fetch(`/api/auth/grant-status/${encodeURIComponent(jobId)}`, { cache: "no-store" })
+            .then(res => {
+                // Unknown job: the server restarted or already pruned it, nothing left to wait for.
+                if (res.status === 404) {
+                    return { status: "done" };
+                }
+                return res.json();
+            })
+            .then(job => {
+                if (job.status === "done" || job.status === "failed" || job.status === "skipped") {
+                    resolve(job.status);
+                } else if (Date.now() >= deadline) {
+                    resolve("timeout");
+                } else {
+                    setTimeout(poll, GRANT_STATUS_POLL_MS);
+                }
+            })
+            .catch(err => {
+                console.error(err);
+                if (Date.now() >= deadline) {
+                    resolve("timeout");
+                } else {
+                    setTimeout(poll, GRANT_STATUS_POLL_MS);
+                }
+            });
+        };
+        poll();
+    });
+}
+
 // ✅ Logout function
 function logoutUser() {
     stopSessionGuard();
@@ -1,25 +1,38 @@
 #pip install pandas openpyxl xlrd
 
-from flask import Blueprint, request, jsonify, current_app as app
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app as app
 from werkzeug.security import check_password_hash, generate_password_hash
 from functools import wraps
 from pymongo import MongoClient
+from pymongo.errors import BulkWriteError
 import jwt, datetime
 from bson.objectid import ObjectId
 import pandas as pd
 import io
+import json
+import queue
 import threading
+import time
+import uuid
 import logging
 import re
-from linux_firewall_manager import update_firewall_rules, get_usage_counters_by_ip
+from linux_firewall_manager import get_usage_counters_by_ip
 from bandwidth_manager import (
     apply_bandwidth_for_active_users,
     assign_auto_bandwidth,
     get_bandwidth_presets,
+    get_bandwidth_reconcile_metrics,
     get_user_activity_snapshot,
     refresh_auto_bandwidth_profiles,
     resolve_effective_bandwidth,
 )
+from password_pool import hash_passwords
+from report_export import (
+    EXPORT_FORMATS,
+    build_audit_query,
+    parse_export_datetime,
+    stream_audit_export,
+)
 
 # [OK] MongoDB
 client = MongoClient("mongodb://localhost:27017/")
@@ -28,6 +41,7 @@ admins_collection = db['admins']
 users_collection = db['users']
 web_filter_collection = db['web_filter']
 notifications_collection = db['notifications']
+report_cache_collection = db['report_cache']
 logger = logging.getLogger(__name__)
 
 DEFAULT_ADMIN_TIMEOUT_HOURS = 2
@@ -35,12 +49,61 @@ DEFAULT_STUDENT_TIMEOUT_HOURS = 2
 MIN_TIMEOUT_HOURS = 1
 MAX_TIMEOUT_HOURS = 24
 FILTER_APPLY_TIMEOUT_SECONDS = 3
+LOGS_DEFAULT_PAGE_SIZE = 100
+LOGS_MAX_PAGE_SIZE = 500
+LOGS_PROJECTION = {
+    "timestamp": 1,
+    "roll_no": 1,
+    "client_ip": 1,
+    "app_name": 1,
+    "domain": 1,
+    "category": 1,
+}
+# India has no DST, so a fixed offset replaces per-row pytz conversion.
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30), "IST")
+BULK_UPLOAD_LOOKUP_CHUNK = 1000
+BULK_UPLOAD_INSERT_CHUNK = 500
+BULK_UPLOAD_HASH_CHUNK = 32
+BULK_UPLOAD_JOB_RETENTION_SECONDS = 3600
+REPORT_TYPES = ('Top Bandwidth Users', 'Blocked Site Activity', 'Full Network Audit')
+REPORT_RANGES = {
+    'daily': datetime.timedelta(days=1),
+    'weekly': datetime.timedelta(weeks=1),
+    'monthly': datetime.timedelta(days=30),
+}
+# Snapshot granularity per range; a report is "as of" the last boundary.
+REPORT_CACHE_BUCKET_SECONDS = {'daily': 15 * 60, 'weekly': 60 * 60, 'monthly': 6 * 60 * 60}
+REPORT_CACHE_PARTIAL_TTL_SECONDS = 60
+REPORT_CACHE_RETENTION = datetime.timedelta(days=35)
+DASHBOARD_STREAM_INTERVAL_SECONDS = 5
+DASHBOARD_STREAM_KEEPALIVE_SECONDS = 15
+DASHBOARD_STREAM_QUEUE_SIZE = 50
+# Stream tokens only open /admin/stream, so leaking one from a URL or access log is short-lived.
+DASHBOARD_STREAM_TOKEN_SECONDS = 60
 
 _filter_apply_state_lock = threading.Lock()
 _filter_apply_thread = None
 _filter_apply_pending = False
 _filter_apply_next_trigger = None
 _filter_apply_last_result = {}
+# Canonical hash / domain set of the blocklist last applied successfully (None until the first apply).
+_filter_applied_hash = None
+_filter_applied_domains = None
+_filter_applied_groups_hash = None
+
+_detection_log_indexes_ready = False
+
+_bulk_upload_jobs_lock = threading.Lock()
+_bulk_upload_jobs = {}
+
+_report_cache_lock = threading.Lock()
+_report_cache_thread = None
+_report_cache_indexes_ready = False
+
+_dashboard_stream_lock = threading.Lock()
+_dashboard_stream_thread = None
+_dashboard_stream_subscribers = set()
+_dashboard_stream_snapshot = {}
 
 
 def _parse_timeout_hours(value):
@@ -102,19 +165,35 @@ def admin_required(f):
         if 'Authorization' in request.headers:
             token = request.headers['Authorization'].split(" ")[1]
 
-        if not token:
-            return jsonify({"message": "Token missing"}), 401
+        error = _check_admin_token(token)
+        if error:
+            return error
 
-        try:
-            data = jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
-            if data.get("role") != "admin":
-                return jsonify({"message": "Unauthorized"}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+
+def _check_admin_token(token, scope=None):
+    """
+    Return an error response for a missing/invalid admin token, else None.
 
-        except Exception:
+    Session tokens carry no scope; a scoped token (e.g. "stream") is accepted
+    only where that scope is asked for.
+    """
+    if not token:
+        return jsonify({"message": "Token missing"}), 401
+
+    try:
+        data = jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
+        if data.get("role") != "admin":
+            return jsonify({"message": "Unauthorized"}), 403
+        if data.get("scope") != scope:
             return jsonify({"message": "Invalid or expired token"}), 401
 
-        return f(*args, **kwargs)
-    return decorated
+    except Exception:
+        return jsonify({"message": "Invalid or expired token"}), 401
+
+    return None
 
 admin_routes = Blueprint("admin_routes", __name__)
 
@@ -278,124 +357,129 @@ def admin_stats():
         "blocked_users": blocked_users
     }), 200
 
+def _compute_dashboard_stats():
+    """Compute the dashboard counters and traffic chart data."""
+    # Get active sessions collection
+    active_sessions_col = db['active_sessions'] if 'active_sessions' in db.list_collection_names() else None
+    detections_col = db['detections'] if 'detections' in db.list_collection_names() else None
+    blocked_users_col = db['blocked_users'] if 'blocked_users' in db.list_collection_names() else None
+
+    usage_by_ip = {}
+    try:
+        usage_by_ip = get_usage_counters_by_ip()
+    except Exception as usage_error:
+        logger.warning("Unable to read live usage counters for dashboard: %s", usage_error)
+    
+    # 1. Count active students (from active_sessions with status "active")
+    active_students = 0
+    if active_sessions_col is not None:
+        active_students = active_sessions_col.count_documents({"status": "active"})
+    
+    # 2. Calculate real total data usage from byte counters.
+    now = datetime.datetime.utcnow()
+    last_24h = now - datetime.timedelta(hours=24)
+
+    persisted_total_bytes = 0
+    users_cursor = users_collection.find(
+        {"role": {"$ne": "admin"}},
+        {"total_data_bytes": 1},
+    )
+    for user_doc in users_cursor:
+        persisted_total_bytes += _safe_non_negative_int(user_doc.get("total_data_bytes"))
+
+    live_session_bytes = 0
+    if active_sessions_col is not None and usage_by_ip:
+        active_sessions = active_sessions_col.find({"status": "active"}, {"client_ip": 1})
+        for session in active_sessions:
+            client_ip = str(session.get("client_ip") or "").strip()
+            if not client_ip:
+                continue
+            live_session_bytes += _safe_non_negative_int(
+                (usage_by_ip.get(client_ip) or {}).get("total_bytes")
+            )
+
+    total_data_gb = _bytes_to_gb(persisted_total_bytes + live_session_bytes)
+    
+    # 3. Count threats blocked in last 24 hours
+    threats_blocked = 0
+    if blocked_users_col is not None:
+        # Count blocks created in last 24h
+        threats_blocked += blocked_users_col.count_documents({
+            "blocked_at": {"$gte": last_24h}
+        })
+    
+    # Also count high-risk detections (proxy, vpn, adult, malware)
+    if detections_col is not None:
+        high_risk_categories = ['proxy', 'vpn', 'adult', 'malware']
+        threats_blocked += detections_col.count_documents({
+            "timestamp": {"$gte": last_24h},
+            "category": {"$in": high_risk_categories}
+        })
+    
+    # 4. Get recent traffic data for chart (last 10 data points, grouped by 2-minute intervals)
+    traffic_data = {
+        "labels": [],
+        "download": [],
+        "upload": []
+    }
+    
+    if detections_col is not None:
+        # Get detections from last 20 minutes, grouped by 2-minute intervals
+        last_20min = now - datetime.timedelta(minutes=20)
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": last_20min}}},
+            {"$group": {
+                "_id": {
+                    "$subtract": [
+                        {"$toLong": "$timestamp"},
+                        {"$mod": [{"$toLong": "$timestamp"}, 120000]}  # 2 minutes in ms
+                    ]
+                },
+                "count": {"$sum": 1}
+            }},
+            {"$sort": {"_id": 1}},
+            {"$limit": 10}
+        ]
+        
+        try:
+            results = list(detections_col.aggregate(pipeline))
+            for r in results:
+                # Convert timestamp to IST time string
+                ts = datetime.datetime.fromtimestamp(r["_id"] / 1000.0)
+                time_str = ts.strftime('%H:%M:%S')
+                traffic_data["labels"].append(time_str)
+                # Simulate download/upload based on detection count
+                download_kb = r["count"] * 50  # Approx 50 KB per detection
+                upload_kb = r["count"] * 15    # Upload is typically less
+                traffic_data["download"].append(download_kb)
+                traffic_data["upload"].append(upload_kb)
+        except Exception as e:
+            print(f"Error aggregating traffic data: {e}")
+            # Fallback to empty data
+            pass
+    
+    # If no traffic data, provide at least one point to avoid empty chart
+    if len(traffic_data["labels"]) == 0:
+        current_time = datetime.datetime.now().strftime('%H:%M:%S')
+        traffic_data["labels"] = [current_time]
+        traffic_data["download"] = [0]
+        traffic_data["upload"] = [0]
+    
+    return {
+        "active_students": active_students,
+        "total_data_gb": total_data_gb,
+        "threats_blocked": threats_blocked,
+        "traffic_data": traffic_data
+    }
+
+
 @admin_routes.route("/admin/dashboard/stats", methods=["GET"])
 @admin_required
 def dashboard_stats():
     """Get real-time dashboard statistics"""
     try:
-        # Get active sessions collection
-        active_sessions_col = db['active_sessions'] if 'active_sessions' in db.list_collection_names() else None
-        detections_col = db['detections'] if 'detections' in db.list_collection_names() else None
-        blocked_users_col = db['blocked_users'] if 'blocked_users' in db.list_collection_names() else None
+        return jsonify(_compute_dashboard_stats()), 200
 
-        usage_by_ip = {}
-        try:
-            usage_by_ip = get_usage_counters_by_ip()
-        except Exception as usage_error:
-            logger.warning("Unable to read live usage counters for dashboard: %s", usage_error)
-        
-        # 1. Count active students (from active_sessions with status "active")
-        active_students = 0
-        if active_sessions_col is not None:
-            active_students = active_sessions_col.count_documents({"status": "active"})
-        
-        # 2. Calculate real total data usage from byte counters.
-        now = datetime.datetime.utcnow()
-        last_24h = now - datetime.timedelta(hours=24)
-
-        persisted_total_bytes = 0
-        users_cursor = users_collection.find(
-            {"role": {"$ne": "admin"}},
-            {"total_data_bytes": 1},
-        )
-        for user_doc in users_cursor:
-            persisted_total_bytes += _safe_non_negative_int(user_doc.get("total_data_bytes"))
-
-        live_session_bytes = 0
-        if active_sessions_col is not None and usage_by_ip:
-            active_sessions = active_sessions_col.find({"status": "active"}, {"client_ip": 1})
-            for session in active_sessions:
-                client_ip = str(session.get("client_ip") or "").strip()
-                if not client_ip:
-                    continue
-                live_session_bytes += _safe_non_negative_int(
-                    (usage_by_ip.get(client_ip) or {}).get("total_bytes")
-                )
-
-        total_data_gb = _bytes_to_gb(persisted_total_bytes + live_session_bytes)
-        
-        # 3. Count threats blocked in last 24 hours
-        threats_blocked = 0
-        if blocked_users_col is not None:
-            # Count blocks created in last 24h
-            threats_blocked += blocked_users_col.count_documents({
-                "blocked_at": {"$gte": last_24h}
-            })
-        
-        # Also count high-risk detections (proxy, vpn, adult, malware)
-        if detections_col is not None:
-            high_risk_categories = ['proxy', 'vpn', 'adult', 'malware']
-            threats_blocked += detections_col.count_documents({
-                "timestamp": {"$gte": last_24h},
-                "category": {"$in": high_risk_categories}
-            })
-        
-        # 4. Get recent traffic data for chart (last 10 data points, grouped by 2-minute intervals)
-        traffic_data = {
-            "labels": [],
-            "download": [],
-            "upload": []
-        }
-        
-        if detections_col is not None:
-            # Get detections from last 20 minutes, grouped by 2-minute intervals
-            last_20min = now - datetime.timedelta(minutes=20)
-            pipeline = [
-                {"$match": {"timestamp": {"$gte": last_20min}}},
-                {"$group": {
-                    "_id": {
-                        "$subtract": [
-                            {"$toLong": "$timestamp"},
-                            {"$mod": [{"$toLong": "$timestamp"}, 120000]}  # 2 minutes in ms
-                        ]
-                    },
-                    "count": {"$sum": 1}
-                }},
-                {"$sort": {"_id": 1}},
-                {"$limit": 10}
-            ]
-            
-            try:
-                results = list(detections_col.aggregate(pipeline))
-                for r in results:
-                    # Convert timestamp to IST time string
-                    ts = datetime.datetime.fromtimestamp(r["_id"] / 1000.0)
-                    time_str = ts.strftime('%H:%M:%S')
-                    traffic_data["labels"].append(time_str)
-                    # Simulate download/upload based on detection count
-                    download_kb = r["count"] * 50  # Approx 50 KB per detection
-                    upload_kb = r["count"] * 15    # Upload is typically less
-                    traffic_data["download"].append(download_kb)
-                    traffic_data["upload"].append(upload_kb)
-            except Exception as e:
-                print(f"Error aggregating traffic data: {e}")
-                # Fallback to empty data
-                pass
-        
-        # If no traffic data, provide at least one point to avoid empty chart
-        if len(traffic_data["labels"]) == 0:
-            current_time = datetime.datetime.now().strftime('%H:%M:%S')
-            traffic_data["labels"] = [current_time]
-            traffic_data["download"] = [0]
-            traffic_data["upload"] = [0]
-        
-        return jsonify({
-            "active_students": active_students,
-            "total_data_gb": total_data_gb,
-            "threats_blocked": threats_blocked,
-            "traffic_data": traffic_data
-        }), 200
-        
     except Exception as e:
         print(f"Error in dashboard_stats: {e}")
         return jsonify({
@@ -783,6 +867,16 @@ def admin_update_client(id):
         if ut in ('student', 'faculty'):
             updates['user_type'] = ut
 
+    # Filter group override (e.g. a section); empty clears it back to user_type.
+    if 'policy_group' in data:
+        from filter_groups import normalize_group_name
+
+        policy_group = normalize_group_name(data['policy_group'])
+        if policy_group:
+            updates['policy_group'] = policy_group
+        else:
+            unset_fields['policy_group'] = ""
+
     if 'password' in data and isinstance(data['password'], str) and data['password'].strip():
         updates['password'] = generate_password_hash(data['password'].strip())
 
@@ -890,6 +984,20 @@ def admin_update_client(id):
     auto_recommendation = None
     auto_warning = None
 
+    # Move a logged-in user's IP to its new filter group (a set add, no rule rebuild).
+    if ('policy_group' in data or 'user_type' in updates) and roll_no_for_update:
+        try:
+            from filter_groups import assign_clients_to_groups
+
+            sessions = db['active_sessions'].find(
+                {"roll_no": roll_no_for_update, "status": "active"}, {"client_ip": 1}
+            )
+            clients = {s["client_ip"]: roll_no_for_update for s in sessions if s.get("client_ip")}
+            if clients:
+                assign_clients_to_groups(clients)
+        except Exception as error:
+            logger.warning("Filter group reassignment failed for %s: %s", roll_no_for_update, error)
+
     # AUTO mode: detect activity and assign tier immediately
     if updates.get('bandwidth_limit') == 'auto' and roll_no_for_update:
         try:
@@ -1017,179 +1125,829 @@ def admin_refresh_auto_bandwidth():
     return jsonify(result), 200
 
 
-@admin_routes.route('/admin/logs', methods=['GET'])
+@admin_routes.route('/admin/bandwidth/reconcile-metrics', methods=['GET'])
 @admin_required
-def admin_logs():
-    """Return network activity logs from the detections collection"""
-    import pytz
-    
-    logs = []
-    
-    # Get detections from the detections collection
-    if 'detections' in db.list_collection_names():
-        detections_cursor = db['detections'].find().sort([('timestamp', -1)]).limit(100)
-        
-        # Setup IST timezone
-        ist = pytz.timezone('Asia/Kolkata')
-        
-        for d in detections_cursor:
-            # Format timestamp with timezone conversion
-            ts = d.get('timestamp')
-            if ts:
-                if hasattr(ts, 'strftime'):
-                    # Convert UTC to IST
-                    if ts.tzinfo is None:
-                        # Assume UTC if naive datetime
-                        ts_utc = pytz.utc.localize(ts)
-                    else:
-                        ts_utc = ts
-                    
-                    # Convert to IST
-                    ts_ist = ts_utc.astimezone(ist)
-                    time_str = ts_ist.strftime('%I:%M:%S %p')
-                else:
-                    time_str = str(ts)
+def admin_bandwidth_reconcile_metrics():
+    """Coalescing stats for bandwidth reconcile runs (requests vs. actual tc rebuilds)."""
+    return jsonify(get_bandwidth_reconcile_metrics()), 200
+
+
+def _format_detection_log(d, ist=IST):
+    """Shape one detection document as an admin log row."""
+    # Format timestamp with timezone conversion
+    ts = d.get('timestamp')
+    if ts:
+        if hasattr(ts, 'strftime'):
+            # Convert UTC to IST
+            if ts.tzinfo is None:
+                # Assume UTC if naive datetime
+                ts_utc = ts.replace(tzinfo=datetime.timezone.utc)
             else:
-                time_str = 'N/A'
+                ts_utc = ts
             
-            # Determine log level based on category
-            category = d.get('category', 'general').lower()
-            if category in ('proxy', 'vpn', 'adult', 'malware'):
-                level = 'error'
-            elif category in ('gaming', 'streaming', 'social'):
-                level = 'warn'
-            else:
-                level = 'info'
-            
-            logs.append({
-                '_id': str(d.get('_id')),
-                'time': time_str,
-                'level': level,
-                'user': d.get('roll_no', 'Unknown'),
-                'ip': d.get('client_ip', 'N/A'),
-                'action': d.get('app_name', 'Unknown'),  # Show just the app name
-                'domain': d.get('domain'),
-                'category': d.get('category', 'general'),
-                'app_name': d.get('app_name', 'Unknown')
-            })
+            # Convert to IST
+            ts_ist = ts_utc.astimezone(ist)
+            time_str = ts_ist.strftime('%I:%M:%S %p')
+        else:
+            time_str = str(ts)
+    else:
+        time_str = 'N/A'
     
-    return jsonify({"logs": logs}), 200
+    # Determine log level based on category
+    category = (d.get('category') or 'general').lower()
+    if category in ('proxy', 'vpn', 'adult', 'malware'):
+        level = 'error'
+    elif category in ('gaming', 'streaming', 'social'):
+        level = 'warn'
+    else:
+        level = 'info'
+    
+    return {
+        '_id': str(d.get('_id')),
+        'time': time_str,
+        'level': level,
+        'user': d.get('roll_no', 'Unknown'),
+        'ip': d.get('client_ip', 'N/A'),
+        'action': d.get('app_name', 'Unknown'),  # Show just the app name
+        'domain': d.get('domain'),
+        'category': d.get('category', 'general'),
+        'app_name': d.get('app_name', 'Unknown')
+    }
+
+
+def _ensure_detection_log_indexes():
+    """Create the indexes the paginated logs queries rely on (once per process)."""
+    global _detection_log_indexes_ready
+    if _detection_log_indexes_ready:
+        return
+
+    detections_col = db['detections']
+    try:
+        # Sort keys first, then every projected field so pages are covered.
+        detections_col.create_index(
+            [
+                ("timestamp", -1),
+                ("_id", -1),
+                ("roll_no", 1),
+                ("category", 1),
+                ("domain", 1),
+                ("client_ip", 1),
+                ("app_name", 1),
+            ],
+            name="logs_page_covered",
+        )
+        # Selective per-student lookups.
+        detections_col.create_index(
+            [("roll_no", 1), ("timestamp", -1), ("_id", -1)],
+            name="logs_roll_no_page",
+        )
+        _detection_log_indexes_ready = True
+    except Exception as e:
+        logger.warning("Unable to create detection log indexes: %s", e)
+
+
+def _encode_log_cursor(doc):
+    ts = doc.get('timestamp')
+    if not isinstance(ts, datetime.datetime):
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    millis = int((ts - datetime.datetime(1970, 1, 1)) // datetime.timedelta(milliseconds=1))
+    return f"{millis}_{doc.get('_id')}"
+
+
+def _decode_log_cursor(value):
+    """Parse '<epoch_ms>_<objectid>' into (timestamp, ObjectId); raise ValueError if invalid."""
+    millis_text, _, oid_text = str(value or "").partition("_")
+    try:
+        timestamp = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=int(millis_text))
+        return timestamp, ObjectId(oid_text)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _build_logs_query(args):
+    query = {}
+
+    roll_no = (args.get('roll_no') or '').strip()
+    if roll_no:
+        query['roll_no'] = roll_no
+
+    category = (args.get('category') or '').strip().lower()
+    if category:
+        query['category'] = category
+
+    domain_prefix = (args.get('domain') or '').strip().lower()
+    if domain_prefix:
+        # Anchored, case-sensitive prefix regexes can use the index bounds.
+        query['domain'] = {"$regex": f"^{re.escape(domain_prefix)}"}
+
+    return query
+
+
+@admin_routes.route('/admin/logs', methods=['GET'])
+@admin_required
+def admin_logs():
+    """
+    Return network activity logs from the detections collection.
+
+    Query params: limit, before/after (cursor from a previous page),
+    roll_no, category, domain (prefix).
+    """
+    try:
+        limit = int(request.args.get('limit', LOGS_DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({"message": "limit must be a number"}), 400
+    limit = max(1, min(LOGS_MAX_PAGE_SIZE, limit))
+
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        return jsonify({"message": "Use either before or after, not both"}), 400
+
+    query = _build_logs_query(request.args)
+    sort_direction = -1
+
+    try:
+        if before:
+            ts, oid = _decode_log_cursor(before)
+            query['$or'] = [{"timestamp": {"$lt": ts}}, {"timestamp": ts, "_id": {"$lt": oid}}]
+        elif after:
+            ts, oid = _decode_log_cursor(after)
+            query['$or'] = [{"timestamp": {"$gt": ts}}, {"timestamp": ts, "_id": {"$gt": oid}}]
+            sort_direction = 1
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    _ensure_detection_log_indexes()
+
+    # Fetch one extra row to know whether another page exists.
+    docs = list(
+        db['detections']
+        .find(query, LOGS_PROJECTION)
+        .sort([('timestamp', sort_direction), ('_id', sort_direction)])
+        .limit(limit + 1)
+    )
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if sort_direction == 1:
+        docs.reverse()
+
+    logs = [_format_detection_log(d) for d in docs]
+
+    return jsonify({
+        "logs": logs,
+        "next_cursor": _encode_log_cursor(docs[-1]) if docs else None,
+        "prev_cursor": _encode_log_cursor(docs[0]) if docs else None,
+        "has_more": has_more if not after else bool(docs),
+        "has_newer": has_more if after else bool(before),
+    }), 200
+
+
+# ========================================
+# LIVE DASHBOARD STREAM (Server-Sent Events)
+# ========================================
+
+def _format_sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+
+def _publish_dashboard_event(event, payload, snapshot=None):
+    """Fan out one event to every connected admin tab."""
+    message = _format_sse(event, payload)
+    with _dashboard_stream_lock:
+        _dashboard_stream_snapshot[event] = payload if snapshot is None else snapshot
+        subscribers = list(_dashboard_stream_subscribers)
+
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            # Slow tab: drop this update, the next one carries fresh values.
+            pass
+
+
+def _dashboard_stream_worker():
+    """
+    Single producer for all admin tabs: runs the dashboard queries once per
+    interval and publishes only what changed.
+    """
+    global _dashboard_stream_thread
+
+    last_stats = None
+    last_count = None
+    last_detection_id = None
+    recent_logs = []
+
+    while True:
+        with _dashboard_stream_lock:
+            if not _dashboard_stream_subscribers:
+                _dashboard_stream_thread = None
+                return
+
+        try:
+            stats = _compute_dashboard_stats()
+            if stats != last_stats:
+                last_stats = stats
+                _publish_dashboard_event("stats", stats)
+        except Exception as e:
+            logger.warning("Dashboard stream stats failed: %s", e)
+
+        try:
+            query = {"_id": {"$gt": last_detection_id}} if last_detection_id is not None else {}
+            new_detections = list(
+                db['detections'].find(query, LOGS_PROJECTION).sort([('_id', -1)]).limit(5)
+            )
+            if new_detections:
+                last_detection_id = new_detections[0]['_id']
+                new_logs = [_format_detection_log(d) for d in new_detections]
+                recent_logs = (new_logs + recent_logs)[:5]
+                _publish_dashboard_event("logs", {"logs": new_logs}, snapshot={"logs": recent_logs})
+        except Exception as e:
+            logger.warning("Dashboard stream logs failed: %s", e)
+
+        try:
+            count = notifications_collection.count_documents({"read": False})
+            if count != last_count:
+                last_count = count
+                _publish_dashboard_event("notifications", {"count": count})
+        except Exception as e:
+            logger.warning("Dashboard stream notifications failed: %s", e)
+
+        time.sleep(DASHBOARD_STREAM_INTERVAL_SECONDS)
+
+
+def _subscribe_dashboard_stream():
+    global _dashboard_stream_thread
+
+    subscriber = queue.Queue(maxsize=DASHBOARD_STREAM_QUEUE_SIZE)
+    with _dashboard_stream_lock:
+        # Replay the latest known state so a new tab renders immediately.
+        for event, payload in _dashboard_stream_snapshot.items():
+            subscriber.put_nowait(_format_sse(event, payload))
+
+        _dashboard_stream_subscribers.add(subscriber)
+        if _dashboard_stream_thread is None or not _dashboard_stream_thread.is_alive():
+            _dashboard_stream_snapshot.clear()
+            _dashboard_stream_thread = threading.Thread(target=_dashboard_stream_worker, daemon=True)
+            _dashboard_stream_thread.start()
+
+    return subscriber
+
+
+def _unsubscribe_dashboard_stream(subscriber):
+    with _dashboard_stream_lock:
+        _dashboard_stream_subscribers.discard(subscriber)
+
+
+@admin_routes.route('/admin/stream-token', methods=['POST'])
+@admin_required
+def admin_dashboard_stream_token():
+    """Issue a short-lived token that can only open /admin/stream."""
+    token = request.headers['Authorization'].split(" ")[1]
+    payload = jwt.decode(token, app.config["SECRET_KEY"], algorithms=["HS256"])
+    stream_token = jwt.encode({
+        "username": payload.get("username"),
+        "role": "admin",
+        "scope": "stream",
+        "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=DASHBOARD_STREAM_TOKEN_SECONDS),
+    }, app.config["SECRET_KEY"], algorithm="HS256")
+    return jsonify({"stream_token": stream_token, "expires_in": DASHBOARD_STREAM_TOKEN_SECONDS})
+
+
+@admin_routes.route('/admin/stream', methods=['GET'])
+def admin_dashboard_stream():
+    """Push dashboard stats, new detections and notification counts via SSE."""
+    # EventSource cannot send headers: it authenticates with a stream-scoped
+    # token in the query string, never with the admin session token.
+    if 'Authorization' in request.headers:
+        error = _check_admin_token(request.headers['Authorization'].split(" ")[-1])
+    else:
+        error = _check_admin_token(request.args.get('stream_token'), scope="stream")
+    if error:
+        return error
+
+    subscriber = _subscribe_dashboard_stream()
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=DASHBOARD_STREAM_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            _unsubscribe_dashboard_stream(subscriber)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+def _usage_bytes_by_user(start_date, end_date=None, include_live=True):
+    """Bytes per student in [start_date, end_date): daily rollups plus not-yet-synced live counters."""
+    start_day = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    day_match = {"$gte": start_day}
+    if end_date is not None:
+        day_match["$lt"] = end_date
+    bytes_by_user = {}
+    for r in db['usage_daily'].aggregate([
+        {"$match": {"day": day_match}},
+        {"$group": {"_id": "$roll_no", "bytes": {"$sum": "$total_bytes"}}},
+    ]):
+        if r.get('_id'):
+            bytes_by_user[r['_id']] = _safe_non_negative_int(r.get('bytes'))
+
+    if not include_live:
+        return bytes_by_user
+
+    try:
+        usage_by_ip = get_usage_counters_by_ip() or {}
+    except Exception as e:
+        logger.warning("Failed to read live usage counters for report: %s", e)
+        usage_by_ip = {}
+
+    if usage_by_ip:
+        active_sessions = db['active_sessions'].find(
+            {"status": "active"},
+            {"roll_no": 1, "client_ip": 1, "usage_accounted_upload_bytes": 1, "usage_accounted_download_bytes": 1},
+        )
+        for session in active_sessions:
+            roll_no = session.get('roll_no')
+            live = usage_by_ip.get(str(session.get('client_ip') or '').strip()) or {}
+            if not roll_no or not live:
+                continue
+            accounted = (
+                _safe_non_negative_int(session.get('usage_accounted_upload_bytes'))
+                + _safe_non_negative_int(session.get('usage_accounted_download_bytes'))
+            )
+            current = _safe_non_negative_int(live.get('total_bytes'))
+            # Counters reset on re-login, so anything below the accounted mark is all new.
+            pending = current - accounted if current >= accounted else current
+            if pending > 0:
+                bytes_by_user[roll_no] = bytes_by_user.get(roll_no, 0) + pending
+
+    return bytes_by_user
+
+
+def _top_domains_by_user(detections_col, time_match, roll_nos=None, limit=None):
+    """Request count and most-requested domain per student, computed in MongoDB."""
+    match = {"timestamp": time_match}
+    if roll_nos is not None:
+        match["roll_no"] = {"$in": list(roll_nos)}
+
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": {"roll_no": "$roll_no", "domain": "$domain"}, "count": {"$sum": 1}}},
+        {"$sort": {"_id.roll_no": 1, "count": -1}},
+        {"$group": {
+            "_id": "$_id.roll_no",
+            "requests": {"$sum": "$count"},
+            "top_domain": {"$first": "$_id.domain"},
+        }},
+    ]
+    if limit:
+        pipeline += [{"$sort": {"requests": -1}}, {"$limit": limit}]
+    return list(detections_col.aggregate(pipeline, allowDiskUse=True))
+
+
+def _top_bandwidth_users_rows(detections_col, start_date, end_date=None, include_live=True, limit=10):
+    time_match = {"$gte": start_date}
+    if end_date is not None:
+        time_match["$lt"] = end_date
+    bytes_by_user = _usage_bytes_by_user(start_date, end_date, include_live=include_live)
+
+    if bytes_by_user:
+        ranked = sorted(bytes_by_user.items(), key=lambda item: item[1], reverse=True)[:limit]
+        activity = {
+            r['_id']: r
+            for r in _top_domains_by_user(detections_col, time_match, roll_nos=[roll_no for roll_no, _ in ranked])
+        }
+    else:
+        # No byte counters yet (e.g. before the first sync): fall back to request counts.
+        activity_rows = _top_domains_by_user(detections_col, time_match, limit=limit)
+        ranked = [(r['_id'], 0) for r in activity_rows]
+        activity = {r['_id']: r for r in activity_rows}
+
+    rows = []
+    for i, (roll_no, byte_count) in enumerate(ranked):
+        r = activity.get(roll_no) or {}
+        rows.append([
+            f"#{i+1}",
+            roll_no or 'Unknown',
+            f"{_bytes_to_gb(byte_count):.3f}",
+            str(r.get('requests', 0)),
+            r.get('top_domain') or 'N/A'
+        ])
+    return rows
+
+
+def _build_report(report_type, time_range, end_date, include_live=False):
+    """Compute one report over the REPORT_RANGES window that ends at end_date."""
+    detections_col = db['detections']
+    start_date = end_date - REPORT_RANGES.get(time_range, REPORT_RANGES['monthly'])
+    time_match = {"$gte": start_date, "$lt": end_date}
+
+    headers = []
+    rows = []
+
+    if report_type == 'Top Bandwidth Users':
+        headers = ['Rank', 'Student ID', 'Data Used (GB)', 'Requests Count', 'Top Domain']
+        rows = _top_bandwidth_users_rows(detections_col, start_date, end_date, include_live=include_live)
+
+    elif report_type == 'Blocked Site Activity':
+        headers = ['Domain', 'Category', 'Access Count', 'Users']
+
+        # Aggregate by domain and category
+        pipeline = [
+            {"$match": {"timestamp": time_match}},
+            {"$group": {
+                "_id": {"domain": "$domain", "category": "$category"},
+                "count": {"$sum": 1},
+                "users": {"$addToSet": "$roll_no"}
+            }},
+            {"$sort": {"count": -1}},
+            {"$limit": 20}
+        ]
+        results = list(detections_col.aggregate(pipeline, allowDiskUse=True))
+
+        for r in results:
+            domain = r.get('_id', {}).get('domain', 'Unknown')
+            category = r.get('_id', {}).get('category', 'general')
+            users = r.get('users', [])
+            rows.append([
+                domain,
+                category,
+                str(r.get('count', 0)),
+                ', '.join(users[:3]) + ('...' if len(users) > 3 else '')
+            ])
+
+    elif report_type == 'Full Network Audit':
+        headers = ['Time', 'Student', 'IP', 'Domain', 'Category']
+
+        # Get recent detections (the complete audit is served by /admin/reports/audit-export)
+        detections = list(detections_col.find(
+            {"timestamp": time_match}
+        ).sort([("timestamp", -1)]).limit(50))
+
+        for d in detections:
+            ts = d.get('timestamp')
+            time_str = ts.strftime('%Y-%m-%d %H:%M') if hasattr(ts, 'strftime') else str(ts)[:16]
+            rows.append([
+                time_str,
+                d.get('roll_no', 'Unknown'),
+                d.get('client_ip', 'N/A'),
+                d.get('domain', 'N/A'),
+                d.get('category', 'general')
+            ])
+
+    return {
+        "headers": headers,
+        "data": rows,
+        "title": f"{time_range.capitalize()} {report_type}",
+    }
+
+
+# ========================================
+# REPORT CACHE
+# ========================================
+
+def _report_bucket_end(time_range, now, partial=False):
+    """Align now to the range's bucket grid (floor for complete buckets, ceil for the partial one)."""
+    bucket_seconds = REPORT_CACHE_BUCKET_SECONDS.get(time_range, REPORT_CACHE_BUCKET_SECONDS['monthly'])
+    epoch = datetime.datetime(1970, 1, 1)
+    elapsed = int((now - epoch).total_seconds())
+    aligned = elapsed - (elapsed % bucket_seconds)
+    if partial and aligned != elapsed:
+        aligned += bucket_seconds
+    return epoch + datetime.timedelta(seconds=aligned)
+
+
+def _ensure_report_cache_indexes():
+    global _report_cache_indexes_ready
+    if _report_cache_indexes_ready:
+        return
+    try:
+        report_cache_collection.create_index(
+            [("type", 1), ("range", 1), ("bucket_end", -1)],
+            unique=True,
+            name="report_cache_key",
+        )
+        report_cache_collection.create_index("expires_at", expireAfterSeconds=0, name="report_cache_ttl")
+        _report_cache_indexes_ready = True
+    except Exception as e:
+        logger.warning("Unable to create report cache indexes: %s", e)
+
+
+def _store_report_snapshot(report_type, time_range, bucket_end, report, partial):
+    now = datetime.datetime.utcnow()
+    doc = dict(report)
+    doc.update({
+        "type": report_type,
+        "range": time_range,
+        "bucket_end": bucket_end,
+        "partial": partial,
+        "computed_at": now,
+        "generated_at": now.isoformat(),
+        "expires_at": bucket_end + REPORT_CACHE_RETENTION,
+    })
+    report_cache_collection.replace_one(
+        {"type": report_type, "range": time_range, "bucket_end": bucket_end},
+        doc,
+        upsert=True,
+    )
+    return doc
+
+
+def _get_cached_report(report_type, time_range, live=False):
+    """
+    Serve a report from report_cache, computing it on a miss.
+
+    Completed buckets are immutable snapshots; only the current partial
+    bucket (live=True) is ever recomputed, once its short TTL lapses.
+    """
+    _ensure_report_cache_indexes()
+    now = datetime.datetime.utcnow()
+    bucket_end = _report_bucket_end(time_range, now, partial=live)
+    key = {"type": report_type, "range": time_range, "bucket_end": bucket_end}
+    if not live:
+        # A live snapshot of this bucket may still be stored; only a finalized one will do.
+        key["partial"] = False
+
+    cached = report_cache_collection.find_one(key)
+    if cached:
+        fresh_enough = (
+            not cached.get("partial")
+            or now - cached.get("computed_at", now) < datetime.timedelta(seconds=REPORT_CACHE_PARTIAL_TTL_SECONDS)
+        )
+        if fresh_enough:
+            return cached, True
+
+    if live:
+        report = _build_report(report_type, time_range, now, include_live=True)
+        return _store_report_snapshot(report_type, time_range, bucket_end, report, partial=True), False
+
+    report = _build_report(report_type, time_range, bucket_end)
+    return _store_report_snapshot(report_type, time_range, bucket_end, report, partial=False), False
+
+
+def _refresh_report_snapshots(now=None):
+    """Finalize the just-completed bucket of every (type, range) and drop its partial entry."""
+    now = now or datetime.datetime.utcnow()
+    refreshed = 0
+    for time_range in REPORT_RANGES:
+        bucket_end = _report_bucket_end(time_range, now)
+        for report_type in REPORT_TYPES:
+            key = {"type": report_type, "range": time_range, "bucket_end": bucket_end}
+            if report_cache_collection.find_one(dict(key, partial=False), {"_id": 1}):
+                continue
+            try:
+                report = _build_report(report_type, time_range, bucket_end)
+                _store_report_snapshot(report_type, time_range, bucket_end, report, partial=False)
+                refreshed += 1
+            except Exception as e:
+                logger.warning("Failed to precompute %s %s report: %s", time_range, report_type, e)
+    return refreshed
+
+
+def _report_cache_worker():
+    _ensure_report_cache_indexes()
+    while True:
+        try:
+            _refresh_report_snapshots()
+        except Exception as e:
+            logger.warning("Report cache refresh failed: %s", e)
+
+        # Sleep until the nearest bucket boundary across all ranges.
+        now = datetime.datetime.utcnow()
+        next_boundary = min(
+            _report_bucket_end(time_range, now) + datetime.timedelta(seconds=REPORT_CACHE_BUCKET_SECONDS[time_range])
+            for time_range in REPORT_RANGES
+        )
+        time.sleep(max(1.0, (next_boundary - now).total_seconds() + 1))
+
+
+def _ensure_report_cache_worker():
+    global _report_cache_thread
+    with _report_cache_lock:
+        if _report_cache_thread is not None and _report_cache_thread.is_alive():
+            return
+        _report_cache_thread = threading.Thread(
+            target=_report_cache_worker,
+            name="report-cache-worker",
+            daemon=True,
+        )
+        _report_cache_thread.start()
 
 
 @admin_routes.route('/admin/reports', methods=['POST'])
 @admin_required
 def admin_reports():
-    """Generate reports from real detection data"""
+    """Serve reports from precomputed snapshots of real detection data"""
     data = request.get_json() or {}
     report_type = data.get('type', 'Top Bandwidth Users')
     time_range = data.get('range', 'weekly')
-    
+    live = bool(data.get('live'))
+
+    if report_type not in REPORT_TYPES:
+        return jsonify({"error": f"Unknown report type: {report_type}", "headers": [], "data": []}), 400
+    if time_range not in REPORT_RANGES:
+        time_range = 'monthly'
+
     try:
-        detections_col = db['detections'] if 'detections' in db.list_collection_names() else None
-        
-        # Calculate time filter based on range
-        now = datetime.datetime.utcnow()
-        if time_range == 'daily':
-            start_date = now - datetime.timedelta(days=1)
-        elif time_range == 'weekly':
-            start_date = now - datetime.timedelta(weeks=1)
-        else:  # monthly
-            start_date = now - datetime.timedelta(days=30)
-        
-        headers = []
-        rows = []
-        
-        if report_type == 'Top Bandwidth Users':
-            headers = ['Rank', 'Student ID', 'Requests Count', 'Top Domain']
-            
-            if detections_col is not None:
-                # Aggregate detections by roll_no
-                pipeline = [
-                    {"$match": {"timestamp": {"$gte": start_date}}},
-                    {"$group": {
-                        "_id": "$roll_no",
-                        "count": {"$sum": 1},
-                        "domains": {"$push": "$domain"}
-                    }},
-                    {"$sort": {"count": -1}},
-                    {"$limit": 10}
-                ]
-                results = list(detections_col.aggregate(pipeline))
-                
-                for i, r in enumerate(results):
-                    # Find most common domain
-                    domains = r.get('domains', [])
-                    top_domain = max(set(domains), key=domains.count) if domains else 'N/A'
-                    rows.append([
-                        f"#{i+1}",
-                        r.get('_id', 'Unknown'),
-                        str(r.get('count', 0)),
-                        top_domain
-                    ])
-        
-        elif report_type == 'Blocked Site Activity':
-            headers = ['Domain', 'Category', 'Access Count', 'Users']
-            
-            if detections_col is not None:
-                # Aggregate by domain and category
-                pipeline = [
-                    {"$match": {"timestamp": {"$gte": start_date}}},
-                    {"$group": {
-                        "_id": {"domain": "$domain", "category": "$category"},
-                        "count": {"$sum": 1},
-                        "users": {"$addToSet": "$roll_no"}
-                    }},
-                    {"$sort": {"count": -1}},
-                    {"$limit": 20}
-                ]
-                results = list(detections_col.aggregate(pipeline))
-                
-                for r in results:
-                    domain = r.get('_id', {}).get('domain', 'Unknown')
-                    category = r.get('_id', {}).get('category', 'general')
-                    users = r.get('users', [])
-                    rows.append([
-                        domain,
-                        category,
-                        str(r.get('count', 0)),
-                        ', '.join(users[:3]) + ('...' if len(users) > 3 else '')
-                    ])
-        
-        elif report_type == 'Full Network Audit':
-            headers = ['Time', 'Student', 'IP', 'Domain', 'Category']
-            
-            if detections_col is not None:
-                # Get recent detections
-                detections = list(detections_col.find(
-                    {"timestamp": {"$gte": start_date}}
-                ).sort([("timestamp", -1)]).limit(50))
-                
-                for d in detections:
-                    ts = d.get('timestamp')
-                    time_str = ts.strftime('%Y-%m-%d %H:%M') if hasattr(ts, 'strftime') else str(ts)[:16]
-                    rows.append([
-                        time_str,
-                        d.get('roll_no', 'Unknown'),
-                        d.get('client_ip', 'N/A'),
-                        d.get('domain', 'N/A'),
-                        d.get('category', 'general')
-                    ])
-        
+        _ensure_report_cache_worker()
+        report, cache_hit = _get_cached_report(report_type, time_range, live=live)
+
         return jsonify({
-            "headers": headers,
-            "data": rows,
-            "title": f"{time_range.capitalize()} {report_type}",
-            "generated_at": now.isoformat()
+            "headers": report.get("headers", []),
+            "data": report.get("data", []),
+            "title": report.get("title") or f"{time_range.capitalize()} {report_type}",
+            "generated_at": report.get("generated_at"),
+            "as_of": report["bucket_end"].isoformat() if not report.get("partial") else report.get("generated_at"),
+            "cached": cache_hit,
         }), 200
         
     except Exception as e:
         print(f"Error generating report: {e}")
         return jsonify({"error": str(e), "headers": [], "data": []}), 500
 
+
+@admin_routes.route('/admin/reports/audit-export', methods=['GET'])
+@admin_required
+def admin_audit_export():
+    """
+    Stream the full network audit as CSV or NDJSON.
+
+    Query params: format (csv|ndjson), start/end (ISO dates, UTC) or
+    range (daily|weekly|monthly), roll_no, category, gzip (1 to compress).
+    """
+    export_format = (request.args.get('format') or 'csv').strip().lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"message": "format must be csv or ndjson"}), 400
+
+    try:
+        start = parse_export_datetime(request.args.get('start'))
+        end = parse_export_datetime(request.args.get('end'))
+    except ValueError as e:
+        return jsonify({"message": str(e)}), 400
+
+    if start is None:
+        range_days = {'daily': 1, 'weekly': 7, 'monthly': 30}.get(
+            (request.args.get('range') or 'monthly').strip().lower(), 30
+        )
+        start = datetime.datetime.utcnow() - datetime.timedelta(days=range_days)
+
+    query = build_audit_query(
+        start=start,
+        end=end,
+        roll_no=(request.args.get('roll_no') or '').strip() or None,
+        category=(request.args.get('category') or '').strip() or None,
+    )
+    compress = (request.args.get('gzip') or '').strip().lower() in ('1', 'true', 'yes')
+
+    _ensure_detection_log_indexes()
+
+    filename = f"network_audit_{start.strftime('%Y%m%d')}.{export_format}"
+    mimetype = EXPORT_FORMATS[export_format]
+    if compress:
+        filename += ".gz"
+        mimetype = "application/gzip"
+
+    return Response(
+        stream_audit_export(db['detections'], query, export_format=export_format, compress=compress),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+def _prepare_bulk_upload_rows(df):
+    """
+    Normalize an uploaded roster with vectorized pandas ops.
+
+    Returns (rows, skipped, errors) where rows is a DataFrame with
+    row_num, roll_no, password and user_type columns.
+    """
+    errors = []
+    df = df.copy()
+    df['row_num'] = df.index + 2  # header is row 1
+
+    df['roll_no'] = df['roll_number'].fillna('').astype(str).str.strip()
+    df['password'] = df['password'].fillna('').astype(str).str.strip()
+
+    # user_type is optional – defaults to 'student'
+    if 'user_type' in df.columns:
+        user_type = df['user_type'].fillna('student').astype(str).str.strip().str.lower()
+    else:
+        user_type = pd.Series('student', index=df.index)
+    df['user_type'] = user_type.where(user_type.isin(['student', 'faculty']), 'student')
+
+    missing = (df['roll_no'] == '') | (df['password'] == '')
+    errors.extend(f'Row {n}: Missing data' for n in df.loc[missing, 'row_num'])
+    df = df[~missing]
+
+    duplicated = df['roll_no'].duplicated(keep='first')
+    errors.extend(f'Row {n}: Duplicate roll number {r} in file' for n, r in df.loc[duplicated, ['row_num', 'roll_no']].itertuples(index=False))
+    df = df[~duplicated]
+
+    skipped = int(missing.sum() + duplicated.sum())
+    return df[['row_num', 'roll_no', 'password', 'user_type']], skipped, errors
+
+
+def _existing_roll_numbers(roll_nos):
+    """Look up which roll numbers already exist with batched $in queries."""
+    existing = set()
+    for start in range(0, len(roll_nos), BULK_UPLOAD_LOOKUP_CHUNK):
+        chunk = roll_nos[start:start + BULK_UPLOAD_LOOKUP_CHUNK]
+        for doc in users_collection.find({'roll_no': {'$in': chunk}}, {'roll_no': 1, '_id': 0}):
+            existing.add(doc.get('roll_no'))
+    return existing
+
+
+def _update_bulk_upload_job(job_id, **fields):
+    with _bulk_upload_jobs_lock:
+        job = _bulk_upload_jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+
+def _prune_bulk_upload_jobs():
+    cutoff = time.time() - BULK_UPLOAD_JOB_RETENTION_SECONDS
+    with _bulk_upload_jobs_lock:
+        for job_id in [j for j, job in _bulk_upload_jobs.items() if job.get('finished_ts', time.time()) < cutoff]:
+            _bulk_upload_jobs.pop(job_id, None)
+
+
+def _run_bulk_upload_job(job_id, rows):
+    """Hash passwords in the process pool and insert_many in unordered batches."""
+    added_count = 0
+    errors = []
+    medium_mbps = _medium_preset_mbps()
+    records = list(rows.itertuples(index=False))
+
+    try:
+        hashes = hash_passwords((r.password for r in records), chunksize=BULK_UPLOAD_HASH_CHUNK)
+        batch = []
+        processed = 0
+
+        for record, password_hash in zip(records, hashes):
+            # Insert new user (using same structure as existing add_client route)
+            batch.append({
+                'roll_no': record.roll_no,
+                'password': password_hash,
+                'role': 'student',
+                'user_type': record.user_type,
+                'blocked': False,
+                'activity': 'Idle',
+                'bandwidth_limit': 'medium',
+                'bandwidth_effective_tier': 'medium',
+                'bandwidth_effective_mbps': medium_mbps,
+            })
+            processed += 1
+
+            if len(batch) >= BULK_UPLOAD_INSERT_CHUNK or processed == len(records):
+                try:
+                    result = users_collection.insert_many(batch, ordered=False)
+                    added_count += len(result.inserted_ids)
+                except BulkWriteError as e:
+                    # Another writer may have created some of these since the $in check.
+                    added_count += e.details.get('nInserted', 0)
+                    for write_error in e.details.get('writeErrors', [])[:10]:
+                        roll_no = (write_error.get('op') or {}).get('roll_no')
+                        errors.append(f'User {roll_no} could not be inserted: {write_error.get("errmsg")}')
+                batch = []
+                _update_bulk_upload_job(job_id, processed=processed, added=added_count)
+
+        with _bulk_upload_jobs_lock:
+            job = _bulk_upload_jobs.get(job_id) or {}
+            job.update({
+                'status': 'completed',
+                'message': 'Bulk upload completed',
+                'added': added_count,
+                'skipped': job.get('skipped', 0) + (len(records) - added_count),
+                'errors': (job.get('errors', []) + errors)[:10],
+                'finished_ts': time.time(),
+            })
+    except Exception as e:
+        print(f"Bulk upload error: {e}")
+        _update_bulk_upload_job(
+            job_id,
+            status='failed',
+            error=str(e),
+            added=added_count,
+            finished_ts=time.time(),
+        )
+
+
 @admin_routes.route('/admin/bulk-upload', methods=['POST'])
 @admin_required
 def bulk_upload_clients():
-    """Bulk upload students via CSV/Excel file"""
+    """Bulk upload students via CSV/Excel file (runs as a background job)"""
     try:
         # Check if file is present
         if 'file' not in request.files:
@@ -1208,9 +1966,9 @@ def bulk_upload_clients():
         # Read file
         try:
             if filename.endswith('.csv'):
-                df = pd.read_csv(io.StringIO(file.stream.read().decode('utf-8')))
+                df = pd.read_csv(io.StringIO(file.stream.read().decode('utf-8')), dtype=str)
             else:
-                df = pd.read_excel(file)
+                df = pd.read_excel(file, dtype=str)
         except Exception as e:
             return jsonify({'error': f'Failed to read file: {str(e)}'}), 400
         
@@ -1218,60 +1976,65 @@ def bulk_upload_clients():
         required_columns = ['roll_number', 'password']
         if not all(col in df.columns for col in required_columns):
             return jsonify({'error': f'CSV must contain columns: {", ".join(required_columns)}'}), 400
-        
-        # Remove NaN values
-        df = df.dropna(subset=required_columns)
-        
-        added_count = 0
-        skipped_count = 0
-        errors = []
-        
-        # Process each row
-        for row_num, (_, row) in enumerate(df.iterrows(), start=2):
-            roll_no = str(row['roll_number']).strip()
-            password = str(row['password']).strip()
-            # user_type is optional – defaults to 'student'
-            raw_user_type = str(row.get('user_type', 'student') or 'student').strip().lower()
-            user_type = raw_user_type if raw_user_type in ('student', 'faculty') else 'student'
-            
-            if not roll_no or not password:
-                skipped_count += 1
-                errors.append(f'Row {row_num}: Missing data')
-                continue
-            
-            # Check if user exists
-            if users_collection.find_one({'roll_no': roll_no}):
-                skipped_count += 1
-                errors.append(f'User {roll_no} already exists')
-                continue
-            
-            # Insert new user (using same structure as existing add_client route)
-            doc = {
-                'roll_no': roll_no,
-                'password': generate_password_hash(password),
-                'role': 'student',
-                'user_type': user_type,
-                'blocked': False,
-                'activity': 'Idle',
-                'bandwidth_limit': 'medium',
-                'bandwidth_effective_tier': 'medium',
-                'bandwidth_effective_mbps': _medium_preset_mbps(),
+
+        rows, skipped_count, errors = _prepare_bulk_upload_rows(df)
+
+        # Check existing users with one $in query per chunk instead of one find_one per row
+        existing = _existing_roll_numbers(rows['roll_no'].tolist())
+        if existing:
+            exists_mask = rows['roll_no'].isin(existing)
+            errors.extend(f'User {r} already exists' for r in rows.loc[exists_mask, 'roll_no'])
+            skipped_count += int(exists_mask.sum())
+            rows = rows[~exists_mask]
+
+        _prune_bulk_upload_jobs()
+        job_id = uuid.uuid4().hex
+        with _bulk_upload_jobs_lock:
+            _bulk_upload_jobs[job_id] = {
+                'job_id': job_id,
+                'status': 'running',
+                'filename': filename,
+                'total': int(len(rows)),
+                'processed': 0,
+                'added': 0,
+                'skipped': skipped_count,
+                'errors': errors[:10],
+                'started_at': datetime.datetime.utcnow().isoformat(),
             }
-            
-            users_collection.insert_one(doc)
-            added_count += 1
-        
+
+        threading.Thread(
+            target=_run_bulk_upload_job,
+            args=(job_id, rows),
+            name=f"bulk-upload-{job_id[:8]}",
+            daemon=True,
+        ).start()
+
         return jsonify({
-            'message': 'Bulk upload completed',
-            'added': added_count,
+            'message': 'Bulk upload started',
+            'job_id': job_id,
+            'status_url': f'/api/admin/bulk-upload/{job_id}',
+            'total': int(len(rows)),
             'skipped': skipped_count,
-            'errors': errors[:10]
-        }), 200
+        }), 202
         
     except Exception as e:
         print(f"Bulk upload error: {e}")
         return jsonify({'error': str(e)}), 500
 
+
+@admin_routes.route('/admin/bulk-upload/<job_id>', methods=['GET'])
+@admin_required
+def bulk_upload_status(job_id):
+    """Progress of a bulk upload job"""
+    with _bulk_upload_jobs_lock:
+        job = _bulk_upload_jobs.get(job_id)
+        job = {k: v for k, v in job.items() if k != 'finished_ts'} if job else None
+
+    if not job:
+        return jsonify({'error': 'Unknown bulk upload job'}), 404
+    return jsonify(job), 200
+
+
 # S&  Web Filtering
 
 DEFAULT_CATEGORIES = {
@@ -1371,37 +2134,110 @@ def normalize_filter_domain(value: str) -> str:
     return host
 
 
+def _effective_blocklist():
+    """Compile the web_filter config into the shared and per-group domain policy files."""
+    from domain_policy import rebuild_domain_policy
+    from filter_groups import rebuild_group_policies
+
+    config = web_filter_collection.find_one({"type": "config"})
+    policy, _ = rebuild_domain_policy(config or {})
+    group_policies = rebuild_group_policies(config or {})
+    return policy, group_policies, config
+
+
 def _run_filtering_apply_once(trigger: str) -> dict:
     """Apply DNS and firewall filtering rules once and return detailed status."""
+    global _filter_applied_hash, _filter_applied_domains, _filter_applied_groups_hash
+
     status = {
         "trigger": trigger,
         "started_at": datetime.datetime.utcnow().isoformat() + "Z",
         "completed_at": None,
         "success": False,
         "partial": False,
+        "skipped": False,
         "dns_updated": False,
         "firewall_updated": False,
+        "groups_updated": False,
         "warnings": [],
         "errors": [],
     }
 
     try:
-        from dns_filtering_manager import update_dnsmasq_blocklist
-        status["dns_updated"] = bool(update_dnsmasq_blocklist())
-        if not status["dns_updated"]:
-            status["warnings"].append("DNS blocklist update failed")
+        policy, group_policies, config = _effective_blocklist()
     except Exception as e:
-        status["errors"].append(f"DNS update error: {e}")
+        status["errors"].append(f"Filter config error: {e}")
+        status["completed_at"] = datetime.datetime.utcnow().isoformat() + "Z"
+        return status
+    if config is None:
+        status["warnings"].append("No filter configuration found in database")
+    blocklist_hash = policy.digest
+    groups_hash = ",".join(f"{group}:{group_policy.digest}" for group, group_policy in sorted(group_policies.items()))
+    resolvable = set(policy.resolvable_names())
+    status["blocklist_hash"] = blocklist_hash
+    status["groups"] = sorted(group_policies)
+
+    # Worker runs are serialized, so the applied state needs no extra lock.
+    global_unchanged = blocklist_hash == _filter_applied_hash
+    groups_unchanged = groups_hash == _filter_applied_groups_hash
+    if global_unchanged and groups_unchanged:
+        status.update(success=True, skipped=True, dns_updated=True, firewall_updated=True, groups_updated=True)
+        status["completed_at"] = datetime.datetime.utcnow().isoformat() + "Z"
+        return status
+
+    if global_unchanged:
+        status.update(dns_updated=True, firewall_updated=True)
+    else:
+        try:
+            from dns_filtering_manager import update_dnsmasq_blocklist
+            status["dns_updated"] = bool(update_dnsmasq_blocklist(set(policy.patterns())))
+            if not status["dns_updated"]:
+                status["warnings"].append("DNS blocklist update failed")
+        except Exception as e:
+            status["errors"].append(f"DNS update error: {e}")
 
-    try:
-        status["firewall_updated"] = bool(update_firewall_rules())
-        if not status["firewall_updated"]:
-            status["warnings"].append("Firewall rules update failed")
-    except Exception as e:
-        status["errors"].append(f"Firewall update error: {e}")
+        try:
+            from linux_firewall_manager import apply_domain_block_changes, get_firewall_manager, sync_domain_blocks
 
-    status["partial"] = bool(status["dns_updated"] or status["firewall_updated"])
-    status["success"] = bool(status["dns_updated"] and status["firewall_updated"])
+            if _filter_applied_domains is None:
+                firewall_result = sync_domain_blocks(sorted(resolvable))
+            else:
+                added = resolvable - _filter_applied_domains
+                removed = _filter_applied_domains - resolvable
+                status["domains_added"] = len(added)
+                status["domains_removed"] = len(removed)
+                firewall_result = apply_domain_block_changes(added, removed)
+
+            status["firewall_updated"] = bool(firewall_result.get("success"))
+            status["ips_added"] = firewall_result.get("added", 0)
+            status["ips_removed"] = firewall_result.get("removed", 0)
+            if not status["firewall_updated"]:
+                status["warnings"].append("Firewall rules update failed")
+            elif firewall_result.get("changed"):
+                get_firewall_manager().save_rules()
+        except Exception as e:
+            status["errors"].append(f"Firewall update error: {e}")
+
+        if status["dns_updated"] and status["firewall_updated"]:
+            _filter_applied_hash = blocklist_hash
+            _filter_applied_domains = resolvable
+
+    if groups_unchanged:
+        status["groups_updated"] = True
+    else:
+        try:
+            from filter_groups import apply_group_policies
+
+            groups_result = apply_group_policies(config, group_policies)
+            status["groups_updated"] = bool(groups_result.get("success"))
+            status["warnings"].extend(f"Filter group: {error}" for error in groups_result.get("errors", []))
+            if status["groups_updated"]:
+                _filter_applied_groups_hash = groups_hash
+        except Exception as e:
+            status["errors"].append(f"Filter group update error: {e}")
+
+    status["partial"] = bool(status["dns_updated"] or status["firewall_updated"] or status["groups_updated"])
+    status["success"] = bool(status["dns_updated"] and status["firewall_updated"] and status["groups_updated"])
 
     if status["firewall_updated"] and not status["dns_updated"]:
         status["warnings"].append(
@@ -1453,6 +2289,16 @@ def _start_filtering_apply(trigger: str):
         return thread, True
 
 
+def start_filtering_apply(trigger: str) -> bool:
+    """
+    Rebuild DNS views, group ipsets and firewall rules in the background.
+
+    Returns False when a run was already in progress (it reruns once done).
+    """
+    _, started_new_job = _start_filtering_apply(trigger)
+    return started_new_job
+
+
 def _apply_filtering_rules_with_timeout(trigger: str, timeout_seconds: int = FILTER_APPLY_TIMEOUT_SECONDS) -> dict:
     """Apply filtering rules with a short wait; continue in background if slow."""
     thread, started_new_job = _start_filtering_apply(trigger)
@@ -1585,11 +2431,21 @@ def get_filtering():
 
     
 
+    try:
+        from blocklist_import import list_manifests
+
+        external_lists = list_manifests()
+    except Exception as e:
+        logger.warning(f"Could not load imported blocklists: {e}")
+        external_lists = []
+
     return jsonify({
 
         "categories": config.get("categories", {}),
 
-        "manual_blocks": config.get("manual_blocks", [])
+        "manual_blocks": config.get("manual_blocks", []),
+
+        "external_lists": external_lists
 
     }), 200
 
@@ -1752,3 +2608,70 @@ def remove_blocked_site():
         "domain": target,
         "apply_status": apply_status,
     }), 202
+
+
+@admin_routes.route('/admin/filtering/groups', methods=['GET'])
+@admin_required
+def get_filter_groups():
+    from filter_groups import get_policy_groups
+
+    config = web_filter_collection.find_one({"type": "config"}) or {}
+    return jsonify({"groups": get_policy_groups(config)}), 200
+
+
+@admin_routes.route('/admin/filtering/groups/<name>', methods=['PUT'])
+@admin_required
+def put_filter_group(name):
+    from filter_groups import normalize_group_name
+
+    group = normalize_group_name(name)
+    if not group:
+        return jsonify({"message": "Invalid group name"}), 400
+
+    data = request.get_json() or {}
+    _refresh_web_filter_defaults()
+    config = web_filter_collection.find_one({"type": "config"}) or {}
+
+    spec = {"inherit_manual_blocks": bool(data.get("inherit_manual_blocks", True))}
+    if "categories" in data:
+        if not isinstance(data["categories"], list):
+            return jsonify({"message": "categories must be a list"}), 400
+        unknown = [c for c in data["categories"] if c not in (config.get("categories") or {})]
+        if unknown:
+            return jsonify({"message": f"Unknown categories: {', '.join(map(str, unknown))}"}), 400
+        spec["categories"] = list(data["categories"])
+
+    manual_blocks = []
+    for url in data.get("manual_blocks") or []:
+        domain = normalize_filter_domain(url)
+        if not domain or "." not in domain:
+            return jsonify({"message": f"Invalid domain: {url}"}), 400
+        manual_blocks.append(domain)
+    spec["manual_blocks"] = sorted(set(manual_blocks))
+
+    web_filter_collection.update_one({"type": "config"}, {"$set": {f"groups.{group}": spec}})
+
+    apply_status = _apply_filtering_rules_with_timeout(trigger=f"group_update:{group}")
+    status_code = 200 if apply_status.get("completed") and apply_status.get("success") else 202
+    return jsonify({"message": f"Group saved: {group}", "group": group, "policy": spec, "apply_status": apply_status}), status_code
+
+
+@admin_routes.route('/admin/filtering/groups/<name>', methods=['DELETE'])
+@admin_required
+def delete_filter_group(name):
+    from filter_groups import normalize_group_name
+
+    group = normalize_group_name(name)
+    if not group:
+        return jsonify({"message": "Invalid group name"}), 400
+
+    result = web_filter_collection.update_one(
+        {"type": "config", f"groups.{group}": {"$exists": True}},
+        {"$unset": {f"groups.{group}": ""}},
+    )
+    if not result.matched_count:
+        return jsonify({"message": "Group not found"}), 404
+
+    apply_status = _apply_filtering_rules_with_timeout(trigger=f"group_delete:{group}")
+    status_code = 200 if apply_status.get("completed") and apply_status.get("success") else 202
+    return jsonify({"message": f"Group removed: {group}", "group": group, "apply_status": apply_status}), status_code
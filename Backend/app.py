@@ -8,9 +8,10 @@ import ipaddress
 from db import users_collection, admins_collection, sessions_collection
 
 # ✅ Import Blueprints
-from admin_routes import admin_routes
+from admin_routes import admin_routes, start_filtering_apply
 from auth_routes import auth_routes
 from filtering_routes import filtering_blueprint
+from linux_firewall_manager import install_sigterm_flush
 
 # --------------------------------------------------
 # ✅ APP CONFIG
@@ -143,4 +144,8 @@ def api_status():
 # ✅ RUN SERVER (LAN HOSTING)
 # --------------------------------------------------
 if __name__ == "__main__":
+    # Group ipsets, their DROP/REDIRECT rules and DNS views live only in the kernel
+    # and in child dnsmasq processes; rebuild them from the database on every boot.
+    start_filtering_apply("startup")
+    install_sigterm_flush()
     app.run(host="0.0.0.0", port=5000, debug=False) # Disable debug to prevent double-execution on reload
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Async DNS Resolver - Resolve many blocked domains concurrently over raw UDP
+Keeps a TTL-honouring cache so periodic refreshes only query expired names
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated "ip[:port]" list; tried in order on timeout. Defaults match
+# the dnsmasq upstreams so lookups bypass our own blocklist (address=/x/0.0.0.0).
+DNS_RESOLVER_UPSTREAM = os.environ.get("DNS_RESOLVER_UPSTREAM", "8.8.8.8,8.8.4.4")
+DNS_RESOLVER_TIMEOUT_SECONDS = float(os.environ.get("DNS_RESOLVER_TIMEOUT_SECONDS", "2"))
+DNS_RESOLVER_RETRIES = int(os.environ.get("DNS_RESOLVER_RETRIES", "2"))
+DNS_RESOLVER_MAX_INFLIGHT = int(os.environ.get("DNS_RESOLVER_MAX_INFLIGHT", "256"))
+DNS_RESOLVER_MIN_TTL = int(os.environ.get("DNS_RESOLVER_MIN_TTL", "30"))
+DNS_RESOLVER_MAX_TTL = int(os.environ.get("DNS_RESOLVER_MAX_TTL", "86400"))
+DNS_RESOLVER_NEGATIVE_TTL = int(os.environ.get("DNS_RESOLVER_NEGATIVE_TTL", "60"))
+
+QTYPE_A = 1
+QTYPE_CNAME = 5
+QTYPE_OPT = 41
+QCLASS_IN = 1
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+EDNS_UDP_PAYLOAD = 1232
+
+
+class DnsError(Exception):
+    """Raised when a lookup times out or the upstream answers with an error rcode."""
+
+
+def parse_upstreams(value: Optional[str] = None) -> List[Tuple[str, int]]:
+    upstreams = []
+    for item in (value if value is not None else DNS_RESOLVER_UPSTREAM).split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        upstreams.append((host, int(port or 53)))
+    return upstreams or [("8.8.8.8", 53)]
+
+
+def normalize_domain(domain: str) -> str:
+    """Strip scheme/path/trailing dot and lowercase; returns "" for unusable input."""
+    name = str(domain or "").strip().lower()
+    name = name.replace("https://", "").replace("http://", "").split("/")[0].split(":")[0]
+    name = name.strip(".")
+    try:
+        name = name.encode("idna").decode("ascii")
+    except UnicodeError:
+        return ""
+    if not name or len(name) > 253:
+        return ""
+    return name
+
+
+def build_query(query_id: int, name: str, qtype: int = QTYPE_A) -> bytes:
+    # RD set, one question, one EDNS0 OPT record so answers up to 1232 bytes fit in UDP.
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 1)
+    labels = b"".join(
+        bytes([len(label)]) + label
+        for label in name.encode("ascii").split(b".")
+    )
+    question = labels + b"\x00" + struct.pack("!HH", qtype, QCLASS_IN)
+    opt = b"\x00" + struct.pack("!HHIH", QTYPE_OPT, EDNS_UDP_PAYLOAD, 0, 0)
+    return header + question + opt
+
+
+def _read_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """Decode a (possibly compressed) name; returns (name, offset after the name)."""
+    labels = []
+    end_offset = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DnsError("truncated name")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data) or jumps > 32:
+                raise DnsError("bad compression pointer")
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            jumps += 1
+            continue
+        if length == 0:
+            offset += 1
+            break
+        labels.append(data[offset + 1:offset + 1 + length].decode("ascii", "replace").lower())
+        offset += 1 + length
+    return ".".join(labels), (end_offset if end_offset is not None else offset)
+
+
+def parse_response(data: bytes) -> Dict:
+    """
+    Parse an A-query response.
+
+    Returns id, rcode, truncated, qname, the A records grouped by owner name
+    ({owner: (ips, ttl)}) and the chain TTL (lowest TTL across CNAME/A answers).
+    """
+    if len(data) < 12:
+        raise DnsError("short response")
+    query_id, flags, qdcount, ancount, _, _ = struct.unpack("!HHHHHH", data[:12])
+    offset = 12
+    qname = ""
+    for _ in range(qdcount):
+        qname, offset = _read_name(data, offset)
+        offset += 4
+
+    records: Dict[str, Tuple[Set[str], int]] = {}
+    chain_ttl: Optional[int] = None
+    for _ in range(ancount):
+        owner, offset = _read_name(data, offset)
+        if offset + 10 > len(data):
+            raise DnsError("truncated answer")
+        rtype, rclass, ttl, rdlength = struct.unpack("!HHIH", data[offset:offset + 10])
+        offset += 10
+        rdata = data[offset:offset + rdlength]
+        offset += rdlength
+        if rclass != QCLASS_IN or rtype not in (QTYPE_A, QTYPE_CNAME):
+            continue
+        chain_ttl = ttl if chain_ttl is None else min(chain_ttl, ttl)
+        if rtype == QTYPE_A and rdlength == 4:
+            ips, owner_ttl = records.get(owner, (set(), ttl))
+            ips.add(socket.inet_ntoa(rdata))
+            records[owner] = (ips, min(owner_ttl, ttl))
+
+    return {
+        "id": query_id,
+        "rcode": flags & 0x000F,
+        "truncated": bool(flags & 0x0200),
+        "qname": qname,
+        "records": records,
+        "chain_ttl": chain_ttl,
+    }
+
+
+class DnsCache:
+    """Thread-safe name -> IPv4 set cache with per-entry expiry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[frozenset, float]] = {}
+
+    def get(self, name: str, now: Optional[float] = None) -> Optional[frozenset]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                self._entries.pop(name, None)
+                return None
+            return entry[0]
+
+    def ttl_remaining(self, name: str, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(name)
+            return max(0.0, entry[1] - now) if entry else 0.0
+
+    def put(self, name: str, ips: Iterable[str], ttl: int) -> None:
+        ttl = max(DNS_RESOLVER_MIN_TTL, min(DNS_RESOLVER_MAX_TTL, int(ttl)))
+        with self._lock:
+            self._entries[name] = (frozenset(ips), time.monotonic() + ttl)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+_shared_cache = DnsCache()
+
+
+def get_dns_cache() -> DnsCache:
+    return _shared_cache
+
+
+class _DnsClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, resolver: "AsyncDnsResolver"):
+        self.resolver = resolver
+
+    def datagram_received(self, data, addr):
+        self.resolver._on_datagram(data, addr)
+
+    def error_received(self, exc):
+        logger.debug("DNS socket error: %s", exc)
+
+
+class AsyncDnsResolver:
+    """
+    Many-in-flight A-record resolver over one UDP socket.
+
+    Use as ``async with AsyncDnsResolver() as resolver``; results go through
+    the shared DnsCache unless another cache is passed in.
+    """
+
+    def __init__(
+        self,
+        upstreams: Optional[List[Tuple[str, int]]] = None,
+        timeout: float = DNS_RESOLVER_TIMEOUT_SECONDS,
+        retries: int = DNS_RESOLVER_RETRIES,
+        max_inflight: int = DNS_RESOLVER_MAX_INFLIGHT,
+        cache: Optional[DnsCache] = None,
+    ):
+        self.upstreams = upstreams or parse_upstreams()
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.cache = cache if cache is not None else _shared_cache
+        self._semaphore = asyncio.Semaphore(max(1, max_inflight))
+        self._transport = None
+        self._pending: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"queries": 0, "cache_hits": 0, "timeouts": 0, "tcp_fallbacks": 0}
+
+    async def __aenter__(self):
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DnsClientProtocol(self),
+            local_addr=("0.0.0.0", 0),
+        )
+        # Hundreds of answers can land at once; the default buffer drops some.
+        sock = self._transport.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+            except OSError:
+                pass
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending.clear()
+
+    def _on_datagram(self, data: bytes, addr) -> None:
+        if (addr[0], addr[1]) not in self.upstreams:
+            return
+        try:
+            response = parse_response(data)
+        except DnsError:
+            return
+        future = self._pending.get((response["id"], response["qname"]))
+        if future is not None and not future.done():
+            future.set_result((data, response))
+
+    def _new_query_id(self, name: str) -> int:
+        while True:
+            query_id = random.getrandbits(16)
+            if (query_id, name) not in self._pending:
+                return query_id
+
+    async def _query_udp(self, name: str, upstream: Tuple[str, int]) -> Dict:
+        query_id = self._new_query_id(name)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[(query_id, name)] = future
+        try:
+            self.stats["queries"] += 1
+            self._transport.sendto(build_query(query_id, name), upstream)
+            _, response = await asyncio.wait_for(future, self.timeout)
+            return response
+        finally:
+            self._pending.pop((query_id, name), None)
+
+    async def _query_tcp(self, name: str, upstream: Tuple[str, int]) -> Dict:
+        self.stats["tcp_fallbacks"] += 1
+        query = build_query(self._new_query_id(name), name)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*upstream), self.timeout)
+        try:
+            writer.write(struct.pack("!H", len(query)) + query)
+            await writer.drain()
+            length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), self.timeout))[0]
+            return parse_response(await asyncio.wait_for(reader.readexactly(length), self.timeout))
+        finally:
+            writer.close()
+
+    async def _lookup(self, name: str) -> Set[str]:
+        last_error: Optional[Exception] = None
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                upstream = self.upstreams[attempt % len(self.upstreams)]
+                try:
+                    response = await self._query_udp(name, upstream)
+                    if response["truncated"]:
+                        response = await self._query_tcp(name, upstream)
+                except asyncio.TimeoutError:
+                    self.stats["timeouts"] += 1
+                    last_error = DnsError(f"timeout from {upstream[0]}")
+                    continue
+                except (OSError, DnsError, asyncio.IncompleteReadError) as error:
+                    last_error = error
+                    continue
+
+                if response["rcode"] not in (RCODE_NOERROR, RCODE_NXDOMAIN):
+                    last_error = DnsError(f"rcode {response['rcode']} from {upstream[0]}")
+                    continue
+
+                records = response["records"]
+                ips: Set[str] = set()
+                for owner, (owner_ips, owner_ttl) in records.items():
+                    ips.update(owner_ips)
+                    if owner != name:
+                        self.cache.put(owner, owner_ips, owner_ttl)
+                if ips:
+                    self.cache.put(name, ips, response["chain_ttl"] or DNS_RESOLVER_MIN_TTL)
+                else:
+                    self.cache.put(name, ips, DNS_RESOLVER_NEGATIVE_TTL)
+                return ips
+
+        logger.warning("DNS lookup failed for %s: %s", name, last_error)
+        return set()
+
+    async def resolve(self, domain: str) -> Set[str]:
+        name = normalize_domain(domain)
+        if not name:
+            return set()
+        cached = self.cache.get(name)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+            return set(cached)
+        # Concurrent callers for the same name share one lookup.
+        inflight = self._inflight.get(name)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._lookup(name))
+            self._inflight[name] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(name, None))
+        return set(await inflight)
+
+    async def resolve_many(self, domains: Iterable[str]) -> Dict[str, Set[str]]:
+        domains = list(dict.fromkeys(domains))
+        results = await asyncio.gather(*(self.resolve(domain) for domain in domains))
+        return dict(zip(domains, results))
+
+
+async def _resolve_all(domains: List[str], upstreams, timeout) -> Tuple[Dict[str, Set[str]], Dict]:
+    async with AsyncDnsResolver(upstreams=upstreams, timeout=timeout) as resolver:
+        return await resolver.resolve_many(domains), resolver.stats
+
+
+def resolve_domains(
+    domains: Iterable[str],
+    upstreams: Optional[List[Tuple[str, int]]] = None,
+    timeout: float = DNS_RESOLVER_TIMEOUT_SECONDS,
+) -> Dict[str, Set[str]]:
+    """
+    Resolve domains to IPv4 sets from a synchronous caller.
+
+    Cached names are answered without touching the network; the rest are
+    queried concurrently in a private event loop.
+    """
+    domains = list(dict.fromkeys(domains))
+    results: Dict[str, Set[str]] = {}
+    misses = []
+    for domain in domains:
+        cached = _shared_cache.get(normalize_domain(domain))
+        if cached is not None:
+            results[domain] = set(cached)
+        else:
+            misses.append(domain)
+
+    if misses:
+        started = time.perf_counter()
+        resolved, stats = asyncio.run(_resolve_all(misses, upstreams, timeout))
+        results.update(resolved)
+        logger.info(
+            "Resolved %d domain(s) in %.2fs (%d cached, %d queries, %d timeouts)",
+            len(misses),
+            time.perf_counter() - started,
+            len(domains) - len(misses),
+            stats["queries"],
+            stats["timeouts"],
+        )
+    return results
+
+
+def resolve_domain(domain: str) -> Set[str]:
+    return resolve_domains([domain]).get(domain, set())
+
+
+def resolve_domains_with_ttl(domains: Iterable[str], **kwargs) -> Dict[str, Tuple[Set[str], float]]:
+    """Like resolve_domains, but also returns the seconds left on each cached answer (0 if the lookup failed)."""
+    results = resolve_domains(domains, **kwargs)
+    return {
+        domain: (ips, _shared_cache.ttl_remaining(normalize_domain(domain)))
+        for domain, ips in results.items()
+    }
+
+
+class _StubDnsServerProtocol(asyncio.DatagramProtocol):
+    """Answers every A query with deterministic addresses; for local testing/benchmarks."""
+
+    def __init__(self, ttl: int, answers_per_name: int):
+        self.ttl = ttl
+        self.answers_per_name = answers_per_name
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+
+    def datagram_received(self, data, addr):
+        try:
+            query_id, _, qdcount, _, _, _ = struct.unpack("!HHHHHH", data[:12])
+            name, offset = _read_name(data, 12)
+        except (struct.error, DnsError):
+            return
+        question = data[12:offset + 4]
+        digest = hashlib.sha1(name.encode()).digest()
+        answers = b""
+        for i in range(self.answers_per_name):
+            ip = bytes([198, 18, digest[i * 2], digest[i * 2 + 1]])
+            answers += b"\xc0\x0c" + struct.pack("!HHIH", QTYPE_A, QCLASS_IN, self.ttl, 4) + ip
+        header = struct.pack("!HHHHHH", query_id, 0x8180, 1, self.answers_per_name, 0, 0)
+        self.transport.sendto(header + question + answers, addr)
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 5353, ttl: int = 300, answers_per_name: int = 2):
+    """Run the stub server on a background thread; returns (thread, loop)."""
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(loop.create_datagram_endpoint(
+            lambda: _StubDnsServerProtocol(ttl, answers_per_name),
+            local_addr=(host, port),
+        ))
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, name="dns-stub-server", daemon=True)
+    thread.start()
+    ready.wait(5)
+    return thread, loop
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Async DNS resolver / benchmark')
+    parser.add_argument('domains', nargs='*', help='Domains to resolve')
+    parser.add_argument('--upstream', default=None, help='ip[:port][,ip[:port]] (default: DNS_RESOLVER_UPSTREAM)')
+    parser.add_argument('--stub', action='store_true',
+                        help='Start a local stub server on 127.0.0.1:5353 and resolve against it')
+    parser.add_argument('--bench', type=int, default=0, help='Resolve N synthetic domains (twice, to show caching)')
+    parser.add_argument('--serve-stub', default=None, metavar='HOST:PORT', help='Only run the stub server')
+
+    args = parser.parse_args()
+
+    if args.serve_stub:
+        stub_host, _, stub_port = args.serve_stub.partition(":")
+        start_stub_server(stub_host, int(stub_port or 5353))
+        logger.info("Stub DNS server listening on %s", args.serve_stub)
+        threading.Event().wait()
+
+    upstream_list = parse_upstreams(args.upstream) if args.upstream else None
+    if args.stub:
+        start_stub_server()
+        upstream_list = [("127.0.0.1", 5353)]
+
+    names = list(args.domains) + [f"bench-{i}.example.test" for i in range(args.bench)]
+    for run_number in (1, 2):
+        started = time.perf_counter()
+        resolved_map = resolve_domains(names, upstreams=upstream_list)
+        elapsed = time.perf_counter() - started
+        answered = sum(1 for ips in resolved_map.values() if ips)
+        print(f"Run {run_number}: {len(names)} domains ({answered} with addresses) in {elapsed:.2f}s")
+        if args.domains and run_number == 1:
+            for domain in args.domains:
+                print(f"  {domain}: {', '.join(sorted(resolved_map.get(domain, set()))) or '-'}")
@@ -1,12 +1,17 @@
 from flask import Blueprint, request, jsonify
 from models.user_model import create_user, find_user, validate_user
-from db import users_collection, admins_collection, sessions_collection, db
+from password_pool import PasswordPoolBusy
+from policy_job_queue import enqueue_grant, get_job as get_grant_job
+from db import users_collection, admins_collection, sessions_collection, db, usage_daily_collection, daily_usage_update
 from werkzeug.security import check_password_hash
 import jwt
 import datetime
 import socket
 import os
 import ipaddress
+import threading
+import time
+from collections import deque
 
 # Import firewall functions for captive portal
 _allow_authenticated_user_fn = None
@@ -43,6 +48,36 @@ DEFAULT_ADMIN_TIMEOUT_HOURS = 2
 DEFAULT_STUDENT_TIMEOUT_HOURS = 2
 MIN_TIMEOUT_HOURS = 1
 MAX_TIMEOUT_HOURS = 24
+# Login attempts allowed per client IP per window (0 disables the limit).
+LOGIN_RATE_LIMIT_ATTEMPTS = int(os.environ.get("LOGIN_RATE_LIMIT_ATTEMPTS", "10"))
+LOGIN_RATE_LIMIT_WINDOW_SECONDS = float(os.environ.get("LOGIN_RATE_LIMIT_WINDOW_SECONDS", "60"))
+
+_login_attempts_lock = threading.Lock()
+_login_attempts = {}
+
+
+def _check_login_rate_limit(client_ip):
+    """Record an attempt; return seconds to wait if the IP is over its limit, else 0."""
+    if LOGIN_RATE_LIMIT_ATTEMPTS <= 0 or not client_ip:
+        return 0
+
+    now = time.monotonic()
+    window_start = now - LOGIN_RATE_LIMIT_WINDOW_SECONDS
+    with _login_attempts_lock:
+        attempts = _login_attempts.setdefault(client_ip, deque())
+        while attempts and attempts[0] <= window_start:
+            attempts.popleft()
+
+        if len(attempts) >= LOGIN_RATE_LIMIT_ATTEMPTS:
+            return max(1, int(attempts[0] - window_start) + 1)
+
+        attempts.append(now)
+
+        # Drop idle IPs so the table stays bounded by recent clients.
+        if len(_login_attempts) > 4096:
+            for ip in [ip for ip, q in _login_attempts.items() if not q or q[-1] <= window_start]:
+                _login_attempts.pop(ip, None)
+    return 0
 
 
 def _parse_timeout_hours(value):
@@ -146,19 +181,21 @@ def _sync_session_usage_totals(roll_no: str, session_doc=None):
     now_utc = datetime.datetime.utcnow()
 
     if delta_total > 0:
+        user_inc = {
+            "total_data_bytes": delta_total,
+            "total_upload_bytes": max(0, delta_upload),
+            "total_download_bytes": max(0, delta_download),
+        }
         users_collection.update_one(
             {"roll_no": roll_no},
             {
-                "$inc": {
-                    "total_data_bytes": delta_total,
-                    "total_upload_bytes": max(0, delta_upload),
-                    "total_download_bytes": max(0, delta_download),
-                },
+                "$inc": user_inc,
                 "$set": {
                     "data_usage_updated_at": now_utc,
                 },
             },
         )
+        usage_daily_collection.update_one(*daily_usage_update(roll_no, user_inc, now_utc), upsert=True)
 
     session_selector = {"_id": session_doc.get("_id")} if session_doc.get("_id") else {"roll_no": roll_no}
     sessions_collection.update_one(
@@ -239,7 +276,7 @@ def _force_logout_session(roll_no: str, reason: str) -> bool:
 
     if BANDWIDTH_MANAGEMENT_ENABLED and _apply_bandwidth_for_active_users_fn:
         try:
-            _apply_bandwidth_for_active_users_fn()
+            _apply_bandwidth_for_active_users_fn(wait=False)
         except Exception as e:
             print(f"⚠️ Failed to refresh bandwidth policy after forced logout: {e}")
 
@@ -284,7 +321,18 @@ def login():
     roll_no = (data.get("roll_no") or "").strip()
     password = data.get("password")
 
-    user = validate_user(roll_no, password)
+    retry_after = _check_login_rate_limit(request.remote_addr)
+    if retry_after:
+        response = jsonify({"status": "error", "msg": "Too many login attempts. Please wait and try again."})
+        response.headers["Retry-After"] = str(retry_after)
+        return response, 429
+
+    try:
+        user = validate_user(roll_no, password)
+    except PasswordPoolBusy:
+        response = jsonify({"status": "error", "msg": "Server is busy. Please try again in a moment."})
+        response.headers["Retry-After"] = "2"
+        return response, 503
 
     if not user:
         return jsonify({"status": "error", "msg": "Invalid credentials"}), 401
@@ -357,20 +405,18 @@ def login():
     )
     print(f"✅ Session created: {roll_no} -> {client_ip}")
     
-    # ✅ Enable internet access for this user (captive portal)
-    if FIREWALL_ENABLED and _allow_authenticated_user_fn and _is_hotspot_client_ip(client_ip):
+    # ✅ Queue internet access (captive portal) + bandwidth policy for this login.
+    # The policy worker batches concurrent logins, so the JWT is returned right away.
+    grant_job = None
+    if FIREWALL_ENABLED or BANDWIDTH_MANAGEMENT_ENABLED:
         try:
-            _allow_authenticated_user_fn(client_ip)
-            print(f"✅ Internet access enabled for {client_ip}")
-        except Exception as e:
-            print(f"⚠️ Failed to enable firewall access: {e}")
-
-    # ✅ Apply bandwidth policy for active users (including this new login)
-    if BANDWIDTH_MANAGEMENT_ENABLED and _apply_bandwidth_for_active_users_fn:
-        try:
-            _apply_bandwidth_for_active_users_fn()
+            grant_job = enqueue_grant(
+                client_ip,
+                roll_no=roll_no,
+                grant_firewall=FIREWALL_ENABLED and _is_hotspot_client_ip(client_ip),
+            )
         except Exception as e:
-            print(f"⚠️ Failed to apply bandwidth policy: {e}")
+            print(f"⚠️ Failed to queue access grant: {e}")
 
     timeout_settings = _get_session_timeout_settings()
     student_timeout_hours = timeout_settings["student_timeout_hours"]
@@ -386,10 +432,20 @@ def login():
         "token": token,
         "role": "student",
         "session_timeout_hours": student_timeout_hours,
+        "grant_job_id": grant_job["job_id"] if grant_job else None,
         "msg": "Login successful"
     }), 200
 
 
+@auth_routes.route("/grant-status/<job_id>", methods=["GET"])
+def grant_status(job_id):
+    """Status of the firewall/bandwidth grant queued by a login."""
+    job = get_grant_job(job_id)
+    if not job:
+        return jsonify({"status": "error", "msg": "Unknown grant job"}), 404
+    return jsonify(job), 200
+
+
 @auth_routes.route("/session-status", methods=["GET"])
 def session_status():
     roll_no = (request.args.get("roll_no") or "").strip()
@@ -465,7 +521,7 @@ def logout():
         # ✅ Refresh bandwidth policies after session removal
         if BANDWIDTH_MANAGEMENT_ENABLED and _apply_bandwidth_for_active_users_fn:
             try:
-                _apply_bandwidth_for_active_users_fn()
+                _apply_bandwidth_for_active_users_fn(wait=False)
             except Exception as e:
                 print(f"⚠️ Failed to refresh bandwidth policy: {e}")
 
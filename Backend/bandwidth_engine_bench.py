@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Bandwidth Engine Bench - Compare HTB+fq_codel and CAKE shaping in network namespaces
+Builds server <-> router <-> N clients, applies each engine on the router's
+hotspot bridge and measures per-client download throughput with iperf3
+
+Needs root, iproute2 and iperf3. Nothing outside the bwt-* namespaces is touched.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+SERVER_NS = "bwt-srv"
+ROUTER_NS = "bwt-rtr"
+CLIENT_NS_PREFIX = "bwt-c"
+HOTSPOT_BRIDGE = "br-hs"
+SERVER_IP = "10.98.0.2"
+IPERF_BASE_PORT = 5201
+TIERS = ["low", "medium", "high"]
+
+
+def run(cmd, check=True, namespace=None):
+    if namespace:
+        cmd = ["ip", "netns", "exec", namespace] + cmd
+    result = subprocess.run(cmd, capture_output=True, text=True, check=False)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"{' '.join(cmd)}: {(result.stderr or result.stdout).strip()}")
+    return result
+
+
+def client_ip(index):
+    return f"10.77.0.{10 + index}"
+
+
+def teardown(client_count):
+    for name in [SERVER_NS, ROUTER_NS] + [f"{CLIENT_NS_PREFIX}{i}" for i in range(client_count)]:
+        run(["ip", "netns", "del", name], check=False)
+
+
+def build_topology(client_count):
+    teardown(client_count)
+    for name in [SERVER_NS, ROUTER_NS]:
+        run(["ip", "netns", "add", name])
+
+    # Upstream link: server <-> router
+    run(["ip", "link", "add", "wan0", "netns", ROUTER_NS, "type", "veth", "peer", "name", "srv0", "netns", SERVER_NS])
+    run(["ip", "addr", "add", "10.98.0.1/24", "dev", "wan0"], namespace=ROUTER_NS)
+    run(["ip", "addr", "add", f"{SERVER_IP}/24", "dev", "srv0"], namespace=SERVER_NS)
+    for ns, dev in [(ROUTER_NS, "wan0"), (SERVER_NS, "srv0"), (ROUTER_NS, "lo"), (SERVER_NS, "lo")]:
+        run(["ip", "link", "set", dev, "up"], namespace=ns)
+    run(["ip", "route", "add", "10.77.0.0/24", "via", "10.98.0.1"], namespace=SERVER_NS)
+
+    # Hotspot side: a bridge on the router with one veth per client namespace
+    run(["ip", "link", "add", HOTSPOT_BRIDGE, "type", "bridge"], namespace=ROUTER_NS)
+    run(["ip", "addr", "add", "10.77.0.1/24", "dev", HOTSPOT_BRIDGE], namespace=ROUTER_NS)
+    run(["ip", "link", "set", HOTSPOT_BRIDGE, "up"], namespace=ROUTER_NS)
+    run(["sysctl", "-qw", "net.ipv4.ip_forward=1"], namespace=ROUTER_NS)
+
+    for i in range(client_count):
+        ns = f"{CLIENT_NS_PREFIX}{i}"
+        port = f"hs{i}"
+        run(["ip", "netns", "add", ns])
+        run(["ip", "link", "add", port, "netns", ROUTER_NS, "type", "veth", "peer", "name", "eth0", "netns", ns])
+        run(["ip", "link", "set", port, "master", HOTSPOT_BRIDGE], namespace=ROUTER_NS)
+        run(["ip", "link", "set", port, "up"], namespace=ROUTER_NS)
+        run(["ip", "addr", "add", f"{client_ip(i)}/24", "dev", "eth0"], namespace=ns)
+        run(["ip", "link", "set", "eth0", "up"], namespace=ns)
+        run(["ip", "link", "set", "lo", "up"], namespace=ns)
+        run(["ip", "route", "add", "default", "via", "10.77.0.1"], namespace=ns)
+
+
+def bench_policies(client_count):
+    policies = []
+    for i in range(client_count):
+        tier = TIERS[i % len(TIERS)]
+        policies.append({"roll_no": f"BENCH{i:04d}", "client_ip": client_ip(i), "tier": tier})
+    return policies
+
+
+def apply_engine(engine, policies, root_rate_mbps):
+    """Run bandwidth_manager inside the router namespace and return its result."""
+    env_args = [
+        "env",
+        f"HOTSPOT_INTERFACE={HOTSPOT_BRIDGE}",
+        f"BANDWIDTH_SHAPING_ENGINE={engine}",
+        f"BANDWIDTH_ROOT_RATE_MBPS={root_rate_mbps}",
+    ]
+    cmd = env_args + [sys.executable, os.path.abspath(__file__), "--apply-policies", json.dumps(policies)]
+    result = run(cmd, namespace=ROUTER_NS)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _apply_policies_here(policies_json):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from bandwidth_manager import TIER_TO_MBPS, apply_tc_bandwidth_policies
+
+    policies = json.loads(policies_json)
+    for policy in policies:
+        policy["effective_mbps"] = TIER_TO_MBPS[policy["tier"]]
+
+    started = time.perf_counter()
+    result = apply_tc_bandwidth_policies(policies)
+    result["apply_seconds"] = round(time.perf_counter() - started, 3)
+    print(json.dumps(result, default=str))
+
+
+def measure_downloads(client_count, seconds):
+    servers = [
+        subprocess.Popen(
+            ["ip", "netns", "exec", SERVER_NS, "iperf3", "-s", "-1", "-p", str(IPERF_BASE_PORT + i)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for i in range(client_count)
+    ]
+    time.sleep(0.5)
+
+    clients = [
+        subprocess.Popen(
+            ["ip", "netns", "exec", f"{CLIENT_NS_PREFIX}{i}", "iperf3", "-c", SERVER_IP,
+             "-p", str(IPERF_BASE_PORT + i), "-R", "-t", str(seconds), "-J"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        for i in range(client_count)
+    ]
+
+    mbps = []
+    for proc in clients:
+        out, _ = proc.communicate()
+        try:
+            bits = json.loads(out)["end"]["sum_received"]["bits_per_second"]
+        except (ValueError, KeyError):
+            bits = 0.0
+        mbps.append(bits / 1e6)
+
+    for proc in servers:
+        proc.kill()
+        proc.wait()
+    return mbps
+
+
+def jain_index(values):
+    total = sum(values)
+    squares = sum(v * v for v in values)
+    if not values or squares == 0:
+        return 0.0
+    return total * total / (len(values) * squares)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare HTB and CAKE shaping engines in network namespaces')
+    parser.add_argument('--clients', type=int, default=12, help='Client namespaces to create (default: 12)')
+    parser.add_argument('--seconds', type=int, default=10, help='iperf3 duration per engine')
+    parser.add_argument('--root-rate', type=int, default=100, help='BANDWIDTH_ROOT_RATE_MBPS for the run')
+    parser.add_argument('--engines', default='htb,cake', help='Comma-separated engines to compare')
+    parser.add_argument('--keep', action='store_true', help='Leave the namespaces in place afterwards')
+    parser.add_argument('--apply-policies', help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.apply_policies:
+        _apply_policies_here(args.apply_policies)
+        sys.exit(0)
+
+    if os.geteuid() != 0:
+        sys.exit("Run as root: namespaces and tc need CAP_NET_ADMIN")
+
+    build_topology(args.clients)
+    policies = bench_policies(args.clients)
+    try:
+        for engine in [e.strip() for e in args.engines.split(",") if e.strip()]:
+            status = apply_engine(engine, policies, args.root_rate)
+            if not status.get("success"):
+                print(f"[{engine}] apply reported errors: {status.get('errors')}")
+            mbps = measure_downloads(args.clients, args.seconds)
+
+            print(f"\n=== {engine} ===")
+            print(f"tc objects: {status.get('tc_objects')}  apply time: {status.get('apply_seconds')}s")
+            print(f"aggregate: {sum(mbps):.1f} Mbps  Jain fairness: {jain_index(mbps):.3f}")
+            for tier in TIERS:
+                tier_mbps = [m for m, p in zip(mbps, policies) if p["tier"] == tier]
+                if tier_mbps:
+                    print(f"  {tier:<6} n={len(tier_mbps):<3} mean={sum(tier_mbps) / len(tier_mbps):.2f} Mbps "
+                          f"min={min(tier_mbps):.2f} max={max(tier_mbps):.2f}")
+    finally:
+        if not args.keep:
+            teardown(args.clients)
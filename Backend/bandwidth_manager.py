@@ -16,9 +16,12 @@ import os
 import subprocess
 import threading
 import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from typing import Any, Dict, List, Optional
 
+from pymongo import UpdateOne
+
 from db import db, sessions_collection, users_collection
 
 try:
@@ -73,6 +76,22 @@ DEFAULT_TIER = "medium"
 
 _bandwidth_daemon_thread: Optional[threading.Thread] = None
 
+# Triggers arriving within this window share one reconcile run.
+BANDWIDTH_RECONCILE_DEBOUNCE_SECONDS = float(os.environ.get("BANDWIDTH_RECONCILE_DEBOUNCE_SECONDS", "0.3"))
+
+_reconcile_lock = threading.Lock()
+_reconcile_thread: Optional[threading.Thread] = None
+_reconcile_pending: Optional[Future] = None
+_reconcile_first_request = 0.0
+_reconcile_metrics: Dict[str, Any] = {
+    "requests": 0,
+    "runs": 0,
+    "last_duration_seconds": None,
+    "max_duration_seconds": 0.0,
+    "total_duration_seconds": 0.0,
+    "last_run_at": None,
+}
+
 
 def get_bandwidth_presets() -> Dict[str, int]:
     return dict(TIER_TO_MBPS)
@@ -401,10 +420,10 @@ def resolve_effective_bandwidth(user_doc: Dict[str, Any]) -> Dict[str, Any]:
     }
 
 
-def _tc_command(args: List[str]) -> subprocess.CompletedProcess:
-    commands: List[List[str]] = [["tc"] + args]
+def _net_command(binary: str, args: List[str]) -> subprocess.CompletedProcess:
+    commands: List[List[str]] = [[binary] + args]
     if os.geteuid() != 0:
-        commands.append(["sudo", "-n", "tc"] + args)
+        commands.append(["sudo", "-n", binary] + args)
 
     last_result: Optional[subprocess.CompletedProcess] = None
 
@@ -435,19 +454,27 @@ def _tc_command(args: List[str]) -> subprocess.CompletedProcess:
             or "not found" in stderr_text
         )
 
-        if command[0] == "tc" and needs_escalation and len(commands) > 1:
+        if command[0] == binary and needs_escalation and len(commands) > 1:
             continue
 
         return result
 
     return last_result or subprocess.CompletedProcess(
-        args=["tc"] + args,
+        args=[binary] + args,
         returncode=1,
         stdout="",
-        stderr="tc command failed",
+        stderr=f"{binary} command failed",
     )
 
 
+def _tc_command(args: List[str]) -> subprocess.CompletedProcess:
+    return _net_command("tc", args)
+
+
+def _ip_command(args: List[str]) -> subprocess.CompletedProcess:
+    return _net_command("ip", args)
+
+
 def _tc_error_message(result: subprocess.CompletedProcess) -> str:
     message = (result.stderr or "").strip() or (result.stdout or "").strip()
     lowered = message.lower()
@@ -460,6 +487,19 @@ def _tc_error_message(result: subprocess.CompletedProcess) -> str:
     return f"tc command failed with exit code {result.returncode}"
 
 
+SHAPING_ENGINES = ("htb", "cake")
+
+# Tier parents sit between the root 1:1 and the per-client 1:1000+ classes.
+_TIER_CLASSIDS: Dict[str, str] = {
+    "high": "1:10",
+    "medium": "1:20",
+    "low": "1:30",
+}
+
+# Guaranteed rate of the 1:999 class that catches unmatched traffic.
+_DEFAULT_CLASS_RATE_MBPS = 2
+
+
 def _classid_for_policy_index(index: int) -> str:
     # Keep class ids in safe range while avoiding collisions in normal operation.
     class_num = 1000 + (index % 54000)
@@ -480,13 +520,92 @@ def _priority_for_tier(tier: str) -> int:
     return 3
 
 
-def _ensure_qos_base(interface: str) -> Dict[str, Any]:
-    """Create/refresh root HTB classes for per-client shaping."""
-    root_rate_mbps = _clamp_custom_mbps(
+def get_shaping_engine() -> str:
+    """Shaping engine selected by BANDWIDTH_SHAPING_ENGINE: "htb" (default) or "cake"."""
+    engine = (os.environ.get("BANDWIDTH_SHAPING_ENGINE") or "htb").strip().lower()
+    return engine if engine in SHAPING_ENGINES else "htb"
+
+
+def _root_rate_mbps() -> int:
+    return _clamp_custom_mbps(
         os.environ.get("BANDWIDTH_ROOT_RATE_MBPS", "300"),
         default=300,
     )
 
+
+def _env_float(env_key: str, default_value: float, minimum: float, maximum: float) -> float:
+    try:
+        parsed = float(os.environ.get(env_key, default_value))
+    except (TypeError, ValueError):
+        parsed = float(default_value)
+    return max(minimum, min(maximum, parsed))
+
+
+def get_tier_hierarchy(
+    root_rate_mbps: Optional[int] = None,
+    tier_demand_mbps: Optional[Dict[str, int]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Per-tier HTB parent classes under 1:1.
+
+    With tier_demand_mbps (the summed per-client rates of each tier's members)
+    a tier is guaranteed exactly its members' demand. When the demand of all
+    tiers exceeds the root rate (less the 1:999 default class), every tier is
+    scaled down by the same factor, so guarantees never oversubscribe 1:1.
+    "scale" records that factor; children are shrunk by it too (see
+    _apply_htb_bandwidth_policies) so they never exceed their parent's rate.
+    Without demand each tier gets a share proportional to its TIER_TO_MBPS
+    value. Tiers may borrow idle capacity up to BANDWIDTH_TIER_CEIL_PERCENT
+    of the root.
+    """
+    root_rate = int(root_rate_mbps or _root_rate_mbps())
+    ceil_percent = _env_float("BANDWIDTH_TIER_CEIL_PERCENT", 100, 1, 100)
+    tier_ceil = max(1, int(root_rate * ceil_percent / 100))
+
+    available = max(len(TIER_TO_MBPS), root_rate - _DEFAULT_CLASS_RATE_MBPS)
+    if tier_demand_mbps is None:
+        total_weight = sum(TIER_TO_MBPS.values()) or 1
+        demand = {tier: available * TIER_TO_MBPS[tier] / total_weight for tier in TIER_TO_MBPS}
+        scale = 1.0
+    else:
+        demand = {tier: max(0, int(tier_demand_mbps.get(tier) or 0)) for tier in TIER_TO_MBPS}
+        total_demand = sum(demand.values())
+        scale = min(1.0, available / total_demand) if total_demand else 1.0
+
+    hierarchy: Dict[str, Dict[str, Any]] = {}
+    for tier in sorted(TIER_TO_MBPS, key=lambda name: TIER_ORDER.get(name, 0), reverse=True):
+        rate = max(1, int(demand[tier] * scale))
+        hierarchy[tier] = {
+            "classid": _TIER_CLASSIDS[tier],
+            "rate_mbps": min(rate, tier_ceil),
+            "ceil_mbps": tier_ceil,
+            "prio": _priority_for_tier(tier),
+            "scale": scale,
+        }
+    return hierarchy
+
+
+def _parent_tier_for_policy(tier: str, effective_mbps: int) -> str:
+    """Tier parent for a client; custom (manual) rates go to the closest tier at or below them."""
+    if tier in TIER_TO_MBPS:
+        return tier
+    fitting = [name for name, mbps in TIER_TO_MBPS.items() if mbps <= effective_mbps]
+    if not fitting:
+        return "low"
+    return max(fitting, key=lambda name: TIER_TO_MBPS[name])
+
+
+def _child_ceil_mbps(effective_mbps: int, tier_ceil_mbps: int) -> int:
+    """How far a client may borrow above its own rate when its tier has idle capacity."""
+    factor = _env_float("BANDWIDTH_CHILD_CEIL_FACTOR", 2.0, 1.0, 100.0)
+    return max(effective_mbps, min(tier_ceil_mbps, int(effective_mbps * factor)))
+
+
+def _ensure_qos_base(interface: str, tier_demand_mbps: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """Create/refresh root and per-tier HTB classes for per-client shaping."""
+    root_rate_mbps = _root_rate_mbps()
+    hierarchy = get_tier_hierarchy(root_rate_mbps, tier_demand_mbps)
+
     # Reset root qdisc to avoid stale/incompatible qdisc state.
     # Some kernels/drivers fail with "change operation not supported" when using replace.
     _tc_command(["qdisc", "del", "dev", interface, "root"])
@@ -509,9 +628,43 @@ def _ensure_qos_base(interface: str) -> Dict[str, Any]:
             "ceil",
             f"{root_rate_mbps}mbit",
         ],
-        ["class", "add", "dev", interface, "parent", "1:1", "classid", "1:999", "htb", "rate", "2mbit", "ceil", "5mbit", "prio", "7"],
+        [
+            "class",
+            "add",
+            "dev",
+            interface,
+            "parent",
+            "1:1",
+            "classid",
+            "1:999",
+            "htb",
+            "rate",
+            f"{_DEFAULT_CLASS_RATE_MBPS}mbit",
+            "ceil",
+            "5mbit",
+            "prio",
+            "7",
+        ],
         ["qdisc", "add", "dev", interface, "parent", "1:999", "handle", "1999:", "fq_codel"],
     ]
+    for tier_config in hierarchy.values():
+        commands.append([
+            "class",
+            "add",
+            "dev",
+            interface,
+            "parent",
+            "1:1",
+            "classid",
+            tier_config["classid"],
+            "htb",
+            "rate",
+            f"{tier_config['rate_mbps']}mbit",
+            "ceil",
+            f"{tier_config['ceil_mbps']}mbit",
+            "prio",
+            str(tier_config["prio"]),
+        ])
 
     for cmd in commands:
         result = _tc_command(cmd)
@@ -529,6 +682,7 @@ def _ensure_qos_base(interface: str) -> Dict[str, Any]:
         "success": True,
         "interface": interface,
         "ingress_enabled": ingress_enabled,
+        "tiers": hierarchy,
     }
 
 
@@ -540,12 +694,32 @@ def apply_tc_bandwidth_policies(client_policies: List[Dict[str, Any]]) -> Dict[s
     matched by destination client IP.
     """
     interface = _get_hotspot_interface()
+    if get_shaping_engine() == "cake":
+        return _apply_cake_bandwidth_policies(interface, client_policies)
+    return _apply_htb_bandwidth_policies(interface, client_policies)
+
+
+def _apply_htb_bandwidth_policies(interface: str, client_policies: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    One HTB class + fq_codel leaf + u32 filter per client under its tier parent.
 
-    setup_status = _ensure_qos_base(interface)
+    Tier rates are sized from this batch's membership on every call, so the
+    hierarchy follows clients joining and leaving tiers.
+    """
+    tier_demand: Dict[str, int] = {tier: 0 for tier in TIER_TO_MBPS}
+    for policy in client_policies:
+        if not str(policy.get("client_ip") or "").strip():
+            continue
+        effective_mbps = _clamp_custom_mbps(policy.get("effective_mbps"), default=TIER_TO_MBPS[DEFAULT_TIER])
+        tier = str(policy.get("tier") or DEFAULT_TIER)
+        tier_demand[_parent_tier_for_policy(tier, effective_mbps)] += effective_mbps
+
+    setup_status = _ensure_qos_base(interface, tier_demand)
     if not setup_status.get("success"):
         return {
             "success": False,
             "interface": interface,
+            "engine": "htb",
             "applied": 0,
             "failed": len(client_policies),
             "errors": [setup_status.get("message", "QoS base setup failed")],
@@ -557,6 +731,7 @@ def apply_tc_bandwidth_policies(client_policies: List[Dict[str, Any]]) -> Dict[s
     if ingress_enabled:
         _tc_command(["filter", "delete", "dev", interface, "parent", "ffff:"])
 
+    hierarchy = setup_status.get("tiers") or get_tier_hierarchy(tier_demand_mbps=tier_demand)
     applied = 0
     errors: List[str] = []
     warnings: List[str] = []
@@ -578,6 +753,11 @@ def apply_tc_bandwidth_policies(client_policies: List[Dict[str, Any]]) -> Dict[s
         classid = _classid_for_policy_index(index)
         qdisc_handle = _qdisc_handle_for_policy_index(index)
         filter_prio = 100 + index
+        parent_tier = _parent_tier_for_policy(tier, effective_mbps)
+        parent_config = hierarchy[parent_tier]
+        ceil_mbps = _child_ceil_mbps(effective_mbps, parent_config["ceil_mbps"])
+        # Shrink the guarantee with the tier so children sum to at most the parent rate.
+        guaranteed_mbps = max(1, int(effective_mbps * parent_config.get("scale", 1.0)))
 
         class_result = _tc_command(
             [
@@ -586,14 +766,14 @@ def apply_tc_bandwidth_policies(client_policies: List[Dict[str, Any]]) -> Dict[s
                 "dev",
                 interface,
                 "parent",
-                "1:1",
+                parent_config["classid"],
                 "classid",
                 classid,
                 "htb",
                 "rate",
-                f"{effective_mbps}mbit",
+                f"{guaranteed_mbps}mbit",
                 "ceil",
-                f"{effective_mbps}mbit",
+                f"{ceil_mbps}mbit",
                 "prio",
                 str(_priority_for_tier(tier)),
             ]
@@ -684,7 +864,10 @@ def apply_tc_bandwidth_policies(client_policies: List[Dict[str, Any]]) -> Dict[s
                     "roll_no": str(policy.get("roll_no") or ""),
                     "client_ip": client_ip,
                     "effective_mbps": effective_mbps,
+                    "guaranteed_mbps": guaranteed_mbps,
+                    "ceil_mbps": ceil_mbps,
                     "tier": _normalize_tier(tier),
+                    "parent_tier": parent_tier,
                     "classid": classid,
                 }
             )
@@ -701,6 +884,253 @@ def apply_tc_bandwidth_policies(client_policies: List[Dict[str, Any]]) -> Dict[s
         "warnings": warnings,
         "policies": applied_policies,
         "ingress_enabled": ingress_enabled,
+        "tiers": hierarchy,
+        "engine": "htb",
+        # root qdisc, 1:1, default class + leaf, tier parents, then class/leaf/filter(/police) per client
+        "tc_objects": 4 + len(hierarchy) + applied * (4 if ingress_enabled else 3),
+    }
+
+
+def _ifb_name_for_interface(interface: str) -> str:
+    # Interface names are capped at 15 characters.
+    return f"ifb-{interface}"[:15]
+
+
+def _ensure_cake_base(interface: str) -> Dict[str, Any]:
+    """
+    Replace the HTB tree with a single CAKE qdisc per direction.
+
+    Downloads: cake dual-dsthost on the hotspot egress, so each client IP
+    gets a fair share of the link. Uploads: ingress traffic is redirected to
+    an IFB device running cake dual-srchost. If the IFB device cannot be
+    created, uploads fall back to per-client policing only.
+    """
+    root_rate_mbps = _root_rate_mbps()
+    ifb_device = _ifb_name_for_interface(interface)
+
+    _tc_command(["qdisc", "del", "dev", interface, "root"])
+    _tc_command(["qdisc", "del", "dev", interface, "ingress"])
+
+    root_result = _tc_command([
+        "qdisc",
+        "add",
+        "dev",
+        interface,
+        "root",
+        "handle",
+        "1:",
+        "cake",
+        "bandwidth",
+        f"{root_rate_mbps}mbit",
+        "dual-dsthost",
+    ])
+    if root_result.returncode != 0:
+        message = _tc_error_message(root_result)
+        logger.warning("cake setup failed on %s: %s", interface, message)
+        return {"success": False, "message": message, "interface": interface}
+
+    ingress_result = _tc_command(["qdisc", "add", "dev", interface, "handle", "ffff:", "ingress"])
+    ingress_enabled = ingress_result.returncode == 0
+    if not ingress_enabled:
+        logger.warning("ingress qdisc setup failed on %s: %s", interface, _tc_error_message(ingress_result))
+
+    upload_cake = False
+    if ingress_enabled:
+        _ip_command(["link", "add", ifb_device, "type", "ifb"])
+        _tc_command(["qdisc", "del", "dev", ifb_device, "root"])
+        steps = [
+            _ip_command(["link", "set", "dev", ifb_device, "up"]),
+            _tc_command([
+                "qdisc",
+                "add",
+                "dev",
+                ifb_device,
+                "root",
+                "cake",
+                "bandwidth",
+                f"{root_rate_mbps}mbit",
+                "dual-srchost",
+            ]),
+        ]
+        failed = [step for step in steps if step.returncode != 0]
+        if failed:
+            logger.warning("IFB upload shaping unavailable on %s: %s", ifb_device, _tc_error_message(failed[0]))
+        else:
+            upload_cake = True
+
+    return {
+        "success": True,
+        "interface": interface,
+        "ingress_enabled": ingress_enabled,
+        "ifb_device": ifb_device if upload_cake else None,
+        "root_rate_mbps": root_rate_mbps,
+    }
+
+
+def _apply_cake_bandwidth_policies(interface: str, client_policies: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Fairness comes from CAKE host isolation; per-user caps are layered on as
+    u32 police filters only for clients whose cap is below the link rate
+    (and only when BANDWIDTH_CAKE_ENFORCE_CAPS is not "0").
+    """
+    setup_status = _ensure_cake_base(interface)
+    if not setup_status.get("success"):
+        return {
+            "success": False,
+            "interface": interface,
+            "engine": "cake",
+            "applied": 0,
+            "failed": len(client_policies),
+            "errors": [setup_status.get("message", "CAKE setup failed")],
+        }
+
+    root_rate_mbps = int(setup_status["root_rate_mbps"])
+    ingress_enabled = bool(setup_status.get("ingress_enabled", False))
+    ifb_device = setup_status.get("ifb_device")
+    enforce_caps = (os.environ.get("BANDWIDTH_CAKE_ENFORCE_CAPS") or "1").strip() != "0"
+
+    applied = 0
+    capped = 0
+    tc_objects = 1 + (1 if ingress_enabled else 0) + (1 if ifb_device else 0)
+    errors: List[str] = []
+    warnings: List[str] = []
+    applied_policies: List[Dict[str, Any]] = []
+
+    for index, policy in enumerate(client_policies, start=1):
+        client_ip = str(policy.get("client_ip") or "").strip()
+        if not client_ip:
+            continue
+
+        try:
+            ipaddress.ip_address(client_ip)
+        except ValueError:
+            errors.append(f"{client_ip}: invalid client IP")
+            continue
+
+        effective_mbps = _clamp_custom_mbps(policy.get("effective_mbps"), default=TIER_TO_MBPS[DEFAULT_TIER])
+        tier = str(policy.get("tier") or DEFAULT_TIER)
+        filter_prio = 100 + index
+        needs_cap = enforce_caps and effective_mbps < root_rate_mbps
+
+        if needs_cap:
+            result = _tc_command([
+                "filter",
+                "add",
+                "dev",
+                interface,
+                "parent",
+                "1:",
+                "protocol",
+                "ip",
+                "prio",
+                str(filter_prio),
+                "u32",
+                "match",
+                "ip",
+                "dst",
+                f"{client_ip}/32",
+                "action",
+                "police",
+                "rate",
+                f"{effective_mbps}mbit",
+                "burst",
+                "64k",
+                "conform-exceed",
+                "drop/ok",
+            ])
+            if result.returncode != 0:
+                errors.append(f"{client_ip}: {_tc_error_message(result)}")
+                continue
+            tc_objects += 1
+            capped += 1
+
+        if ingress_enabled and (needs_cap or not ifb_device):
+            # Police the upload cap, then hand conforming packets on to the IFB cake.
+            ingress_cmd = [
+                "filter",
+                "add",
+                "dev",
+                interface,
+                "parent",
+                "ffff:",
+                "protocol",
+                "ip",
+                "prio",
+                str(filter_prio),
+                "u32",
+                "match",
+                "ip",
+                "src",
+                f"{client_ip}/32",
+                "action",
+                "police",
+                "rate",
+                f"{effective_mbps}mbit",
+                "burst",
+                "64k",
+                "conform-exceed",
+                "drop/pipe" if ifb_device else "drop/ok",
+            ]
+            if ifb_device:
+                ingress_cmd += ["action", "mirred", "egress", "redirect", "dev", ifb_device]
+            ingress_filter_result = _tc_command(ingress_cmd)
+            if ingress_filter_result.returncode != 0:
+                warnings.append(
+                    f"{client_ip}: upload shaping not applied: {_tc_error_message(ingress_filter_result)}"
+                )
+            else:
+                tc_objects += 1
+
+        applied += 1
+        applied_policies.append(
+            {
+                "roll_no": str(policy.get("roll_no") or ""),
+                "client_ip": client_ip,
+                "effective_mbps": effective_mbps,
+                "tier": _normalize_tier(tier),
+                "capped": needs_cap,
+            }
+        )
+
+    if ingress_enabled and ifb_device:
+        # Everything not matched by a per-client filter above still goes through the IFB cake.
+        redirect_result = _tc_command([
+            "filter",
+            "add",
+            "dev",
+            interface,
+            "parent",
+            "ffff:",
+            "protocol",
+            "all",
+            "prio",
+            "65000",
+            "matchall",
+            "action",
+            "mirred",
+            "egress",
+            "redirect",
+            "dev",
+            ifb_device,
+        ])
+        if redirect_result.returncode != 0:
+            warnings.append(f"upload redirect to {ifb_device} failed: {_tc_error_message(redirect_result)}")
+        else:
+            tc_objects += 1
+
+    return {
+        "success": len(errors) == 0,
+        "interface": interface,
+        "applied": applied,
+        "failed": len(errors),
+        "errors": errors,
+        "warnings": warnings,
+        "policies": applied_policies,
+        "ingress_enabled": ingress_enabled,
+        "engine": "cake",
+        "ifb_device": ifb_device,
+        "capped": capped,
+        "tc_objects": tc_objects,
     }
 
 
@@ -726,11 +1156,29 @@ def assign_auto_bandwidth(roll_no: str) -> Dict[str, Any]:
     return recommendation
 
 
-def apply_bandwidth_for_active_users() -> Dict[str, Any]:
+# user field -> resolve_effective_bandwidth() key
+_EFFECTIVE_POLICY_FIELDS: Dict[str, str] = {
+    "bandwidth_effective_mode": "mode",
+    "bandwidth_effective_tier": "tier",
+    "bandwidth_effective_mbps": "effective_mbps",
+}
+# Everything resolve_effective_bandwidth() reads, plus the stored effective values.
+_EFFECTIVE_POLICY_INPUT_FIELDS = (
+    "bandwidth_limit",
+    "bandwidth_custom_value",
+    "bandwidth_auto_assigned",
+    *_EFFECTIVE_POLICY_FIELDS,
+)
+
+
+def _reconcile_active_bandwidth() -> Dict[str, Any]:
     """Resolve bandwidth for active sessions and apply tc filters."""
-    active_sessions = list(sessions_collection.find({"status": "active"}))
+    active_sessions = list(
+        sessions_collection.find({"status": "active"}, {"roll_no": 1, "client_ip": 1})
+    )
     policies: List[Dict[str, Any]] = []
     skipped_sessions: List[Dict[str, Any]] = []
+    shaped_sessions: List[Dict[str, str]] = []
     hotspot_network = _get_hotspot_network()
 
     for session in active_sessions:
@@ -768,26 +1216,46 @@ def apply_bandwidth_for_active_users() -> Dict[str, Any]:
             )
             continue
 
-        user_doc = users_collection.find_one({"roll_no": roll_no}) or {}
+        shaped_sessions.append({"roll_no": roll_no, "client_ip": client_ip})
+
+    # One $in round-trip for every user instead of a find_one per session.
+    users_by_roll_no: Dict[str, Dict[str, Any]] = {}
+    if shaped_sessions:
+        roll_nos = sorted({entry["roll_no"] for entry in shaped_sessions})
+        for user_doc in users_collection.find(
+            {"roll_no": {"$in": roll_nos}},
+            {"_id": 0, "roll_no": 1, **{field: 1 for field in _EFFECTIVE_POLICY_INPUT_FIELDS}},
+        ):
+            users_by_roll_no[str(user_doc.get("roll_no"))] = user_doc
+
+    now = datetime.utcnow()
+    user_updates: List[UpdateOne] = []
+    seen_roll_nos = set()
+    for entry in shaped_sessions:
+        roll_no = entry["roll_no"]
+        user_doc = users_by_roll_no.get(roll_no) or {}
         resolved = resolve_effective_bandwidth(user_doc)
-        policy = {
-            "roll_no": roll_no,
-            "client_ip": client_ip,
-            **resolved,
+        policies.append({**entry, **resolved})
+
+        if roll_no in seen_roll_nos:
+            continue
+        seen_roll_nos.add(roll_no)
+
+        # Only persist effective fields that actually changed.
+        changed = {
+            field: resolved[key]
+            for field, key in _EFFECTIVE_POLICY_FIELDS.items()
+            if user_doc.get(field) != resolved[key]
         }
-        policies.append(policy)
+        if changed:
+            changed["bandwidth_last_applied"] = now
+            user_updates.append(UpdateOne({"roll_no": roll_no}, {"$set": changed}))
 
-        users_collection.update_one(
-            {"roll_no": roll_no},
-            {
-                "$set": {
-                    "bandwidth_effective_mode": resolved["mode"],
-                    "bandwidth_effective_tier": resolved["tier"],
-                    "bandwidth_effective_mbps": resolved["effective_mbps"],
-                    "bandwidth_last_applied": datetime.utcnow(),
-                }
-            },
-        )
+    if user_updates:
+        try:
+            users_collection.bulk_write(user_updates, ordered=False)
+        except Exception as error:
+            logger.warning("Failed to persist effective bandwidth for %d user(s): %s", len(user_updates), error)
 
     if not policies:
         return {
@@ -814,6 +1282,104 @@ def apply_bandwidth_for_active_users() -> Dict[str, Any]:
     }
 
 
+def _bandwidth_reconcile_worker() -> None:
+    global _reconcile_thread, _reconcile_pending, _reconcile_first_request
+
+    while True:
+        with _reconcile_lock:
+            future = _reconcile_pending
+            if future is None:
+                _reconcile_thread = None
+                return
+            wait_seconds = _reconcile_first_request + BANDWIDTH_RECONCILE_DEBOUNCE_SECONDS - time.monotonic()
+
+        # Let a burst of triggers land on the same pending run.
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+        with _reconcile_lock:
+            future = _reconcile_pending
+            _reconcile_pending = None
+            _reconcile_first_request = 0.0
+
+        if future is None or not future.set_running_or_notify_cancel():
+            continue
+
+        started = time.monotonic()
+        try:
+            result = _reconcile_active_bandwidth()
+        except Exception as error:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        finally:
+            duration = time.monotonic() - started
+            with _reconcile_lock:
+                _reconcile_metrics["runs"] += 1
+                _reconcile_metrics["last_duration_seconds"] = round(duration, 3)
+                _reconcile_metrics["total_duration_seconds"] += duration
+                _reconcile_metrics["max_duration_seconds"] = round(
+                    max(_reconcile_metrics["max_duration_seconds"], duration), 3
+                )
+                _reconcile_metrics["last_run_at"] = datetime.utcnow().isoformat()
+
+
+def request_bandwidth_reconcile() -> Future:
+    """
+    Schedule a reconcile of active-user shaping.
+
+    Calls within BANDWIDTH_RECONCILE_DEBOUNCE_SECONDS of each other share
+    one run, and at most one run is in flight; a trigger that arrives
+    mid-run queues exactly one follow-up. The returned Future resolves to
+    the run's result.
+    """
+    global _reconcile_thread, _reconcile_pending, _reconcile_first_request
+
+    with _reconcile_lock:
+        _reconcile_metrics["requests"] += 1
+        if _reconcile_pending is None:
+            _reconcile_pending = Future()
+            _reconcile_first_request = time.monotonic()
+        future = _reconcile_pending
+
+        if _reconcile_thread is None or not _reconcile_thread.is_alive():
+            _reconcile_thread = threading.Thread(
+                target=_bandwidth_reconcile_worker,
+                name="bandwidth-reconcile",
+                daemon=True,
+            )
+            _reconcile_thread.start()
+
+    return future
+
+
+def apply_bandwidth_for_active_users(wait: bool = True, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Resolve bandwidth for active sessions and apply tc filters (coalesced).
+
+    With wait=False the reconcile is only scheduled and a placeholder
+    result is returned immediately.
+    """
+    future = request_bandwidth_reconcile()
+    if not wait:
+        return {"scheduled": True}
+    return future.result(timeout=timeout)
+
+
+def get_bandwidth_reconcile_metrics() -> Dict[str, Any]:
+    with _reconcile_lock:
+        metrics = dict(_reconcile_metrics)
+        metrics["pending"] = _reconcile_pending is not None
+        metrics["in_flight"] = _reconcile_thread is not None and _reconcile_thread.is_alive()
+
+    runs = metrics["runs"]
+    metrics["coalesce_ratio"] = round(metrics["requests"] / runs, 2) if runs else None
+    metrics["avg_duration_seconds"] = round(metrics["total_duration_seconds"] / runs, 3) if runs else None
+    metrics["total_duration_seconds"] = round(metrics["total_duration_seconds"], 3)
+    metrics["debounce_seconds"] = BANDWIDTH_RECONCILE_DEBOUNCE_SECONDS
+    return metrics
+
+
 def refresh_auto_bandwidth_profiles(confidence_threshold: float = 0.5) -> Dict[str, Any]:
     """Recompute auto-tier users and apply latest policies for active sessions."""
     auto_users = list(users_collection.find({"role": "student", "bandwidth_limit": "auto"}))
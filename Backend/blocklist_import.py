@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""
+Blocklist Import - Ingest hosts-format / domain-list / adblock files into a filter category
+Lists are stored as sorted, zlib-compressed chunks (not one giant config document) and
+streamed into the compiled domain policy, so Flask workers never hold them in memory
+"""
+
+import datetime
+import gzip
+import hashlib
+import ipaddress
+import logging
+import os
+import sys
+import uuid
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from domain_policy import normalize_pattern
+
+logger = logging.getLogger(__name__)
+
+BLOCKLIST_CHUNK_SIZE = int(os.environ.get("BLOCKLIST_CHUNK_SIZE", "20000"))
+BLOCKLIST_INSERT_BATCH = 50
+_SINK_ADDRESSES = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+# Names hosts files map to a sink address that must never become blocks.
+_HOSTS_IGNORED_NAMES = {
+    "localhost", "localhost.localdomain", "local", "broadcasthost",
+    "ip6-localhost", "ip6-loopback", "ip6-localnet", "ip6-mcastprefix",
+    "ip6-allnodes", "ip6-allrouters", "ip6-allhosts", "0.0.0.0",
+}
+
+
+def _lists_collection():
+    from db import web_filter_lists_collection
+
+    return web_filter_lists_collection
+
+
+def _is_ip(value: str) -> bool:
+    if value in _SINK_ADDRESSES:
+        return True
+    if not (value[:1].isdigit() or ":" in value):
+        return False
+    try:
+        ipaddress.ip_address(value)
+        return True
+    except ValueError:
+        return False
+
+
+def parse_blocklist_line(line: str) -> List[str]:
+    """Domains named on one line of a hosts file, plain domain list or adblock list."""
+    line = line.strip()
+    if not line or line[0] in "#![" or line.startswith("@@"):
+        return []
+
+    if line.startswith("||"):
+        # Adblock: only plain "||domain^" rules; anything with options or paths is conditional.
+        body, sep, rest = line[2:].partition("^")
+        names = [body] if sep and not rest else []
+    else:
+        parts = line.split("#", 1)[0].split()
+        if len(parts) >= 2 and _is_ip(parts[0]):
+            names = parts[1:]
+        elif len(parts) == 1:
+            names = parts
+        else:
+            names = []
+
+    domains = []
+    for name in names:
+        pattern = normalize_pattern(name)
+        if not pattern or pattern in _HOSTS_IGNORED_NAMES or "." not in pattern or _is_ip(pattern):
+            continue
+        domains.append(pattern)
+    return domains
+
+
+def iter_blocklist_domains(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        yield from parse_blocklist_line(line)
+
+
+def open_blocklist(path: str):
+    """Text stream for a list file ("-" for stdin, .gz handled transparently)."""
+    if path == "-":
+        return sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def encode_chunk(domains: List[str]) -> bytes:
+    return zlib.compress("\n".join(domains).encode("utf-8"), 6)
+
+
+def decode_chunk(data: bytes) -> List[str]:
+    text = zlib.decompress(bytes(data)).decode("utf-8")
+    return text.split("\n") if text else []
+
+
+def _chunked(domains: List[str], chunk_size: int) -> Iterator[List[str]]:
+    for start in range(0, len(domains), chunk_size):
+        yield domains[start:start + chunk_size]
+
+
+def _list_id_for(path: str, category: str) -> str:
+    base = os.path.basename(path).split(".")[0] if path != "-" else "stdin"
+    return f"{category}:{base}".lower().replace(" ", "-")
+
+
+def _ensure_indexes(collection) -> None:
+    collection.create_index([("type", 1), ("list_id", 1), ("import_id", 1), ("seq", 1)])
+    collection.create_index([("type", 1), ("category", 1)])
+
+
+def import_blocklist(lines: Iterable[str], category: str, list_id: str, source: str = "",
+                     chunk_size: int = BLOCKLIST_CHUNK_SIZE, collection=None) -> Dict:
+    """
+    Replace list_id with the domains in lines.
+
+    New chunks are written under a fresh import_id, the manifest is switched
+    to it, and only then are the previous chunks deleted, so readers always
+    see one complete import. An identical list is not rewritten.
+    """
+    collection = collection if collection is not None else _lists_collection()
+    domains = sorted(set(iter_blocklist_domains(lines)))
+    digest = hashlib.sha256("\n".join(domains).encode("utf-8")).hexdigest()
+
+    existing = collection.find_one({"type": "manifest", "list_id": list_id})
+    if existing and existing.get("sha256") == digest and existing.get("category") == category:
+        logger.info("Blocklist %s unchanged (%d entries)", list_id, len(domains))
+        return {**{k: v for k, v in existing.items() if k != "_id"}, "changed": False}
+
+    _ensure_indexes(collection)
+    import_id = uuid.uuid4().hex
+    batch: List[Dict] = []
+    stored_bytes = 0
+    seq = -1
+    for seq, chunk in enumerate(_chunked(domains, max(1, chunk_size))):
+        data = encode_chunk(chunk)
+        stored_bytes += len(data)
+        batch.append({
+            "type": "chunk",
+            "list_id": list_id,
+            "import_id": import_id,
+            "seq": seq,
+            "count": len(chunk),
+            "first": chunk[0],
+            "last": chunk[-1],
+            "data": data,
+        })
+        if len(batch) >= BLOCKLIST_INSERT_BATCH:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+    manifest = {
+        "type": "manifest",
+        "list_id": list_id,
+        "category": category,
+        "source": source,
+        "entries": len(domains),
+        "chunks": seq + 1,
+        "stored_bytes": stored_bytes,
+        "sha256": digest,
+        "import_id": import_id,
+        "imported_at": datetime.datetime.utcnow(),
+    }
+    collection.update_one({"type": "manifest", "list_id": list_id}, {"$set": manifest}, upsert=True)
+    collection.delete_many({"type": "chunk", "list_id": list_id, "import_id": {"$ne": import_id}})
+    logger.info("Imported %d domains into %s (%d chunks, %d bytes)", len(domains), list_id, seq + 1, stored_bytes)
+    return {**manifest, "changed": True}
+
+
+def list_manifests(collection=None) -> List[Dict]:
+    collection = collection if collection is not None else _lists_collection()
+    return list(collection.find({"type": "manifest"}, {"_id": 0}).sort("list_id", 1))
+
+
+def remove_blocklist(list_id: str, collection=None) -> bool:
+    collection = collection if collection is not None else _lists_collection()
+    removed = collection.delete_one({"type": "manifest", "list_id": list_id}).deleted_count
+    collection.delete_many({"type": "chunk", "list_id": list_id})
+    return bool(removed)
+
+
+def iter_list_domains(manifest: Dict, collection=None) -> Iterator[str]:
+    """Stream one list's domains chunk by chunk."""
+    collection = collection if collection is not None else _lists_collection()
+    cursor = collection.find(
+        {"type": "chunk", "list_id": manifest["list_id"], "import_id": manifest["import_id"]},
+        {"_id": 0, "data": 1},
+    ).sort("seq", 1)
+    for chunk in cursor:
+        yield from decode_chunk(chunk["data"])
+
+
+def external_list_source(config: Optional[Dict], collection=None) -> Tuple[Iterator[Tuple[str, str]], str]:
+    """
+    (pattern, category) stream of lists whose category is active, plus a digest
+    of those lists so an unchanged set is detected without reading any chunk.
+    """
+    active = sorted(
+        name for name, details in ((config or {}).get("categories") or {}).items()
+        if (details or {}).get("active", False)
+    )
+    if not active:
+        return iter(()), ""
+
+    collection = collection if collection is not None else _lists_collection()
+    manifests = list(collection.find(
+        {"type": "manifest", "category": {"$in": active}},
+        {"_id": 0, "list_id": 1, "import_id": 1, "category": 1, "sha256": 1},
+    ).sort("list_id", 1))
+    if not manifests:
+        return iter(()), ""
+
+    digest = hashlib.sha256("".join(
+        f"{m['list_id']}\t{m['category']}\t{m['sha256']}\n" for m in manifests
+    ).encode("utf-8")).hexdigest()
+
+    def stream() -> Iterator[Tuple[str, str]]:
+        for manifest in manifests:
+            for domain in iter_list_domains(manifest, collection):
+                yield domain, manifest["category"]
+
+    return stream(), digest
+
+
+def _ensure_category(category: str) -> bool:
+    """Add an (inactive) empty category to the web_filter config if it is missing."""
+    from db import web_filter_collection
+
+    config = web_filter_collection.find_one({"type": "config"}) or {}
+    if category in (config.get("categories") or {}):
+        return False
+    web_filter_collection.update_one(
+        {"type": "config"},
+        {"$set": {f"categories.{category}": {"active": False, "sites": []}}},
+        upsert=True,
+    )
+    return True
+
+
+def _synthetic_hosts_lines(count: int) -> List[str]:
+    import random
+
+    rng = random.Random(42)
+    tlds = ["com", "net", "org", "io", "co.uk", "info", "xyz"]
+    alphabet = "abcdefghijklmnopqrstuvwxyz0123456789"
+    lines = ["# synthetic benchmark list", "127.0.0.1 localhost"]
+    for index in range(count):
+        name = "".join(rng.choice(alphabet) for _ in range(rng.randint(5, 14)))
+        host = f"{name}{index}.{rng.choice(tlds)}"
+        if index % 4 == 0:
+            host = f"{rng.choice(['ads', 'cdn', 'track', 'www'])}.{host}"
+        lines.append(f"0.0.0.0 {host}")
+    return lines
+
+
+def run_benchmark(count: int, lookups: int) -> None:
+    """Offline ingestion + lookup benchmark (no MongoDB or dnsmasq needed)."""
+    import random
+    import resource
+    import tempfile
+    import time
+
+    from domain_policy import compile_domain_policy, load_domain_policy
+
+    lines = _synthetic_hosts_lines(count)
+    raw_bytes = sum(len(line) + 1 for line in lines)
+
+    started = time.perf_counter()
+    domains = sorted(set(iter_blocklist_domains(lines)))
+    parse_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chunks = [encode_chunk(chunk) for chunk in _chunked(domains, BLOCKLIST_CHUNK_SIZE)]
+    encode_s = time.perf_counter() - started
+    stored = sum(len(c) for c in chunks)
+
+    started = time.perf_counter()
+    data = compile_domain_policy({}, ((d, "Bench") for c in chunks for d in decode_chunk(c)), "bench")
+    compile_s = time.perf_counter() - started
+
+    path = os.path.join(tempfile.mkdtemp(prefix="blocklist-bench-"), "domain_policy.bin")
+    with open(path, "wb") as f:
+        f.write(data)
+    started = time.perf_counter()
+    policy = load_domain_policy(path)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    rng = random.Random(7)
+    hits = [f"x{i}.{rng.choice(domains)}" for i in range(lookups)]
+    misses = [f"nothere{i}.example-{i % 97}.com" for i in range(lookups)]
+    started = time.perf_counter()
+    matched = sum(1 for name in hits if policy.is_blocked(name))
+    hit_s = time.perf_counter() - started
+    started = time.perf_counter()
+    matched_misses = sum(1 for name in misses if policy.is_blocked(name))
+    miss_s = time.perf_counter() - started
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Parsed {len(lines):,} lines -> {len(domains):,} domains in {parse_s:.2f}s "
+          f"({len(lines) / max(parse_s, 1e-9):,.0f} lines/s)")
+    print(f"Stored {len(chunks)} chunks: {stored / 1e6:.1f} MB (raw {raw_bytes / 1e6:.1f} MB, "
+          f"{stored / max(raw_bytes, 1):.0%}) in {encode_s:.2f}s")
+    print(f"Compiled policy: {len(data) / 1e6:.1f} MB in {compile_s:.2f}s, mmap load {load_ms:.2f} ms")
+    print(f"Lookups: {lookups / max(hit_s, 1e-9):,.0f}/s hits ({matched}/{lookups} matched), "
+          f"{lookups / max(miss_s, 1e-9):,.0f}/s misses ({matched_misses} false matches)")
+    print(f"Peak RSS {peak_rss_mb:.0f} MB")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Import large external blocklists into a filter category')
+    parser.add_argument('file', nargs='?', help='hosts / domain-list / adblock file (.gz ok, "-" for stdin)')
+    parser.add_argument('--category', help='web_filter category the list belongs to (e.g. "Proxy/VPN")')
+    parser.add_argument('--list-id', help='Stable id for re-imports (default: category:filename)')
+    parser.add_argument('--chunk-size', type=int, default=BLOCKLIST_CHUNK_SIZE)
+    parser.add_argument('--apply', action='store_true', help='Recompile the domain policy and reload dnsmasq')
+    parser.add_argument('--list', action='store_true', help='Show imported lists')
+    parser.add_argument('--remove', metavar='LIST_ID', help='Delete an imported list')
+    parser.add_argument('--bench', type=int, metavar='N', help='Offline benchmark with N synthetic domains')
+    parser.add_argument('--bench-lookups', type=int, default=200000)
+
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args.bench, args.bench_lookups)
+        sys.exit(0)
+
+    if args.list:
+        for item in list_manifests():
+            print(f"{item['list_id']:<40} {item['category']:<16} {item['entries']:>9,} entries "
+                  f"{item.get('stored_bytes', 0) / 1e6:6.1f} MB  {item.get('imported_at')}")
+    elif args.remove:
+        print("Removed" if remove_blocklist(args.remove) else f"No list {args.remove}")
+    elif args.file:
+        if not args.category:
+            parser.error("--category is required when importing")
+        if _ensure_category(args.category):
+            print(f"Created inactive category {args.category!r}; enable it in the dashboard to enforce it")
+        with open_blocklist(args.file) as stream:
+            result = import_blocklist(
+                stream,
+                args.category,
+                args.list_id or _list_id_for(args.file, args.category),
+                source=os.path.abspath(args.file) if args.file != "-" else "stdin",
+                chunk_size=args.chunk_size,
+            )
+        print(f"{result['list_id']}: {result['entries']:,} domains "
+              f"({'imported' if result['changed'] else 'unchanged'})")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.apply:
+        from dns_filtering_manager import update_dnsmasq_blocklist
+        from domain_policy import rebuild_domain_policy
+
+        policy, changed = rebuild_domain_policy()
+        print(f"Domain policy {'rebuilt' if changed else 'unchanged'} ({policy.digest[:12]})")
+        update_dnsmasq_blocklist(set(policy.patterns()))
@@ -9,3 +9,23 @@ admins_collection = db["admins"]
 sessions_collection = db["active_sessions"]
 blocked_users_collection = db["blocked_users"]
 web_filter_collection = db["web_filter"]
+# Imported external blocklists (manifests + compressed domain chunks)
+web_filter_lists_collection = db["web_filter_lists"]
+# Per-day byte rollups used by the bandwidth reports
+usage_daily_collection = db["usage_daily"]
+
+
+def daily_usage_update(roll_no, user_inc, now):
+    """Return (filter, update) that adds a user's byte deltas to today's rollup."""
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+    return (
+        {"roll_no": roll_no, "day": day},
+        {
+            "$inc": {
+                "total_bytes": user_inc.get("total_data_bytes", 0),
+                "upload_bytes": user_inc.get("total_upload_bytes", 0),
+                "download_bytes": user_inc.get("total_download_bytes", 0),
+            },
+            "$set": {"updated_at": now},
+        },
+    )
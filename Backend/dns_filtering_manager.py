@@ -5,18 +5,39 @@ Manages domain blocking via dnsmasq for reliable web filtering
 """
 
 import subprocess
+import hashlib
 import logging
 import os
+import signal
 import tempfile
-from typing import List, Set, Optional
-from db import web_filter_collection
+from typing import Iterable, List, Set, Optional
+from domain_policy import get_domain_policy, normalize_pattern
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# dnsmasq only re-reads addn-hosts and servers-file on SIGHUP, so the
+# blocklist lives there; blocklist.conf just points at them and only
+# changes (needing a restart) when those paths change.
 DNSMASQ_BLOCKLIST_FILE = "/etc/dnsmasq.d/blocklist.conf"
+DNSMASQ_BLOCK_HOSTS_FILE = os.environ.get("DNSMASQ_BLOCK_HOSTS_FILE", "/etc/dnsmasq.blocklist.hosts")
+DNSMASQ_BLOCK_SERVERS_FILE = os.environ.get("DNSMASQ_BLOCK_SERVERS_FILE", "/etc/dnsmasq.blocklist.servers")
 DNSMASQ_APPLY_HELPER = os.environ.get("DNSMASQ_APPLY_HELPER", "/usr/local/sbin/wifi-dnsmasq-apply")
 
+DNSMASQ_MANAGED_FILES = {
+    "include": DNSMASQ_BLOCKLIST_FILE,
+    "hosts": DNSMASQ_BLOCK_HOSTS_FILE,
+    "servers": DNSMASQ_BLOCK_SERVERS_FILE,
+}
+
+# Filter groups get their own DNS-only dnsmasq instance ("view"); clients in a
+# group's ipset are redirected to its port. dnsmasq tags only select DHCP
+# options, so separate instances are what gives per-client DNS answers.
+DNS_VIEW_DIR = os.environ.get("DNS_VIEW_DIR", "/etc/dnsmasq.groups")
+DNS_VIEW_RUN_DIR = os.environ.get("DNS_VIEW_RUN_DIR", "/run")
+DNS_VIEW_BASE_PORT = int(os.environ.get("DNS_VIEW_BASE_PORT", "5400"))
+HOTSPOT_GATEWAY_IP = os.environ.get("HOTSPOT_GATEWAY_IP", "192.168.50.1")
+
 
 def _run_privileged_command(args: List[str], check: bool = True) -> subprocess.CompletedProcess:
     """Run a command with root privileges without interactive sudo prompts."""
@@ -32,51 +53,85 @@ def _run_privileged_command(args: List[str], check: bool = True) -> subprocess.C
     return result
 
 
-def _apply_dnsmasq_changes(temp_file: Optional[str] = None, clear: bool = False) -> None:
-    """
-    Apply dnsmasq changes using privileged helper if available.
-    Falls back to direct root commands when helper is unavailable.
-    """
-    helper_exists = os.path.exists(DNSMASQ_APPLY_HELPER) and os.access(DNSMASQ_APPLY_HELPER, os.X_OK)
+def _helper_available() -> bool:
+    return os.path.exists(DNSMASQ_APPLY_HELPER) and os.access(DNSMASQ_APPLY_HELPER, os.X_OK)
+
 
-    if helper_exists:
-        helper_args = [DNSMASQ_APPLY_HELPER, "--clear"] if clear else [DNSMASQ_APPLY_HELPER, str(temp_file or "")]
-        _run_privileged_command(helper_args, check=True)
+def _install_dnsmasq_file(kind: str, content: str) -> None:
+    """Install one managed file (include/hosts/servers) via the helper or directly as root."""
+    temp_file = None
+    try:
+        with tempfile.NamedTemporaryFile(mode='w', delete=False, prefix=f"dnsmasq-{kind}-") as f:
+            f.write(content)
+            temp_file = f.name
+
+        if _helper_available():
+            _run_privileged_command([DNSMASQ_APPLY_HELPER, kind, temp_file], check=True)
+            return
+
+        _run_privileged_command([
+            "install", "-o", "root", "-g", "root", "-m", "0644", temp_file, DNSMASQ_MANAGED_FILES[kind]
+        ], check=True)
+    finally:
+        if temp_file and os.path.exists(temp_file):
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+
+
+def _dnsmasq_service_command(action: str) -> None:
+    """action is "reload" (SIGHUP: re-read hosts/servers files) or "restart"."""
+    if _helper_available():
+        _run_privileged_command([DNSMASQ_APPLY_HELPER, action], check=True)
         return
 
-    if clear:
-        _run_privileged_command(["rm", "-f", DNSMASQ_BLOCKLIST_FILE], check=False)
+    if action == "reload":
+        _run_privileged_command(["systemctl", "kill", "-s", "HUP", "dnsmasq"], check=True)
+    else:
         _run_privileged_command(["systemctl", "restart", "dnsmasq"], check=True)
-        return
 
-    if not temp_file:
-        raise RuntimeError("Temporary blocklist file path is required")
 
-    _run_privileged_command([
-        "install", "-o", "root", "-g", "root", "-m", "0644", temp_file, DNSMASQ_BLOCKLIST_FILE
-    ], check=True)
-    _run_privileged_command(["systemctl", "restart", "dnsmasq"], check=True)
+def _read_text(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def normalize_blocked_domains(domains: Iterable[str]) -> List[str]:
+    """Canonical, sorted, de-duplicated domain patterns (see domain_policy.normalize_pattern)."""
+    return sorted({name for name in (normalize_pattern(domain) for domain in domains or []) if name})
+
+
+def render_blocklist_files(domains: Iterable[str]) -> dict:
+    """Build the include, hosts and servers file contents for a domain set."""
+    names = normalize_blocked_domains(domains)
+    header = [
+        "# Auto-generated web filtering blocklist",
+        "# DO NOT EDIT MANUALLY - managed by WiFi Management System",
+    ]
+    include = "\n".join(header + [
+        f"addn-hosts={DNSMASQ_BLOCK_HOSTS_FILE}",
+        f"servers-file={DNSMASQ_BLOCK_SERVERS_FILE}",
+    ]) + "\n"
+    # Exact names answer 0.0.0.0 from the hosts file (as before); the
+    # servers entries keep subdomains local so they get NXDOMAIN.
+    # "*.name" rules block subdomains only (dnsmasq >= 2.86 wildcard syntax).
+    hosts = "\n".join(header + [f"0.0.0.0 {name}" for name in names if not name.startswith("*.")]) + "\n"
+    servers = "\n".join(header + [f"server=/{name}/" for name in names]) + "\n"
+    return {"include": include, "hosts": hosts, "servers": servers}
+
 
 def get_blocked_domains() -> Set[str]:
-    """Get all domains that should be blocked from MongoDB"""
+    """Get all domain patterns that should be blocked from the shared domain policy"""
     try:
-        config = web_filter_collection.find_one({"type": "config"})
-        if not config:
-            logger.warning("No filter configuration found")
-            return set()
-        
-        domains = set()
-        
-        # Add manually blocked sites
-        if "manual_blocks" in config:
-            domains.update(config["manual_blocks"])
-        
-        # Add active category sites
-        if "categories" in config:
-            for category, details in config["categories"].items():
-                if details.get("active", False):
-                    domains.update(details.get("sites", []))
-        
+        domains = set(get_domain_policy().patterns())
         logger.info(f"Found {len(domains)} domains to block")
         return domains
         
@@ -85,49 +140,170 @@ def get_blocked_domains() -> Set[str]:
         return set()
 
 
-def update_dnsmasq_blocklist():
-    """Update dnsmasq blocklist configuration file"""
-    temp_file = None
+def update_dnsmasq_blocklist(domains: Optional[Set[str]] = None):
+    """
+    Update the dnsmasq blocklist.
+
+    Files are only rewritten when their content hash differs from what is
+    installed. Blocklist changes are picked up with SIGHUP; dnsmasq is only
+    restarted when the include file itself changes (first run / new paths)
+    or the reload fails.
+    """
     try:
-        domains = get_blocked_domains()
-        
-        if not domains:
-            logger.info("No domains to block, removing blocklist file")
-            _apply_dnsmasq_changes(clear=True)
-            return True
-        
-        # Generate blocklist configuration
-        config_lines = [
-            "# Auto-generated web filtering blocklist",
-            "# DO NOT EDIT MANUALLY - managed by WiFi Management System\n"
+        if domains is None:
+            domains = get_blocked_domains()
+
+        rendered = render_blocklist_files(domains)
+        changed = [
+            kind for kind, content in rendered.items()
+            if _read_text(DNSMASQ_MANAGED_FILES[kind]) is None
+            or _content_hash(_read_text(DNSMASQ_MANAGED_FILES[kind])) != _content_hash(content)
         ]
-        
-        for domain in sorted(domains):
-            # Clean domain name
-            domain = domain.replace('https://', '').replace('http://', '').split('/')[0]
-            # Block domain by returning 0.0.0.0 for all queries
-            config_lines.append(f"address=/{domain}/0.0.0.0")
-        
-        # Write to a unique temp file first to avoid permission issues
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as f:
-            f.write('\n'.join(config_lines))
-            temp_file = f.name
+        if not changed:
+            logger.info("dnsmasq blocklist unchanged, skipping reload")
+            return True
 
-        logger.info("Applying dnsmasq blocklist...")
-        _apply_dnsmasq_changes(temp_file=temp_file, clear=False)
+        # Data files first so a restart (if needed) already sees them.
+        for kind in ("hosts", "servers", "include"):
+            if kind in changed:
+                _install_dnsmasq_file(kind, rendered[kind])
+
+        if "include" in changed:
+            logger.info("Applying dnsmasq blocklist (include changed, restarting)...")
+            _dnsmasq_service_command("restart")
+        else:
+            logger.info("Applying dnsmasq blocklist (SIGHUP)...")
+            try:
+                _dnsmasq_service_command("reload")
+            except RuntimeError as e:
+                logger.warning(f"dnsmasq reload failed, restarting instead: {e}")
+                _dnsmasq_service_command("restart")
         
-        logger.info(f"✅ Blocked {len(domains)} domains via DNS")
+        logger.info(f"✅ Blocked {len(normalize_blocked_domains(domains))} domains via DNS")
         return True
         
     except Exception as e:
         logger.error(f"Failed to update dnsmasq blocklist: {e}")
         return False
+
+
+def _dns_view_command(action: str, group: str, kind: Optional[str] = None, content: Optional[str] = None) -> None:
+    """
+    view-install/view-start/view-reload/view-stop for one group, through the
+    sudoers-allowed helper when installed, else directly as root.
+    """
+    paths = dns_view_paths(group)
+    temp_file = None
+    try:
+        if action == "view-install":
+            with tempfile.NamedTemporaryFile(mode='w', delete=False, prefix="dnsmasq-view-") as f:
+                f.write(content)
+                temp_file = f.name
+
+        if _helper_available():
+            args = [DNSMASQ_APPLY_HELPER, action, group]
+            if action == "view-install":
+                args.extend([kind, temp_file])
+            _run_privileged_command(args, check=action != "view-stop")
+            return
+
+        pid = _dns_view_pid(group)
+        if action == "view-install":
+            _run_privileged_command(
+                ["install", "-D", "-o", "root", "-g", "root", "-m", "0644", temp_file, paths[kind]], check=True
+            )
+        elif action == "view-start":
+            _run_privileged_command(["dnsmasq", f"--conf-file={paths['conf']}"], check=True)
+        elif action == "view-reload" and pid:
+            _run_privileged_command(["kill", f"-{int(signal.SIGHUP)}", str(pid)], check=True)
+        elif action == "view-stop":
+            if pid:
+                _run_privileged_command(["kill", str(pid)], check=False)
+            _run_privileged_command(["rm", "-f", paths["conf"], paths["hosts"], paths["servers"]], check=False)
     finally:
         if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except OSError:
-                pass
+            os.remove(temp_file)
+
+
+def dns_view_paths(group: str) -> dict:
+    return {
+        "conf": os.path.join(DNS_VIEW_DIR, f"{group}.conf"),
+        "hosts": os.path.join(DNS_VIEW_DIR, f"{group}.hosts"),
+        "servers": os.path.join(DNS_VIEW_DIR, f"{group}.servers"),
+        "pid": os.path.join(DNS_VIEW_RUN_DIR, f"wifi-dnsmasq-{group}.pid"),
+    }
+
+
+def render_dns_view_config(group: str, port: int) -> str:
+    from async_dns_resolver import parse_upstreams
+
+    paths = dns_view_paths(group)
+    lines = [
+        f"# DNS view for filter group {group}",
+        "# DO NOT EDIT MANUALLY - managed by WiFi Management System",
+        f"port={port}",
+        f"listen-address={HOTSPOT_GATEWAY_IP}",
+        "bind-interfaces",
+        "no-resolv",
+        "no-hosts",
+        "cache-size=1000",
+        f"pid-file={paths['pid']}",
+        f"addn-hosts={paths['hosts']}",
+        f"servers-file={paths['servers']}",
+    ]
+    lines.extend(f"server={host}#{upstream_port}" for host, upstream_port in parse_upstreams())
+    return "\n".join(lines) + "\n"
+
+
+def _dns_view_pid(group: str) -> Optional[int]:
+    try:
+        pid = int((_read_text(dns_view_paths(group)["pid"]) or "").strip())
+    except ValueError:
+        return None
+    return pid if os.path.exists(f"/proc/{pid}") else None
+
+
+def update_dns_view(group: str, port: int, domains: Iterable[str]) -> bool:
+    """
+    Write a group's view files and start it, SIGHUP it when only the
+    blocklist changed, or restart it when its config changed.
+    """
+    try:
+        paths = dns_view_paths(group)
+        rendered = render_blocklist_files(domains)
+        wanted = {
+            "conf": render_dns_view_config(group, port),
+            "hosts": rendered["hosts"],
+            "servers": rendered["servers"],
+        }
+        changed = [
+            kind for kind, content in wanted.items()
+            if _read_text(paths[kind]) is None or _content_hash(_read_text(paths[kind])) != _content_hash(content)
+        ]
+        pid = _dns_view_pid(group)
+        if pid and "conf" in changed:
+            # view-stop also removes the files; everything is reinstalled below.
+            _dns_view_command("view-stop", group)
+            pid = None
+            changed = list(wanted)
+        for kind in ("hosts", "servers", "conf"):
+            if kind in changed:
+                _dns_view_command("view-install", group, kind, wanted[kind])
+
+        if pid is None:
+            logger.info(f"Starting DNS view for group {group} on port {port}")
+            _dns_view_command("view-start", group)
+        elif changed:
+            logger.info(f"Reloading DNS view for group {group} (SIGHUP)")
+            _dns_view_command("view-reload", group)
+        return True
+    except Exception as e:
+        logger.error(f"Failed to update DNS view for group {group}: {e}")
+        return False
+
+
+def stop_dns_view(group: str) -> None:
+    _dns_view_command("view-stop", group)
 
 
 def test_domain_blocked(domain: str) -> bool:
@@ -139,8 +315,15 @@ def test_domain_blocked(domain: str) -> bool:
             text=True,
             timeout=5
         )
-        # If DNS returns 0.0.0.0, domain is blocked
-        return '0.0.0.0' in result.stdout
+        # Blocked names answer 0.0.0.0; blocked subdomains answer NXDOMAIN,
+        # which only counts for names under a blocked pattern (any unknown name is NXDOMAIN).
+        if '0.0.0.0' in result.stdout:
+            return True
+        if 'NXDOMAIN' not in result.stdout:
+            return False
+        from domain_policy import get_domain_policy
+
+        return get_domain_policy().is_blocked(domain)
     except Exception as e:
         logger.error(f"Error testing domain {domain}: {e}")
         return False
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Domain Policy - One compiled blocklist shared by dnsmasq, the firewall and the analyzer
+Holds blocked domains as a reversed-label trie, serialized to a compact file read via mmap
+
+Pattern semantics:
+  example.com      blocks example.com and every subdomain
+  *.example.com    blocks subdomains of example.com only
+"""
+
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DOMAIN_POLICY_FILE = os.environ.get(
+    "DOMAIN_POLICY_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "domain_policy.bin"),
+)
+
+MANUAL_TAG = "manual"
+
+_MAGIC = b"DPOL"
+_VERSION = 1
+# magic, version, reserved, node_count, nodes_off, label_count, labels_off, tag_count, tags_off, digest
+_HEADER = struct.Struct("<4sHHIIIIII32s")
+# label_id, child_start, child_count, tag_id, flags
+_NODE = struct.Struct("<IIIHH")
+_U32 = struct.Struct("<I")
+_SPAN = struct.Struct("<II")
+
+FLAG_SUBTREE = 1   # this name and everything below it
+FLAG_WILDCARD = 2  # everything below it, not the name itself
+FLAG_BULK = 4      # only from imported lists: enforced by DNS, never resolved for the firewall
+NO_TAG = 0xFFFF
+
+
+def normalize_pattern(value: str) -> str:
+    """Canonical pattern: lowercase IDNA name, optional leading "*."; "" if unusable."""
+    name = str(value or "").strip().lower()
+    name = name.replace("https://", "").replace("http://", "").split("/")[0].split(":")[0]
+    name = name.strip(".")
+    wildcard = name.startswith("*.")
+    if wildcard:
+        name = name[2:].strip(".")
+    if not name or "*" in name or ".." in name:
+        return ""
+    if not name.isascii():
+        try:
+            name = name.encode("idna").decode("ascii")
+        except UnicodeError:
+            return ""
+    return f"*.{name}" if wildcard else name
+
+
+def policy_entries_from_config(config: Optional[Dict]) -> Dict[str, str]:
+    """Pattern -> tag for manual blocks (tag "manual") and sites of active categories."""
+    entries: Dict[str, str] = {}
+    if not config:
+        return entries
+
+    for category in sorted((config.get("categories") or {})):
+        details = config["categories"][category] or {}
+        if not details.get("active", False):
+            continue
+        for site in details.get("sites", []) or []:
+            pattern = normalize_pattern(site)
+            if pattern:
+                entries.setdefault(pattern, category)
+
+    # Manual blocks take precedence over category tags.
+    for site in config.get("manual_blocks", []) or []:
+        pattern = normalize_pattern(site)
+        if pattern:
+            entries[pattern] = MANUAL_TAG
+    return entries
+
+
+def policy_digest(entries: Dict[str, str], external_digest: str = "") -> str:
+    """Identifies the policy inputs: config entries plus the digest of any external lists."""
+    digest = hashlib.sha256()
+    for pattern in sorted(entries):
+        digest.update(f"{pattern}\t{entries[pattern]}\n".encode("utf-8"))
+    digest.update(f"\x00{external_digest}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _pack_strings(strings: List[str]) -> bytes:
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = array("I", [0])
+    for item in encoded:
+        offsets.append(offsets[-1] + len(item))
+    if sys.byteorder != "little":
+        offsets.byteswap()
+    return offsets.tobytes() + b"".join(encoded)
+
+
+def _trie_key(pattern: str) -> Tuple[str, int]:
+    """Reversed labels joined by NUL (sorts like a label tuple) and the rule flag."""
+    if pattern.startswith("*."):
+        return "\x00".join(reversed(pattern[2:].split("."))), FLAG_WILDCARD
+    return "\x00".join(reversed(pattern.split("."))), FLAG_SUBTREE
+
+
+def _collect_rules(entries: Dict[str, str], external: Optional[Iterable[Tuple[str, str]]]) -> Dict[str, List]:
+    """
+    Trie key -> [flags, tag]. Config entries keep their tag over external
+    (bulk) ones, but a bulk rule still widens coverage: config "*.x" plus an
+    imported "x" blocks both. Bulk-only coverage is flagged FLAG_BULK.
+    """
+    rules: Dict[str, List] = {}
+    for pattern, tag in entries.items():
+        key, flag = _trie_key(pattern)
+        rule = rules.setdefault(key, [0, tag])
+        rule[0] |= flag
+        if tag == MANUAL_TAG:
+            rule[1] = tag
+    for pattern, tag in external or ():
+        key, flag = _trie_key(pattern)
+        rule = rules.get(key)
+        if rule is None:
+            rules[key] = [flag | FLAG_BULK, tag]
+        elif rule[0] & FLAG_BULK or not rule[0] & FLAG_SUBTREE:
+            # A config subtree already covers anything a bulk rule could add.
+            rule[0] |= flag | FLAG_BULK
+    return rules
+
+
+def compile_domain_policy(entries: Dict[str, str],
+                          external: Optional[Iterable[Tuple[str, str]]] = None,
+                          external_digest: str = "") -> bytes:
+    """
+    Serialize rules into the on-disk trie format.
+
+    Nodes are laid out level by level from the sorted keys, so each node's
+    children are contiguous and sorted (binary searchable) without ever
+    building a pointer trie in memory.
+    """
+    rules = _collect_rules(entries, external)
+
+    label_ids: Dict[str, int] = {"": 0}
+    labels_table: List[str] = [""]
+    tag_ids: Dict[str, int] = {}
+    tags_table: List[str] = []
+    # Per depth: parent (index within the previous level), label id, flags, tag id.
+    parents: List[array] = []
+    node_labels: List[array] = []
+    node_flags: List[array] = []
+    node_tags: List[array] = []
+
+    path: List[int] = []
+    previous: List[str] = []
+    for key in sorted(rules):
+        labels = key.split("\x00")
+        common = 0
+        while common < len(previous) and common < len(labels) and previous[common] == labels[common]:
+            common += 1
+        del path[common:]
+        for depth in range(common, len(labels)):
+            if depth == len(parents):
+                parents.append(array("I"))
+                node_labels.append(array("I"))
+                node_flags.append(array("H"))
+                node_tags.append(array("H"))
+            label = labels[depth]
+            label_id = label_ids.get(label)
+            if label_id is None:
+                label_id = label_ids[label] = len(labels_table)
+                labels_table.append(label)
+            parents[depth].append(path[depth - 1] if depth else 0)
+            node_labels[depth].append(label_id)
+            node_flags[depth].append(0)
+            node_tags[depth].append(NO_TAG)
+            path.append(len(parents[depth]) - 1)
+        flags, tag = rules[key]
+        if tag not in tag_ids:
+            tag_ids[tag] = len(tags_table)
+            tags_table.append(tag)
+        leaf_depth = len(labels) - 1
+        node_flags[leaf_depth][path[-1]] = flags
+        node_tags[leaf_depth][path[-1]] = tag_ids[tag]
+        previous = labels
+    del rules
+
+    level_offsets = [1]
+    for level in parents:
+        level_offsets.append(level_offsets[-1] + len(level))
+    node_count = level_offsets[-1]
+
+    node_blob = bytearray(node_count * _NODE.size)
+    root_children = len(parents[0]) if parents else 0
+    _NODE.pack_into(node_blob, 0, 0, 1 if root_children else 0, root_children, NO_TAG, 0)
+    for depth in range(len(parents)):
+        # Children of this level's nodes are contiguous runs in the next level.
+        child_start = [0] * len(parents[depth])
+        child_count = [0] * len(parents[depth])
+        if depth + 1 < len(parents):
+            for index, parent in enumerate(parents[depth + 1]):
+                if not child_count[parent]:
+                    child_start[parent] = level_offsets[depth + 1] + index
+                child_count[parent] += 1
+        base = level_offsets[depth]
+        for index in range(len(parents[depth])):
+            _NODE.pack_into(
+                node_blob, (base + index) * _NODE.size,
+                node_labels[depth][index], child_start[index], child_count[index],
+                node_tags[depth][index], node_flags[depth][index],
+            )
+
+    labels_blob = _pack_strings(labels_table)
+    tags_blob = _pack_strings(tags_table)
+    nodes_off = _HEADER.size
+    labels_off = nodes_off + len(node_blob)
+    tags_off = labels_off + len(labels_blob)
+    header = _HEADER.pack(
+        _MAGIC, _VERSION, 0,
+        node_count, nodes_off,
+        len(labels_table), labels_off,
+        len(tags_table), tags_off,
+        bytes.fromhex(policy_digest(entries, external_digest)),
+    )
+    return header + bytes(node_blob) + labels_blob + tags_blob
+
+
+class DomainPolicy:
+    """Read-only view over a compiled policy (bytes or an mmap)."""
+
+    def __init__(self, buffer, source: Optional[str] = None):
+        self._buf = buffer
+        self.source = source
+        (magic, version, _, self._node_count, self._nodes_off, self._label_count,
+         self._labels_off, self._tag_count, self._tags_off, digest) = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"Not a domain policy file (v{_VERSION}): {source or 'buffer'}")
+        self.digest = digest.hex()
+        self._tags = [self._string(self._tags_off, self._tag_count, i).decode("utf-8") for i in range(self._tag_count)]
+
+    def _string(self, table_off: int, count: int, index: int) -> bytes:
+        start, end = _SPAN.unpack_from(self._buf, table_off + 4 * index)
+        blob = table_off + 4 * (count + 1)
+        return self._buf[blob + start:blob + end]
+
+    def _node(self, index: int) -> Tuple[int, int, int, int, int]:
+        return _NODE.unpack_from(self._buf, self._nodes_off + index * _NODE.size)
+
+    def _label(self, label_id: int) -> bytes:
+        return self._string(self._labels_off, self._label_count, label_id)
+
+    def _find_child(self, child_start: int, child_count: int, label: bytes) -> Optional[int]:
+        buf, nodes_off, labels_off = self._buf, self._nodes_off, self._labels_off
+        blob = labels_off + 4 * (self._label_count + 1)
+        lo, hi = child_start, child_start + child_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            label_id = _U32.unpack_from(buf, nodes_off + mid * _NODE.size)[0]
+            start, end = _SPAN.unpack_from(buf, labels_off + 4 * label_id)
+            mid_label = buf[blob + start:blob + end]
+            if mid_label < label:
+                lo = mid + 1
+            elif mid_label > label:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def lookup(self, domain: str) -> Optional[str]:
+        """Tag of the rule blocking domain ("manual" or a category), or None."""
+        name = normalize_pattern(domain)
+        if not name or name.startswith("*."):
+            return None
+        labels = name.split(".")
+        _, child_start, child_count, _, _ = self._node(0)
+        remaining = len(labels)
+        for label in reversed(labels):
+            remaining -= 1
+            index = self._find_child(child_start, child_count, label.encode("utf-8"))
+            if index is None:
+                return None
+            _, child_start, child_count, tag_id, flags = self._node(index)
+            if flags & FLAG_SUBTREE or (flags & FLAG_WILDCARD and remaining > 0):
+                return self._tags[tag_id] if tag_id != NO_TAG else MANUAL_TAG
+        return None
+
+    def is_blocked(self, domain: str) -> bool:
+        return self.lookup(domain) is not None
+
+    def entries(self) -> Iterator[Tuple[str, str]]:
+        """Yield (pattern, tag) for every rule, parents before children."""
+        for pattern, tag, _ in self._rules():
+            yield pattern, tag
+
+    def _rules(self) -> Iterator[Tuple[str, str, int]]:
+        stack = [(0, [])]
+        while stack:
+            index, suffix = stack.pop()
+            label_id, child_start, child_count, tag_id, flags = self._node(index)
+            labels = suffix + [self._label(label_id).decode("utf-8")] if index else suffix
+            name = ".".join(reversed(labels))
+            tag = self._tags[tag_id] if tag_id != NO_TAG else MANUAL_TAG
+            if flags & FLAG_SUBTREE:
+                yield name, tag, flags
+            if flags & FLAG_WILDCARD:
+                yield f"*.{name}", tag, flags
+            for child in range(child_start + child_count - 1, child_start - 1, -1):
+                stack.append((child, labels))
+
+    def patterns(self) -> List[str]:
+        return sorted(pattern for pattern, _ in self.entries())
+
+    def resolvable_names(self) -> List[str]:
+        """
+        Names the firewall resolves to IPs. Wildcard-only rules have no single
+        name, and imported list entries are left to DNS (far too many to resolve).
+        """
+        return sorted(
+            pattern for pattern, _, flags in self._rules()
+            if not pattern.startswith("*.") and not flags & FLAG_BULK
+        )
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.entries())
+
+
+def write_domain_policy(entries: Dict[str, str], path: str = DOMAIN_POLICY_FILE,
+                        external: Optional[Iterable[Tuple[str, str]]] = None,
+                        external_digest: str = "") -> Tuple["DomainPolicy", bool]:
+    """
+    Compile and atomically replace the policy file; returns (policy, changed).
+
+    external is consumed lazily, so an unchanged external_digest never
+    touches the (possibly very large) imported lists.
+    """
+    current = load_domain_policy(path)
+    if current is not None and current.digest == policy_digest(entries, external_digest):
+        return current, False
+
+    data = compile_domain_policy(entries, external, external_digest)
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".domain_policy.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    logger.info("Wrote domain policy (%d bytes) to %s", len(data), path)
+    return load_domain_policy(path), True
+
+
+_cache_lock = threading.Lock()
+_cache: Dict[str, Tuple[Tuple[int, int, int], DomainPolicy]] = {}
+
+
+def load_domain_policy(path: str = DOMAIN_POLICY_FILE) -> Optional[DomainPolicy]:
+    """mmap the policy file, reusing the mapping until the file is replaced; None if missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        policy = DomainPolicy(mapped, source=path)
+        _cache[path] = (key, policy)
+        return policy
+
+
+def rebuild_domain_policy(config: Optional[Dict] = None, path: str = DOMAIN_POLICY_FILE) -> Tuple[DomainPolicy, bool]:
+    """Compile from the web_filter config (read from MongoDB when not given) and imported lists."""
+    if config is None:
+        from db import web_filter_collection
+
+        config = web_filter_collection.find_one({"type": "config"})
+    from blocklist_import import external_list_source
+
+    external, external_digest = external_list_source(config)
+    return write_domain_policy(policy_entries_from_config(config), path, external, external_digest)
+
+
+def group_policy_path(group: str) -> str:
+    """Policy file of a filter group, next to the global one."""
+    base, ext = os.path.splitext(DOMAIN_POLICY_FILE)
+    return f"{base}.{group}{ext}"
+
+
+def get_domain_policy(path: str = DOMAIN_POLICY_FILE) -> DomainPolicy:
+    """The shared policy; compiled from MongoDB on first use if the file does not exist yet."""
+    policy = load_domain_policy(path)
+    if policy is None:
+        policy, _ = rebuild_domain_policy(path=path)
+    return policy
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Build or query the shared domain policy')
+    parser.add_argument('--rebuild', action='store_true', help='Recompile from the web_filter config')
+    parser.add_argument('--list', action='store_true', help='Print every rule')
+    parser.add_argument('domains', nargs='*', help='Domains to look up')
+
+    args = parser.parse_args()
+
+    shared = rebuild_domain_policy()[0] if args.rebuild else get_domain_policy()
+    print(f"{shared.source}: {len(shared)} rules, digest {shared.digest[:12]}")
+    if args.list:
+        for rule, rule_tag in shared.entries():
+            print(f"  {rule}\t{rule_tag}")
+    for queried in args.domains:
+        print(f"  {queried}: {shared.lookup(queried) or 'allowed'}")
+    sys.exit(0)
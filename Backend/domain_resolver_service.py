@@ -2,12 +2,30 @@
 """
 Domain Resolver Service - Periodically refresh IPs for blocked domains
 Runs as a background service to keep firewall rules updated
+
+Each domain is re-resolved when its DNS TTL runs out and only the IPs that
+changed are added to / removed from GLOBAL_BLOCKS (no flush).
 """
 
+import os
 import time
 import logging
-from datetime import datetime
-from linux_firewall_manager import get_firewall_manager
+from typing import Dict
+from async_dns_resolver import DNS_RESOLVER_NEGATIVE_TTL, resolve_domains_with_ttl
+from filter_groups import refresh_group_block_sets
+from linux_firewall_manager import (
+    apply_global_block_diff,
+    get_blocked_domains,
+    get_firewall_manager,
+    get_global_block_ips,
+    install_sigterm_flush,
+)
+
+# Keep an IP blocked this long after a domain stops returning it; clients may
+# still hold the old answer in their own caches.
+DOMAIN_IP_GRACE_SECONDS = int(os.environ.get("DOMAIN_IP_GRACE_SECONDS", "300"))
+# How often per-group blocked-IP sets are re-resolved (swapped only when they change).
+GROUP_BLOCKS_REFRESH_SECONDS = int(os.environ.get("GROUP_BLOCKS_REFRESH_SECONDS", "600"))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,37 +34,106 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class DomainResolverService:
-    def __init__(self, refresh_interval=3600):
+    def __init__(self, refresh_interval=3600, check_interval=30, grace_seconds=DOMAIN_IP_GRACE_SECONDS):
         """
         Initialize resolver service
         
         Args:
-            refresh_interval: Seconds between IP refresh (default 1 hour)
+            refresh_interval: Longest a domain goes without re-resolution, even with a longer TTL (default 1 hour)
+            check_interval: Seconds between checks for expired domains / config changes
+            grace_seconds: How long an IP stays blocked after its domain stops resolving to it
         """
         self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self.grace_seconds = grace_seconds
         self.firewall_manager = get_firewall_manager()
         self.running = False
+        # domain -> {"ips": {ip: keep_until}, "expires_at": monotonic deadline}
+        self.domain_records: Dict[str, Dict] = {}
+        self.groups_refreshed_at = 0.0
+
+    def refresh_once(self) -> Dict:
+        """Re-resolve domains whose TTL expired and apply the IP diff to GLOBAL_BLOCKS."""
+        domains = get_blocked_domains()
+        if domains is None:
+            logger.warning("No filter configuration found in database")
+            return {"success": False}
+
+        now = time.monotonic()
+        for domain in set(self.domain_records) - domains:
+            self.domain_records.pop(domain, None)
+
+        due = sorted(
+            domain for domain in domains
+            if self.domain_records.get(domain, {}).get("expires_at", 0) <= now
+        )
+        if due:
+            resolved = resolve_domains_with_ttl(due)
+            for domain in due:
+                ips, ttl = resolved.get(domain, (set(), 0))
+                ttl = min(ttl or DNS_RESOLVER_NEGATIVE_TTL, self.refresh_interval)
+                record = self.domain_records.setdefault(domain, {"ips": {}, "expires_at": 0})
+                keep_until = now + ttl + self.grace_seconds
+                for ip in ips:
+                    record["ips"][ip] = keep_until
+                record["expires_at"] = now + ttl
+
+        desired = set()
+        for record in self.domain_records.values():
+            record["ips"] = {ip: keep_until for ip, keep_until in record["ips"].items() if keep_until > now}
+            desired.update(record["ips"])
+
+        current = get_global_block_ips()
+        if current is None:
+            # Could not read the chain; add what we want and leave removals for next time.
+            current = set(self.firewall_manager.blocked_ips)
+        to_add = desired - current
+        to_remove = current - desired
+
+        result = {"success": True, "resolved": len(due), "added": 0, "removed": 0, "blocked_ips": len(desired)}
+        if to_add or to_remove:
+            diff = apply_global_block_diff(to_add, to_remove)
+            result.update(success=diff.get("success", False), added=len(to_add), removed=len(to_remove))
+            self.firewall_manager.save_rules()
+
+        if now - self.groups_refreshed_at >= GROUP_BLOCKS_REFRESH_SECONDS:
+            self.groups_refreshed_at = now
+            try:
+                result["groups"] = refresh_group_block_sets()
+            except Exception as e:
+                logger.warning(f"Group blocked-IP refresh failed: {e}")
+        return result
+
+    def _seconds_until_next_expiry(self) -> float:
+        if not self.domain_records:
+            return self.check_interval
+        soonest = min(record["expires_at"] for record in self.domain_records.values())
+        return max(1.0, min(self.check_interval, soonest - time.monotonic()))
     
     def run(self):
         """Main service loop"""
         self.running = True
-        logger.info(f"Domain Resolver Service started (refresh every {self.refresh_interval}s)")
+        logger.info(
+            f"Domain Resolver Service started (TTL-driven, checks every {self.check_interval}s, "
+            f"max {self.refresh_interval}s per domain)"
+        )
+        self.firewall_manager._ensure_forward_usage_order()
         
         while self.running:
             try:
-                logger.info("Refreshing firewall rules from database...")
-                success = self.firewall_manager.update_from_database()
+                result = self.refresh_once()
                 
-                if success:
-                    self.firewall_manager.save_rules()
-                    stats = self.firewall_manager.get_blocked_ips_count()
-                    logger.info(f"✅ Rules updated - {stats['total_blocked_ips']} IPs blocked")
+                if result.get("success"):
+                    if result.get("resolved") or result.get("added") or result.get("removed"):
+                        logger.info(
+                            f"✅ Re-resolved {result['resolved']} domain(s): +{result['added']} / "
+                            f"-{result['removed']} IPs ({result['blocked_ips']} blocked)"
+                        )
                 else:
                     logger.error("❌ Failed to update firewall rules")
                 
-                # Wait for next refresh
-                logger.info(f"Next refresh in {self.refresh_interval} seconds...")
-                time.sleep(self.refresh_interval)
+                # Wake up when the next domain's TTL runs out (or at the next check).
+                time.sleep(self._seconds_until_next_expiry())
                 
             except KeyboardInterrupt:
                 logger.info("Received stop signal")
@@ -72,12 +159,19 @@ if __name__ == "__main__":
         '--interval',
         type=int,
         default=3600,
-        help='Refresh interval in seconds (default: 3600 = 1 hour)'
+        help='Maximum seconds between re-resolutions of a domain (default: 3600 = 1 hour)'
+    )
+    parser.add_argument(
+        '--check-interval',
+        type=int,
+        default=30,
+        help='Seconds between checks for expired TTLs and config changes (default: 30)'
     )
     
     args = parser.parse_args()
     
-    service = DomainResolverService(refresh_interval=args.interval)
+    service = DomainResolverService(refresh_interval=args.interval, check_interval=args.check_interval)
+    install_sigterm_flush()
     
     try:
         service.run()
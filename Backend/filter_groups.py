@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Filter Groups - Per-group (faculty, sections, ...) filtering policies
+Each group in web_filter.groups gets its own compiled domain policy, a blocked-IP ipset,
+a member ipset and a DNS view; logins only add the client IP to its group's member set
+
+Group spec (web_filter config, "groups" field):
+  {"faculty": {"categories": [], "manual_blocks": [], "inherit_manual_blocks": true}}
+  categories            active categories for the group (omit to follow the global toggles)
+  manual_blocks         extra domains for the group
+  inherit_manual_blocks also apply the global manual blocks (default true)
+
+Users join a group through their "policy_group" field, or else their user_type.
+Clients outside every group keep the global policy (GLOBAL_BLOCKS + dnsmasq).
+"""
+
+import logging
+import os
+import re
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from domain_policy import DomainPolicy, group_policy_path, rebuild_domain_policy
+
+logger = logging.getLogger(__name__)
+
+FILTER_GROUP_NAME_MAX = 16  # keeps ipset names (wifi_grp_<name>_new) under 31 chars
+_GROUP_NAME_INVALID = re.compile(r"[^a-z0-9_-]+")
+
+_group_block_ips_lock = threading.Lock()
+_group_block_ips: Dict[str, Set[str]] = {}
+
+
+def normalize_group_name(name) -> str:
+    return _GROUP_NAME_INVALID.sub("-", str(name or "").strip().lower()).strip("-")[:FILTER_GROUP_NAME_MAX]
+
+
+def get_policy_groups(config: Optional[Dict]) -> Dict[str, Dict]:
+    groups = {}
+    for name, spec in ((config or {}).get("groups") or {}).items():
+        group = normalize_group_name(name)
+        if group and isinstance(spec, dict):
+            groups[group] = spec
+    return groups
+
+
+def group_filter_config(config: Optional[Dict], spec: Dict) -> Dict:
+    """The web_filter config as seen by one group."""
+    config = config or {}
+    categories = config.get("categories") or {}
+    if "categories" in spec:
+        active = set(spec.get("categories") or [])
+        categories = {name: {**(details or {}), "active": name in active} for name, details in categories.items()}
+
+    manual_blocks = list(spec.get("manual_blocks") or [])
+    if spec.get("inherit_manual_blocks", True):
+        manual_blocks = list(config.get("manual_blocks") or []) + manual_blocks
+    return {"categories": categories, "manual_blocks": manual_blocks}
+
+
+def group_for_user(user: Optional[Dict], groups) -> Optional[str]:
+    """The group a user's traffic is filtered by, or None for the global policy."""
+    if not user:
+        return None
+    for candidate in (user.get("policy_group"), user.get("user_type")):
+        group = normalize_group_name(candidate)
+        if group and group in groups:
+            return group
+    return None
+
+
+def rebuild_group_policies(config: Optional[Dict]) -> Dict[str, DomainPolicy]:
+    """Compile (or reuse, when unchanged) every group's policy file."""
+    policies = {}
+    for group, spec in sorted(get_policy_groups(config).items()):
+        policies[group], _ = rebuild_domain_policy(group_filter_config(config, spec), group_policy_path(group))
+    return policies
+
+
+def dns_view_ports(groups: Iterable[str]) -> Dict[str, int]:
+    from dns_filtering_manager import DNS_VIEW_BASE_PORT
+
+    return {group: DNS_VIEW_BASE_PORT + index for index, group in enumerate(sorted(groups))}
+
+
+def _user_groups(roll_nos: Iterable[str], groups) -> Dict[str, Optional[str]]:
+    from db import users_collection
+
+    roll_nos = sorted({r for r in roll_nos if r})
+    if not roll_nos:
+        return {}
+    cursor = users_collection.find(
+        {"roll_no": {"$in": roll_nos}},
+        {"roll_no": 1, "user_type": 1, "policy_group": 1},
+    )
+    return {user.get("roll_no"): group_for_user(user, groups) for user in cursor}
+
+
+def active_group_members(groups) -> Dict[str, Set[str]]:
+    """Client IPs of active sessions, by group."""
+    from db import sessions_collection
+
+    sessions = list(sessions_collection.find({"status": "active"}, {"roll_no": 1, "client_ip": 1}))
+    user_groups = _user_groups((s.get("roll_no") for s in sessions), groups)
+    members: Dict[str, Set[str]] = {group: set() for group in groups}
+    for session in sessions:
+        group = user_groups.get(session.get("roll_no"))
+        if group and session.get("client_ip"):
+            members[group].add(session["client_ip"])
+    return members
+
+
+def _resolve_policy_ips(policy: DomainPolicy) -> Set[str]:
+    from async_dns_resolver import resolve_domains
+
+    names = policy.resolvable_names()
+    if not names:
+        return set()
+    return set().union(*resolve_domains(names).values())
+
+
+def _replace_block_set(group: str, ips: Set[str], force: bool = False) -> bool:
+    from linux_firewall_manager import group_set_names, replace_group_set
+
+    with _group_block_ips_lock:
+        if not force and _group_block_ips.get(group) == ips:
+            return True
+    if not replace_group_set(group_set_names(group)[1], ips):
+        return False
+    with _group_block_ips_lock:
+        _group_block_ips[group] = set(ips)
+    return True
+
+
+def apply_group_policies(config: Optional[Dict], group_policies: Optional[Dict[str, DomainPolicy]] = None) -> Dict:
+    """Bring kernel sets, rules and DNS views in line with the configured groups."""
+    from dns_filtering_manager import stop_dns_view, update_dns_view
+    from linux_firewall_manager import (
+        ensure_group_firewall,
+        get_firewall_groups,
+        group_set_names,
+        remove_group_firewall,
+        replace_group_set,
+    )
+
+    groups = get_policy_groups(config)
+    if group_policies is None:
+        group_policies = rebuild_group_policies(config)
+    result = {"success": True, "groups": sorted(groups), "errors": []}
+
+    for stale in get_firewall_groups() - set(groups):
+        remove_group_firewall(stale)
+        stop_dns_view(stale)
+        with _group_block_ips_lock:
+            _group_block_ips.pop(stale, None)
+        try:
+            os.remove(group_policy_path(stale))
+        except OSError:
+            pass
+    if not groups:
+        return result
+
+    ports = dns_view_ports(groups)
+    members = active_group_members(groups)
+    for group in sorted(groups):
+        policy = group_policies[group]
+        if not ensure_group_firewall(group, ports[group]):
+            result["errors"].append(f"{group}: ipset/iptables setup failed")
+            continue
+        if not _replace_block_set(group, _resolve_policy_ips(policy), force=True):
+            result["errors"].append(f"{group}: blocked-IP set update failed")
+        if not replace_group_set(group_set_names(group)[0], members[group]):
+            result["errors"].append(f"{group}: member set update failed")
+        if not update_dns_view(group, ports[group], policy.patterns()):
+            result["errors"].append(f"{group}: DNS view update failed")
+
+    result["success"] = not result["errors"]
+    result["members"] = {group: len(ips) for group, ips in members.items()}
+    return result
+
+
+def refresh_group_block_sets() -> Dict:
+    """Re-resolve each group's names (TTL-cached) and swap its set only if the IPs changed."""
+    from domain_policy import load_domain_policy
+    from linux_firewall_manager import get_firewall_groups
+
+    # Groups come from the kernel: this also runs in the resolver service process.
+    groups = sorted(get_firewall_groups())
+    refreshed = 0
+    for group in groups:
+        policy = load_domain_policy(group_policy_path(group))
+        if policy is None:
+            continue
+        ips = _resolve_policy_ips(policy)
+        with _group_block_ips_lock:
+            unchanged = _group_block_ips.get(group) == ips
+        if not unchanged and _replace_block_set(group, ips):
+            refreshed += 1
+    return {"groups": len(groups), "refreshed": refreshed}
+
+
+def assign_clients_to_groups(clients: Dict[str, Optional[str]]) -> Dict:
+    """
+    client_ip -> roll_no for freshly granted sessions. Puts each IP in its
+    group's member set with one ipset restore (no rule changes).
+    """
+    from db import web_filter_collection
+    from linux_firewall_manager import set_client_groups
+
+    config = web_filter_collection.find_one({"type": "config"}, {"groups": 1})
+    groups = get_policy_groups(config)
+    if not groups or not clients:
+        return {"success": True, "assigned": 0}
+
+    user_groups = _user_groups(clients.values(), groups)
+    assignments = {client_ip: user_groups.get(roll_no) for client_ip, roll_no in clients.items()}
+    ok = set_client_groups(assignments, groups)
+    return {"success": ok, "assigned": sum(1 for group in assignments.values() if group)}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Compile and apply per-group filtering policies')
+    parser.add_argument('--dry-run', action='store_true', help='Only compile group policies')
+
+    args = parser.parse_args()
+
+    from db import web_filter_collection
+
+    filter_config = web_filter_collection.find_one({"type": "config"})
+    compiled = rebuild_group_policies(filter_config)
+    for name, group_policy in compiled.items():
+        print(f"{name}: {len(group_policy)} rules ({group_policy.source})")
+    if not args.dry_run:
+        print(json.dumps(apply_group_policies(filter_config, compiled), indent=2))
@@ -5,26 +5,57 @@ Integrates with Flask backend for dynamic filtering
 """
 
 import subprocess
-import socket
+import atexit
+import hashlib
 import logging
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import shlex
+import signal
+import sys
+import tempfile
+import threading
+import time
 from typing import List, Dict, Set, Optional
 from db import web_filter_collection
+from async_dns_resolver import resolve_domain, resolve_domains
+from domain_policy import load_domain_policy, policy_entries_from_config, rebuild_domain_policy
+from usage_counters import read_set_counters
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 PUBLIC_DNS_SERVERS = ("8.8.8.8", "8.8.4.4", "1.1.1.1", "1.0.0.1")
 GLOBAL_BLOCKS_CHAIN = "GLOBAL_BLOCKS"
+# IPs learned from captured DNS answers; separate so GLOBAL_BLOCKS refreshes never touch them.
+LEARNED_BLOCKS_CHAIN = "GLOBAL_BLOCKS_LEARNED"
 HOTSPOT_FORWARD_CHAIN = "WIFI_MGMT_FORWARD"
 HOTSPOT_AUTH_CHAIN = "WIFI_MGMT_AUTH"
 HOTSPOT_PREROUTING_CHAIN = "WIFI_MGMT_PREROUTING"
 HOTSPOT_USAGE_CHAIN = "WIFI_MGMT_USAGE"
-
-USAGE_COMMENT_UPLOAD_PREFIX = "wifi_usage_up:"
-USAGE_COMMENT_DOWNLOAD_PREFIX = "wifi_usage_down:"
+# Per-group filtering: one DROP rule per group matching its member and blocked-IP ipsets.
+GROUP_BLOCKS_CHAIN = "WIFI_MGMT_GROUP_BLOCKS"
+DNS_VIEWS_CHAIN = "WIFI_MGMT_DNS_VIEWS"
+GROUPED_CLIENTS_SET = "wifi_grouped"  # list:set of every group's member set
+GROUP_MEMBER_SET_PREFIX = "wifi_grp_"
+GROUP_BLOCK_SET_PREFIX = "wifi_blk_"
+
+# Usage accounting: per-element ipset counters (upload by source, download by destination).
+USAGE_UPLOAD_SET = "wifi_usage_up"
+USAGE_DOWNLOAD_SET = "wifi_usage_down"
+LEARNED_BLOCK_COMMENT_PREFIX = "wifi_learned_until:"
+
+# Rules are persisted at most once per interval; later requests are coalesced.
+FIREWALL_RULES_FILE = os.environ.get("FIREWALL_RULES_FILE", "/etc/iptables/rules.v4")
+# Set definitions the saved rules reference (--match-set); restored before rules.v4 by ipset-persistent.
+FIREWALL_IPSETS_FILE = os.environ.get("FIREWALL_IPSETS_FILE", "/etc/iptables/ipsets")
+FIREWALL_SAVE_MIN_INTERVAL_SECONDS = float(os.environ.get("FIREWALL_SAVE_MIN_INTERVAL_SECONDS", "300"))
+
+_rules_save_lock = threading.Lock()
+_rules_save_timer: Optional[threading.Timer] = None
+_rules_save_dirty = False
+_rules_last_saved_at = 0.0
+_rules_last_checksum: Optional[str] = None
 
 
 def _iptables_run(args: List[str], table: str = "filter", check: bool = False) -> subprocess.CompletedProcess:
@@ -66,49 +97,39 @@ def _delete_rule_all(chain: str, rule_args: List[str], table: str = "filter") ->
             break
 
 
-def _usage_upload_comment(client_ip: str) -> str:
-    return f"{USAGE_COMMENT_UPLOAD_PREFIX}{client_ip}"
-
-
-def _usage_download_comment(client_ip: str) -> str:
-    return f"{USAGE_COMMENT_DOWNLOAD_PREFIX}{client_ip}"
-
-
-def _usage_upload_rule_args(client_ip: str, hotspot_interface: str, internet_interface: str) -> List[str]:
-    return [
-        "-s",
-        client_ip,
-        "-i",
-        hotspot_interface,
-        "-o",
-        internet_interface,
-        "-m",
-        "comment",
-        "--comment",
-        _usage_upload_comment(client_ip),
-        "-j",
-        "RETURN",
-    ]
-
-
-def _usage_download_rule_args(client_ip: str, hotspot_interface: str, internet_interface: str) -> List[str]:
+def _usage_rule_args(hotspot_interface: str, internet_interface: str) -> List[List[str]]:
+    """The two usage-chain rules; matching a client's set element bumps its counters."""
     return [
-        "-d",
-        client_ip,
-        "-i",
-        internet_interface,
-        "-o",
-        hotspot_interface,
-        "-m",
-        "conntrack",
-        "--ctstate",
-        "RELATED,ESTABLISHED",
-        "-m",
-        "comment",
-        "--comment",
-        _usage_download_comment(client_ip),
-        "-j",
-        "RETURN",
+        [
+            "-i",
+            hotspot_interface,
+            "-o",
+            internet_interface,
+            "-m",
+            "set",
+            "--match-set",
+            USAGE_UPLOAD_SET,
+            "src",
+            "-j",
+            "RETURN",
+        ],
+        [
+            "-i",
+            internet_interface,
+            "-o",
+            hotspot_interface,
+            "-m",
+            "conntrack",
+            "--ctstate",
+            "RELATED,ESTABLISHED",
+            "-m",
+            "set",
+            "--match-set",
+            USAGE_DOWNLOAD_SET,
+            "dst",
+            "-j",
+            "RETURN",
+        ],
     ]
 
 
@@ -173,6 +194,7 @@ def _prefix_from_gateway_ip(gateway_ip: str) -> str:
 class LinuxFirewallManager:
     def __init__(self):
         self.blocked_ips = set()
+        self.domain_ips: Dict[str, Set[str]] = {}  # Last resolved IPs per blocked domain
         self.authenticated_ips = set()  # Track authenticated users
         self.hotspot_subnet = os.environ.get("HOTSPOT_SUBNET", "192.168.50.0/24")
         self.flask_server_ip = os.environ.get("HOTSPOT_GATEWAY_IP", "192.168.50.1")
@@ -338,6 +360,7 @@ class LinuxFirewallManager:
 
             # Default behavior for usage chain is pass-through.
             _ensure_rule(HOTSPOT_USAGE_CHAIN, ["-j", "RETURN"])
+            _ensure_usage_accounting(self)
 
             # Reset hooks so usage accounting runs before ACCEPT decisions.
             self._ensure_forward_usage_order()
@@ -349,8 +372,8 @@ class LinuxFirewallManager:
                 table="nat",
             )
 
-            # Chain order: blocklist -> DNS bypass protection -> authenticated users -> drop.
-            _ensure_rule(HOTSPOT_FORWARD_CHAIN, ["-j", GLOBAL_BLOCKS_CHAIN])
+            # Chain order: blocklists -> DNS bypass protection -> authenticated users -> drop.
+            _ensure_block_hooks()
 
             for dns in PUBLIC_DNS_SERVERS:
                 _ensure_rule(
@@ -372,52 +395,15 @@ class LinuxFirewallManager:
             return False
     
     def resolve_domain_ips(self, domain: str) -> Set[str]:
-        """Resolve all IP addresses for a domain using multiple methods"""
-        ips = set()
+        """Resolve IPv4 addresses for a domain (cached, honouring record TTLs)"""
         try:
-            # Remove protocol if present
-            domain = domain.replace('https://', '').replace('http://', '').split('/')[0]
-            
-            # Method 1: socket.getaddrinfo (Standard)
-            try:
-                addr_info = socket.getaddrinfo(domain, None)
-                for info in addr_info:
-                    ip_text = str(info[4][0])
-                    if ':' not in ip_text:  # IPv4 only for now
-                        ips.add(ip_text)
-            except Exception:
-                pass
-
-            # Method 2: System 'dig' command (More reliable for multiple A records)
-            try:
-                result = subprocess.run(['dig', '+short', domain], capture_output=True, text=True, timeout=2)
-                for line in result.stdout.splitlines():
-                    ip = line.strip()
-                    if ip and ':' not in ip and ip[0].isdigit():
-                        ips.add(ip)
-            except Exception:
-                pass
-            
-            # Method 3: 'nslookup' as backup
-            if not ips:
-                try:
-                    result = subprocess.run(['nslookup', domain], capture_output=True, text=True, timeout=2)
-                    for line in result.stdout.splitlines():
-                        if 'Address: ' in line:
-                            parts = line.split('Address: ')
-                            if len(parts) > 1:
-                                ip = parts[1].strip()
-                                if ':' not in ip and not ip.startswith('127.'): # Ignore blocks/loopback
-                                    ips.add(ip)
-                except Exception:
-                    pass
-
+            ips = resolve_domain(domain)
             logger.info(f"Resolved {domain} to IPs: {ips}")
+            return ips
         except Exception as e:
             logger.error(f"Error resolving {domain}: {e}")
-        
-        return ips
-    
+            return set()
+
     def block_ip(self, ip: str):
         """Block a specific IP address using iptables"""
         ip = str(ip or "").strip()
@@ -494,7 +480,7 @@ class LinuxFirewallManager:
             try:
                 _ensure_chain(GLOBAL_BLOCKS_CHAIN)
                 _ensure_chain(HOTSPOT_FORWARD_CHAIN)
-                _ensure_rule(HOTSPOT_FORWARD_CHAIN, ['-j', GLOBAL_BLOCKS_CHAIN])
+                _ensure_block_hooks()
             except:
                 pass
             return False
@@ -513,38 +499,20 @@ class LinuxFirewallManager:
             # Clear existing rules
             self.clear_filter_rules()
             
-            # Get all domains to block
-            domains_to_block = set()
-            
-            # Add manually blocked sites
-            if "manual_blocks" in config:
-                domains_to_block.update(config["manual_blocks"])
-            
-            # Add active category sites
-            if "categories" in config:
-                for category, details in config["categories"].items():
-                    if details.get("active", False):
-                        domains_to_block.update(details.get("sites", []))
+            # Get all domains to block (refreshing the shared policy file)
+            domains_to_block = set(rebuild_domain_policy(config)[0].resolvable_names())
             
-            # Resolve all domains in parallel to reduce apply latency.
+            # Resolve all domains concurrently (one UDP socket, cached by TTL).
             domain_to_ips: Dict[str, Set[str]] = {}
             logger.info(f"Blocking {len(domains_to_block)} domains")
 
             if domains_to_block:
-                max_workers = min(16, max(4, len(domains_to_block)))
-                with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                    future_to_domain = {
-                        executor.submit(self.resolve_domain_ips, domain): domain
-                        for domain in domains_to_block
-                    }
-
-                    for future in as_completed(future_to_domain):
-                        domain = future_to_domain[future]
-                        try:
-                            domain_to_ips[domain] = future.result() or set()
-                        except Exception as e:
-                            logger.error(f"Error resolving {domain}: {e}")
-                            domain_to_ips[domain] = set()
+                try:
+                    domain_to_ips = resolve_domains(sorted(domains_to_block))
+                except Exception as e:
+                    logger.error(f"Error resolving blocked domains: {e}")
+
+            self.domain_ips = {domain: set(ips) for domain, ips in domain_to_ips.items()}
 
             # Add each IP once even if multiple domains resolve to it.
             unique_ips = set()
@@ -562,25 +530,15 @@ class LinuxFirewallManager:
             logger.error(f"Failed to update from database: {e}")
             return False
     
-    def save_rules(self):
-        """Save iptables rules to persist across reboots"""
-        try:
-            subprocess.run(['sudo', 'netfilter-persistent', 'save'], check=True)
-            logger.info("Firewall rules saved")
-            return True
-        except subprocess.CalledProcessError:
-            # Try alternative method
-            try:
-                subprocess.run(['sudo', 'mkdir', '-p', '/etc/iptables'], check=True)
-                subprocess.run(
-                    ['sudo', 'sh', '-c', 'iptables-save > /etc/iptables/rules.v4'],
-                    check=True,
-                )
-                logger.info("Firewall rules saved (alternative method)")
-                return True
-            except Exception as e:
-                logger.error(f"Failed to save rules: {e}")
-                return False
+    def save_rules(self, force: bool = False):
+        """
+        Persist iptables rules across reboots (debounced).
+
+        Saves immediately if the last save is older than
+        FIREWALL_SAVE_MIN_INTERVAL_SECONDS, otherwise schedules one save for
+        when the interval elapses. force=True saves now.
+        """
+        return request_rules_save(force=force)
     
     def reset_firewall(self):
         """Remove WiFi-management rules without flushing global firewall state."""
@@ -635,12 +593,26 @@ class LinuxFirewallManager:
             self._cleanup_legacy_rules()
 
             # Flush and delete project chains.
-            for chain in (HOTSPOT_AUTH_CHAIN, HOTSPOT_FORWARD_CHAIN, HOTSPOT_USAGE_CHAIN, GLOBAL_BLOCKS_CHAIN):
+            for chain in (
+                HOTSPOT_AUTH_CHAIN,
+                HOTSPOT_FORWARD_CHAIN,
+                HOTSPOT_USAGE_CHAIN,
+                GLOBAL_BLOCKS_CHAIN,
+                LEARNED_BLOCKS_CHAIN,
+                GROUP_BLOCKS_CHAIN,
+            ):
                 _flush_chain(chain)
                 _iptables_run(["-X", chain], check=False)
 
             _flush_chain(HOTSPOT_PREROUTING_CHAIN, table="nat")
             _iptables_run(["-X", HOTSPOT_PREROUTING_CHAIN], table="nat", check=False)
+            _destroy_usage_sets()
+
+            for proto in ("udp", "tcp"):
+                _delete_rule_all("PREROUTING", _dns_views_hook_args(self, proto), table="nat")
+            _flush_chain(DNS_VIEWS_CHAIN, table="nat")
+            _iptables_run(["-X", DNS_VIEWS_CHAIN], table="nat", check=False)
+            _destroy_group_sets()
 
             self.blocked_ips.clear()
             self.authenticated_ips.clear()
@@ -722,142 +694,26 @@ class LinuxFirewallManager:
             "blocked_ips": list(self.blocked_ips)
         }
 
-    def get_usage_counters_by_ip(self) -> Dict[str, Dict[str, int]]:
-        """Read per-client upload/download byte counters from usage chain."""
+    def get_usage_counters_by_ip(self, source=None) -> Dict[str, Dict[str, int]]:
+        """
+        Read per-client upload/download byte counters from the usage sets.
+        One netlink dump per set (see usage_counters); source overrides the
+        reader, e.g. a FakeCounterSource.
+        """
         usage: Dict[str, Dict[str, int]] = {}
-
-        def _set_usage(client_ip: str, direction: str, byte_count: int) -> None:
-            ip_text = str(client_ip or "").strip()
-            if not ip_text:
-                return
-            entry = usage.setdefault(ip_text, {"upload_bytes": 0, "download_bytes": 0, "total_bytes": 0})
-            entry[direction] = max(0, int(byte_count))
-
-        def _parse_iptables_save(output: str) -> bool:
-            parsed = False
-            chain_pattern = re.compile(
-                rf"^\[(\d+):(\d+)\]\s+-A\s+{re.escape(HOTSPOT_USAGE_CHAIN)}\s+(.*)$"
-            )
-
-            for line in (output or "").splitlines():
-                match = chain_pattern.match(line.strip())
-                if not match:
-                    continue
-
-                byte_count = int(match.group(2))
-                rule = match.group(3)
-
-                if USAGE_COMMENT_UPLOAD_PREFIX in rule:
-                    ip_match = re.search(r"-s\s+((?:\d{1,3}\.){3}\d{1,3})(?:/\d+)?", rule)
-                    if not ip_match:
-                        continue
-                    _set_usage(ip_match.group(1), "upload_bytes", byte_count)
-                    parsed = True
-                    continue
-
-                if USAGE_COMMENT_DOWNLOAD_PREFIX in rule:
-                    ip_match = re.search(r"-d\s+((?:\d{1,3}\.){3}\d{1,3})(?:/\d+)?", rule)
-                    if not ip_match:
-                        continue
-                    _set_usage(ip_match.group(1), "download_bytes", byte_count)
-                    parsed = True
-
-            return parsed
-
-        def _parse_iptables_list(output: str) -> bool:
-            parsed = False
-            for line in (output or "").splitlines():
-                stripped = line.strip()
-                if not stripped or stripped.startswith("Chain ") or stripped.startswith("pkts "):
-                    continue
-
-                parts = stripped.split()
-                if len(parts) < 9:
-                    continue
-
-                byte_text = parts[1]
-                target = parts[2]
-                source = parts[7]
-                destination = parts[8]
-
-                if target != "RETURN":
-                    continue
-
-                try:
-                    byte_count = int(byte_text)
-                except ValueError:
-                    continue
-
-                source_ip = source.split("/", 1)[0]
-                destination_ip = destination.split("/", 1)[0]
-
-                if source_ip != "0.0.0.0" and source_ip != "0.0.0.0/0":
-                    _set_usage(source_ip, "upload_bytes", byte_count)
-                    parsed = True
-                    continue
-
-                if destination_ip != "0.0.0.0" and destination_ip != "0.0.0.0/0":
-                    _set_usage(destination_ip, "download_bytes", byte_count)
-                    parsed = True
-
-            return parsed
-
-        command_candidates = [
-            ["iptables-save", "-c"],
-            ["sudo", "-n", "iptables-save", "-c"],
-        ]
-
-        parsed_any = False
-
-        for command in command_candidates:
-            try:
-                result = subprocess.run(
-                    command,
-                    capture_output=True,
-                    text=True,
-                    check=False,
-                )
-            except Exception:
-                continue
-
-            if result.returncode != 0:
-                continue
-
-            if _parse_iptables_save(result.stdout):
-                parsed_any = True
-                break
-
-        if not parsed_any:
-            list_command_candidates = [
-                ["iptables", "-L", HOTSPOT_USAGE_CHAIN, "-v", "-n", "-x"],
-                ["sudo", "-n", "iptables", "-L", HOTSPOT_USAGE_CHAIN, "-v", "-n", "-x"],
-            ]
-
-            for command in list_command_candidates:
-                try:
-                    result = subprocess.run(
-                        command,
-                        capture_output=True,
-                        text=True,
-                        check=False,
-                    )
-                except Exception:
-                    continue
-
-                if result.returncode != 0:
-                    continue
-
-                if _parse_iptables_list(result.stdout):
-                    parsed_any = True
-                    break
-
-        if not parsed_any:
+        try:
+            counters = read_set_counters((USAGE_UPLOAD_SET, USAGE_DOWNLOAD_SET), source)
+        except Exception as e:
+            logger.warning(f"Failed to read usage counters: {e}")
             return usage
 
+        for direction, set_name in (("upload_bytes", USAGE_UPLOAD_SET), ("download_bytes", USAGE_DOWNLOAD_SET)):
+            for client_ip, (_packets, byte_count) in counters.get(set_name, {}).items():
+                entry = usage.setdefault(client_ip, {"upload_bytes": 0, "download_bytes": 0, "total_bytes": 0})
+                entry[direction] = max(0, int(byte_count))
+
         for entry in usage.values():
-            upload_bytes = max(0, int(entry.get("upload_bytes", 0)))
-            download_bytes = max(0, int(entry.get("download_bytes", 0)))
-            entry["total_bytes"] = upload_bytes + download_bytes
+            entry["total_bytes"] = entry["upload_bytes"] + entry["download_bytes"]
 
         return usage
 
@@ -884,9 +740,9 @@ def get_firewall_manager() -> LinuxFirewallManager:
     return _firewall_manager
 
 
-def get_usage_counters_by_ip() -> Dict[str, Dict[str, int]]:
+def get_usage_counters_by_ip(source=None) -> Dict[str, Dict[str, int]]:
     """Get live usage counters keyed by client IP."""
-    return get_firewall_manager().get_usage_counters_by_ip()
+    return get_firewall_manager().get_usage_counters_by_ip(source)
 
 
 def get_usage_for_client_ip(client_ip: str) -> Dict[str, int]:
@@ -950,6 +806,7 @@ def allow_authenticated_user(client_ip: str):
         _ensure_chain(HOTSPOT_AUTH_CHAIN)
         _ensure_chain(HOTSPOT_USAGE_CHAIN)
         _ensure_rule(HOTSPOT_USAGE_CHAIN, ["-j", "RETURN"])
+        _ensure_usage_accounting(manager)
 
         _ensure_rule(
             HOTSPOT_AUTH_CHAIN,
@@ -965,17 +822,8 @@ def allow_authenticated_user(client_ip: str):
             ],
         )
 
-        # Add per-client usage accounting rules (upload/download bytes).
-        _ensure_rule(
-            HOTSPOT_USAGE_CHAIN,
-            _usage_upload_rule_args(client_ip, manager.hotspot_interface, manager.internet_interface),
-            insert_position=1,
-        )
-        _ensure_rule(
-            HOTSPOT_USAGE_CHAIN,
-            _usage_download_rule_args(client_ip, manager.hotspot_interface, manager.internet_interface),
-            insert_position=1,
-        )
+        # Start per-client usage counters (upload/download bytes).
+        _update_usage_sets("add", [client_ip])
 
         # Exempt authenticated users from captive HTTP redirect.
         _ensure_chain(HOTSPOT_PREROUTING_CHAIN, table="nat")
@@ -998,15 +846,8 @@ def block_authenticated_user(client_ip: str):
     manager = get_firewall_manager()
     
     try:
-        # Remove per-client usage accounting rules.
-        _delete_rule_all(
-            HOTSPOT_USAGE_CHAIN,
-            _usage_upload_rule_args(client_ip, manager.hotspot_interface, manager.internet_interface),
-        )
-        _delete_rule_all(
-            HOTSPOT_USAGE_CHAIN,
-            _usage_download_rule_args(client_ip, manager.hotspot_interface, manager.internet_interface),
-        )
+        # Drop per-client usage counters.
+        _update_usage_sets("del", [client_ip])
 
         # Remove filter accept rule for this IP.
         _delete_rule_all(
@@ -1032,12 +873,852 @@ def block_authenticated_user(client_ip: str):
         
         if client_ip in manager.authenticated_ips:
             manager.authenticated_ips.remove(client_ip)
+        remove_clients_from_groups([client_ip])
         logger.info(f"✅ Blocked internet access for {client_ip}")
         return True
     except Exception as e:
         logger.error(f"Failed to block user {client_ip}: {e}")
         return False
 
+def _iptables_save_table(table: str) -> Optional[str]:
+    for command in (["sudo", "-n", "iptables-save", "-t", table], ["iptables-save", "-t", table]):
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, check=False)
+        except Exception:
+            continue
+        if result.returncode == 0:
+            return result.stdout or ""
+    return None
+
+
+def _client_rule_deletions(save_output: str, chains: Set[str], client_cidrs: Set[str]) -> List[str]:
+    """Turn saved '-A' rules of given chains that match client IPs into '-D' lines."""
+    deletions = []
+    for line in (save_output or "").splitlines():
+        parts = line.split()
+        if len(parts) < 4 or parts[0] != "-A" or parts[1] not in chains:
+            continue
+        for index, token in enumerate(parts[:-1]):
+            if token in ("-s", "-d") and parts[index + 1] in client_cidrs:
+                deletions.append("-D" + line[2:])
+                break
+    return deletions
+
+
+def block_authenticated_users(client_ips) -> Dict:
+    """
+    Remove internet access for many users in one ruleset transaction.
+
+    Reads each table once with iptables-save and applies all deletions with a
+    single iptables-restore --noflush, instead of several forks per client.
+    Falls back to per-client removal if the batch cannot be applied.
+    """
+    manager = get_firewall_manager()
+    ips = sorted({str(ip or "").strip() for ip in client_ips if str(ip or "").strip()})
+    if not ips:
+        return {"success": True, "removed_rules": 0, "fallback": False}
+
+    client_cidrs = {f"{ip}/32" for ip in ips}
+    table_chains = {
+        "filter": {HOTSPOT_AUTH_CHAIN, HOTSPOT_USAGE_CHAIN},
+        "nat": {HOTSPOT_PREROUTING_CHAIN},
+    }
+
+    script_lines: List[str] = []
+    removed_rules = 0
+    batch_ok = True
+
+    for table, chains in table_chains.items():
+        saved = _iptables_save_table(table)
+        if saved is None:
+            batch_ok = False
+            break
+        deletions = _client_rule_deletions(saved, chains, client_cidrs)
+        if deletions:
+            script_lines.append(f"*{table}")
+            script_lines.extend(deletions)
+            script_lines.append("COMMIT")
+            removed_rules += len(deletions)
+
+    if batch_ok and script_lines:
+        try:
+            result = subprocess.run(
+                ["sudo", "iptables-restore", "--noflush"],
+                input="\n".join(script_lines) + "\n",
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            batch_ok = result.returncode == 0
+            if not batch_ok:
+                logger.warning("Batched iptables-restore failed: %s", (result.stderr or "").strip())
+        except Exception as e:
+            logger.warning(f"Batched iptables-restore failed: {e}")
+            batch_ok = False
+
+    if not batch_ok:
+        failed = [ip for ip in ips if not block_authenticated_user(ip)]
+        return {"success": not failed, "removed_rules": None, "fallback": True, "failed": failed}
+
+    manager.authenticated_ips.difference_update(ips)
+    _update_usage_sets("del", ips)
+    remove_clients_from_groups(ips)
+    logger.info(f"✅ Blocked internet access for {len(ips)} client(s) ({removed_rules} rules removed)")
+    return {"success": True, "removed_rules": removed_rules, "fallback": False}
+
+def _client_grant_lines(save_filter: str, save_nat: str, client_ip: str, manager) -> Dict[str, List[str]]:
+    """iptables-restore lines that add whichever grant rules this client is missing."""
+    cidr = f"{client_ip}/32"
+    filter_rules = [line.split() for line in (save_filter or "").splitlines() if line.startswith("-A ")]
+    nat_rules = [line.split() for line in (save_nat or "").splitlines() if line.startswith("-A ")]
+
+    def has_rule(rules, chain, *needles):
+        return any(
+            parts[1] == chain and all(needle in parts for needle in needles)
+            for parts in rules
+        )
+
+    lines: Dict[str, List[str]] = {"filter": [], "nat": []}
+    if not has_rule(filter_rules, HOTSPOT_AUTH_CHAIN, cidr, "ACCEPT"):
+        lines["filter"].append(
+            f"-A {HOTSPOT_AUTH_CHAIN} -s {cidr} -i {manager.hotspot_interface} "
+            f"-o {manager.internet_interface} -j ACCEPT"
+        )
+    if not has_rule(nat_rules, HOTSPOT_PREROUTING_CHAIN, cidr, "RETURN"):
+        lines["nat"].append(f"-I {HOTSPOT_PREROUTING_CHAIN} 1 -s {cidr} -j RETURN")
+    return lines
+
+
+def allow_authenticated_users(client_ips) -> Dict:
+    """
+    Grant internet access to many users in one ruleset transaction.
+
+    Mirrors block_authenticated_users: one iptables-save per table to find
+    missing rules, then a single iptables-restore --noflush. Falls back to
+    per-client allow_authenticated_user if the batch cannot be applied.
+    """
+    manager = get_firewall_manager()
+    ips = sorted({str(ip or "").strip() for ip in client_ips if str(ip or "").strip()})
+    if not ips:
+        return {"success": True, "added_rules": 0, "fallback": False}
+
+    batch_ok = True
+    added_rules = 0
+    script_lines: List[str] = []
+
+    try:
+        _ensure_chain(HOTSPOT_AUTH_CHAIN)
+        _ensure_chain(HOTSPOT_USAGE_CHAIN)
+        _ensure_rule(HOTSPOT_USAGE_CHAIN, ["-j", "RETURN"])
+        _ensure_usage_accounting(manager)
+        _ensure_chain(HOTSPOT_PREROUTING_CHAIN, table="nat")
+    except Exception as e:
+        logger.warning(f"Failed to prepare hotspot chains: {e}")
+        batch_ok = False
+
+    saved_filter = _iptables_save_table("filter") if batch_ok else None
+    saved_nat = _iptables_save_table("nat") if batch_ok else None
+    if saved_filter is None or saved_nat is None:
+        batch_ok = False
+
+    if batch_ok:
+        table_lines: Dict[str, List[str]] = {"filter": [], "nat": []}
+        for ip in ips:
+            for table, lines in _client_grant_lines(saved_filter, saved_nat, ip, manager).items():
+                table_lines[table].extend(lines)
+
+        for table, lines in table_lines.items():
+            if lines:
+                script_lines.append(f"*{table}")
+                script_lines.extend(lines)
+                script_lines.append("COMMIT")
+                added_rules += len(lines)
+
+    if batch_ok and script_lines:
+        try:
+            result = subprocess.run(
+                ["sudo", "iptables-restore", "--noflush"],
+                input="\n".join(script_lines) + "\n",
+                capture_output=True,
+                text=True,
+                check=False,
+            )
+            batch_ok = result.returncode == 0
+            if not batch_ok:
+                logger.warning("Batched iptables-restore failed: %s", (result.stderr or "").strip())
+        except Exception as e:
+            logger.warning(f"Batched iptables-restore failed: {e}")
+            batch_ok = False
+
+    if not batch_ok:
+        failed = [ip for ip in ips if not allow_authenticated_user(ip)]
+        return {"success": not failed, "added_rules": None, "fallback": True, "failed": failed}
+
+    manager.authenticated_ips.update(ips)
+    _update_usage_sets("add", ips)
+    logger.info(f"✅ Allowed internet access for {len(ips)} client(s) ({added_rules} rules added)")
+    return {"success": True, "added_rules": added_rules, "fallback": False}
+
+
+def _iptables_restore_filter(lines: List[str], label: str) -> bool:
+    """Apply filter-table lines with one iptables-restore --noflush."""
+    if not lines:
+        return True
+    try:
+        result = subprocess.run(
+            ["sudo", "iptables-restore", "--noflush"],
+            input="*filter\n" + "\n".join(lines) + "\nCOMMIT\n",
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if result.returncode != 0:
+            logger.warning("Batched %s update failed: %s", label, (result.stderr or "").strip())
+        return result.returncode == 0
+    except Exception as e:
+        logger.warning(f"Batched {label} update failed: {e}")
+        return False
+
+
+def _ruleset_checksum(ruleset: str) -> str:
+    """Checksum ignoring iptables-save timestamps and packet/byte counters."""
+    lines = [
+        re.sub(r"\[\d+:\d+\]", "", line)
+        for line in ruleset.splitlines()
+        if line and not line.startswith("#")
+    ]
+    return hashlib.sha256("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def _ipset_definitions() -> Optional[str]:
+    """
+    `ipset save` reduced to what a rules restore needs: every set's create
+    line, then the list:set membership. Members, counters and the transient
+    *_new swap twins are left out; they are rebuilt at runtime.
+    """
+    try:
+        result = _ipset_run(["save"])
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    creates, adds = [], []
+    for line in (result.stdout or "").splitlines():
+        parts = line.split()
+        if len(parts) < 3 or parts[1].endswith("_new"):
+            continue
+        if parts[0] == "create":
+            creates.append(line)
+        elif parts[0] == "add" and parts[1] == GROUPED_CLIENTS_SET:
+            adds.append(line)
+    return "\n".join(creates + adds) + "\n" if creates else ""
+
+
+def _write_rules_file_atomically(ruleset: str, path: str = FIREWALL_RULES_FILE) -> None:
+    """Write via a temp file in the target directory, then rename over the old file."""
+    target_dir = os.path.dirname(path) or "."
+    if os.geteuid() == 0:
+        os.makedirs(target_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=target_dir, prefix=".rules.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(ruleset)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, 0o640)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return
+
+    staged = os.path.join(target_dir, f".{os.path.basename(path)}.tmp")
+    with tempfile.NamedTemporaryFile(mode="w", delete=False, prefix="iptables-rules-") as f:
+        f.write(ruleset)
+        local_temp = f.name
+    try:
+        subprocess.run(["sudo", "-n", "mkdir", "-p", target_dir], check=True)
+        subprocess.run(["sudo", "-n", "install", "-m", "0640", local_temp, staged], check=True)
+        subprocess.run(["sudo", "-n", "mv", "-f", staged, path], check=True)
+    finally:
+        os.remove(local_temp)
+
+
+def _persist_rules_now() -> bool:
+    """Save the live ruleset unless it matches what was last written."""
+    global _rules_last_checksum, _rules_last_saved_at, _rules_save_dirty
+
+    result = subprocess.run(["sudo", "iptables-save"], capture_output=True, text=True, check=False)
+    if result.returncode != 0 or not result.stdout:
+        logger.error(f"Failed to save rules: iptables-save: {(result.stderr or '').strip()}")
+        return False
+
+    ipsets = _ipset_definitions()
+    checksum = _ruleset_checksum(result.stdout + (ipsets or ""))
+    if _rules_last_checksum is None:
+        # First save in this process: compare against what is already on disk.
+        try:
+            with open(FIREWALL_RULES_FILE, "r") as f:
+                saved = f.read()
+            if ipsets is not None:
+                with open(FIREWALL_IPSETS_FILE, "r") as f:
+                    saved += f.read()
+            _rules_last_checksum = _ruleset_checksum(saved)
+        except OSError:
+            pass
+
+    with _rules_save_lock:
+        _rules_save_dirty = False
+        _rules_last_saved_at = time.monotonic()
+        if checksum == _rules_last_checksum:
+            logger.debug("Firewall ruleset unchanged, skipping save")
+            return True
+
+    try:
+        # Sets first: a boot-time restore of rules.v4 fails as a whole if a --match-set target is missing.
+        if ipsets is not None:
+            _write_rules_file_atomically(ipsets, FIREWALL_IPSETS_FILE)
+        _write_rules_file_atomically(result.stdout)
+    except Exception as e:
+        logger.error(f"Failed to save rules: {e}")
+        with _rules_save_lock:
+            _rules_save_dirty = True
+        return False
+
+    with _rules_save_lock:
+        _rules_last_checksum = checksum
+    logger.info("Firewall rules saved")
+    return True
+
+
+def _deferred_rules_save() -> None:
+    global _rules_save_timer
+    with _rules_save_lock:
+        _rules_save_timer = None
+    _persist_rules_now()
+
+
+def request_rules_save(force: bool = False) -> bool:
+    """Save now if allowed by the debounce interval, else coalesce into one scheduled save."""
+    global _rules_save_timer, _rules_save_dirty
+
+    with _rules_save_lock:
+        elapsed = time.monotonic() - _rules_last_saved_at
+        if not force and _rules_last_saved_at and elapsed < FIREWALL_SAVE_MIN_INTERVAL_SECONDS:
+            _rules_save_dirty = True
+            if _rules_save_timer is None:
+                _rules_save_timer = threading.Timer(FIREWALL_SAVE_MIN_INTERVAL_SECONDS - elapsed, _deferred_rules_save)
+                _rules_save_timer.daemon = True
+                _rules_save_timer.start()
+            return True
+        if _rules_save_timer is not None:
+            _rules_save_timer.cancel()
+            _rules_save_timer = None
+
+    return _persist_rules_now()
+
+
+@atexit.register
+def _flush_pending_rules_save() -> None:
+    if _rules_save_dirty:
+        request_rules_save(force=True)
+
+
+def install_sigterm_flush() -> None:
+    """
+    Write a deferred ruleset save before exiting on SIGTERM.
+
+    systemd stops services with SIGTERM, whose default action kills the
+    process without running atexit hooks. Call from the main thread.
+    """
+    def _handle_sigterm(signum, frame):
+        logger.info("SIGTERM received, flushing pending firewall save")
+        _flush_pending_rules_save()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, _handle_sigterm)
+
+
+def get_blocked_domains(config: Optional[Dict] = None) -> Optional[Set[str]]:
+    """
+    Resolvable blocked names (manual blocks plus sites of active categories).
+
+    Read from the compiled domain policy when no config is given, so the
+    firewall blocks exactly what dnsmasq and the analyzer do. Wildcard-only
+    rules have no single name to resolve and are left to DNS/learning.
+    None if neither a policy file nor a filter config exists.
+    """
+    if config is None:
+        policy = load_domain_policy()
+        if policy is not None:
+            return set(policy.resolvable_names())
+        config = web_filter_collection.find_one({"type": "config"})
+    if not config:
+        return None
+
+    return {pattern for pattern in policy_entries_from_config(config) if not pattern.startswith("*.")}
+
+
+# Rules block_ip installs per address, as (protocol, dport); ("", "") is the catch-all DROP.
+_GLOBAL_BLOCK_RULE_KINDS = [("", ""), ("tcp", "443"), ("udp", "443")]
+
+
+def _global_block_rules_from_save(save_output: str) -> Dict[str, Dict[tuple, str]]:
+    """Map ip -> {(protocol, dport): saved rule line} for GLOBAL_BLOCKS."""
+    rules: Dict[str, Dict[tuple, str]] = {}
+    prefix = f"-A {GLOBAL_BLOCKS_CHAIN} "
+    for line in (save_output or "").splitlines():
+        if not line.startswith(prefix):
+            continue
+        parts = line.split()
+        ip = protocol = dport = ""
+        for index, token in enumerate(parts[:-1]):
+            if token == "-d":
+                ip = parts[index + 1].split("/", 1)[0]
+            elif token == "-p":
+                protocol = parts[index + 1]
+            elif token == "--dport":
+                dport = parts[index + 1]
+        if ip:
+            rules.setdefault(ip, {})[(protocol, dport)] = line
+    return rules
+
+
+def get_global_block_ips() -> Optional[Set[str]]:
+    """IPs currently dropped in GLOBAL_BLOCKS, read with one iptables-save; None if unreadable."""
+    saved_filter = _iptables_save_table("filter")
+    if saved_filter is None:
+        return None
+    return set(_global_block_rules_from_save(saved_filter))
+
+
+def apply_global_block_diff(add_ips, remove_ips) -> Dict:
+    """
+    Add and remove blocked IPs without flushing GLOBAL_BLOCKS.
+
+    Reads the filter table once and applies every -A/-D in a single
+    iptables-restore --noflush, so there is never a window with no blocks.
+    Falls back to per-IP block_ip/unblock_ip if the batch cannot be applied.
+    """
+    manager = get_firewall_manager()
+    add = sorted({str(ip or "").strip() for ip in add_ips if str(ip or "").strip()})
+    remove = sorted({str(ip or "").strip() for ip in remove_ips if str(ip or "").strip()} - set(add))
+    if not add and not remove:
+        return {"success": True, "added": 0, "removed": 0, "fallback": False}
+
+    batch_ok = True
+    try:
+        _ensure_chain(GLOBAL_BLOCKS_CHAIN)
+    except Exception as e:
+        logger.warning(f"Failed to prepare {GLOBAL_BLOCKS_CHAIN}: {e}")
+        batch_ok = False
+
+    saved_filter = _iptables_save_table("filter") if batch_ok else None
+    if saved_filter is None:
+        batch_ok = False
+
+    if batch_ok:
+        existing = _global_block_rules_from_save(saved_filter)
+        lines: List[str] = []
+        for ip in add:
+            present = existing.get(ip, {})
+            for protocol, dport in _GLOBAL_BLOCK_RULE_KINDS:
+                if (protocol, dport) in present:
+                    continue
+                match = f" -p {protocol} --dport {dport}" if protocol else ""
+                lines.append(f"-A {GLOBAL_BLOCKS_CHAIN} -d {ip}{match} -j DROP")
+        for ip in remove:
+            lines.extend("-D" + line[2:] for line in existing.get(ip, {}).values())
+
+        batch_ok = _iptables_restore_filter(lines, GLOBAL_BLOCKS_CHAIN)
+
+    if not batch_ok:
+        failed = [ip for ip in add if not manager.block_ip(ip)]
+        failed += [ip for ip in remove if not manager.unblock_ip(ip)]
+        return {"success": not failed, "added": len(add), "removed": len(remove), "fallback": True, "failed": failed}
+
+    manager.blocked_ips.update(add)
+    manager.blocked_ips.difference_update(remove)
+    logger.info(f"Updated {GLOBAL_BLOCKS_CHAIN}: +{len(add)} / -{len(remove)} IPs")
+    return {"success": True, "added": len(add), "removed": len(remove), "fallback": False}
+
+
+def sync_domain_blocks(domains) -> Dict:
+    """
+    Make GLOBAL_BLOCKS match the resolved IPs of exactly these domains,
+    diffing against the live chain instead of flushing it.
+    """
+    manager = get_firewall_manager()
+    manager._ensure_forward_usage_order()
+
+    domains = sorted(set(domains or []))
+    resolved = resolve_domains(domains) if domains else {}
+    manager.domain_ips = {domain: set(resolved.get(domain) or set()) for domain in domains}
+
+    desired = set().union(*manager.domain_ips.values()) if manager.domain_ips else set()
+    current = get_global_block_ips()
+    if current is None:
+        current = set(manager.blocked_ips)
+    result = apply_global_block_diff(desired - current, current - desired)
+    result["changed"] = bool(result.get("added") or result.get("removed"))
+    return result
+
+
+def apply_domain_block_changes(added_domains, removed_domains) -> Dict:
+    """
+    Block newly added domains and unblock removed ones, touching only their IPs.
+
+    IPs still used by another blocked domain stay blocked. Relies on
+    manager.domain_ips from the previous sync/update_from_database.
+    """
+    manager = get_firewall_manager()
+    added = sorted(set(added_domains or []))
+    removed = set(removed_domains or [])
+
+    released: Set[str] = set()
+    for domain in removed:
+        released.update(manager.domain_ips.pop(domain, set()))
+    new_ips: Set[str] = set()
+    if added:
+        resolved = resolve_domains(added)
+        for domain in added:
+            manager.domain_ips[domain] = set(resolved.get(domain) or set())
+            new_ips.update(manager.domain_ips[domain])
+
+    still_blocked = set().union(*manager.domain_ips.values()) if manager.domain_ips else set()
+    current = get_global_block_ips()
+    if current is None:
+        current = set(manager.blocked_ips)
+    result = apply_global_block_diff(new_ips - current, (released - still_blocked) & current)
+    result["changed"] = bool(result.get("added") or result.get("removed"))
+    return result
+
+
+def _learned_blocks_from_save(save_output: str) -> Dict[str, tuple]:
+    """Map ip -> (expires_at epoch, saved rule line) for LEARNED_BLOCKS_CHAIN."""
+    learned: Dict[str, tuple] = {}
+    prefix = f"-A {LEARNED_BLOCKS_CHAIN} "
+    for line in (save_output or "").splitlines():
+        if not line.startswith(prefix):
+            continue
+        parts = line.split()
+        ip = ""
+        expires_at = 0.0
+        for index, token in enumerate(parts[:-1]):
+            if token == "-d":
+                ip = parts[index + 1].split("/", 1)[0]
+            elif token == "--comment":
+                comment = parts[index + 1].strip('"')
+                if comment.startswith(LEARNED_BLOCK_COMMENT_PREFIX):
+                    try:
+                        expires_at = float(comment[len(LEARNED_BLOCK_COMMENT_PREFIX):])
+                    except ValueError:
+                        expires_at = 0.0
+        if ip:
+            learned[ip] = (expires_at, line)
+    return learned
+
+
+def _ensure_learned_blocks_hook() -> None:
+    _ensure_chain(LEARNED_BLOCKS_CHAIN)
+    _ensure_chain(HOTSPOT_FORWARD_CHAIN)
+    # Ahead of the DNS-bypass/auth/drop rules, next to the GLOBAL_BLOCKS jump.
+    _ensure_rule(HOTSPOT_FORWARD_CHAIN, _block_hook_args(LEARNED_BLOCKS_CHAIN), insert_position=1)
+
+
+def get_learned_block_expiries() -> Optional[Dict[str, float]]:
+    """Learned IPs with their expiry (epoch seconds), as persisted in rule comments."""
+    saved_filter = _iptables_save_table("filter")
+    if saved_filter is None:
+        return None
+    return {ip: expires_at for ip, (expires_at, _) in _learned_blocks_from_save(saved_filter).items()}
+
+
+def apply_learned_block_diff(add_ips: Dict[str, float], remove_ips) -> Dict:
+    """
+    Add learned IPs (ip -> expires_at epoch) and drop expired ones in one
+    iptables-restore --noflush. The expiry is kept in the rule comment so a
+    restarted learner can pick the set back up.
+    """
+    add = {str(ip).strip(): float(expires_at) for ip, expires_at in (add_ips or {}).items() if str(ip).strip()}
+    remove = {str(ip or "").strip() for ip in remove_ips if str(ip or "").strip()} - set(add)
+    if not add and not remove:
+        return {"success": True, "added": 0, "removed": 0}
+
+    try:
+        _ensure_learned_blocks_hook()
+    except Exception as e:
+        logger.warning(f"Failed to prepare {LEARNED_BLOCKS_CHAIN}: {e}")
+        return {"success": False, "added": 0, "removed": 0, "error": str(e)}
+
+    saved_filter = _iptables_save_table("filter")
+    if saved_filter is None:
+        return {"success": False, "added": 0, "removed": 0, "error": "iptables-save failed"}
+    existing = _learned_blocks_from_save(saved_filter)
+
+    lines: List[str] = []
+    for ip in remove:
+        if ip in existing:
+            lines.append("-D" + existing[ip][1][2:])
+    for ip, expires_at in sorted(add.items()):
+        if ip in existing:
+            lines.append("-D" + existing[ip][1][2:])
+        lines.append(
+            f"-A {LEARNED_BLOCKS_CHAIN} -d {ip} -m comment "
+            f"--comment {LEARNED_BLOCK_COMMENT_PREFIX}{int(expires_at)} -j DROP"
+        )
+
+    if not _iptables_restore_filter(lines, LEARNED_BLOCKS_CHAIN):
+        return {"success": False, "added": 0, "removed": 0}
+
+    logger.info(f"Updated {LEARNED_BLOCKS_CHAIN}: +{len(add)} / -{len(remove)} IPs")
+    return {"success": True, "added": len(add), "removed": len(remove)}
+
+
+_grouped_set_ready: Optional[bool] = None
+
+
+def _ipset_run(args: List[str], check: bool = False, input_text: Optional[str] = None) -> subprocess.CompletedProcess:
+    return subprocess.run(["sudo", "ipset"] + args, input=input_text, capture_output=True, text=True, check=check)
+
+
+def _ipset_restore(lines: List[str], label: str) -> bool:
+    """Apply ipset commands with one `ipset -exist restore`."""
+    if not lines:
+        return True
+    try:
+        result = _ipset_run(["-exist", "restore"], input_text="\n".join(lines) + "\n")
+        if result.returncode != 0:
+            logger.warning("ipset %s update failed: %s", label, (result.stderr or "").strip())
+        return result.returncode == 0
+    except Exception as e:
+        logger.warning(f"ipset {label} update failed: {e}")
+        return False
+
+
+def _ensure_grouped_set() -> bool:
+    """Create the list:set of group member sets; False if ipset is unavailable."""
+    global _grouped_set_ready
+    try:
+        _grouped_set_ready = _ipset_run(["create", GROUPED_CLIENTS_SET, "list:set", "-exist"]).returncode == 0
+    except OSError:
+        _grouped_set_ready = False
+    return _grouped_set_ready
+
+
+def _block_hook_args(chain: str) -> List[str]:
+    """Jump into a global block chain, skipped for clients whose group has its own policy."""
+    if _grouped_set_ready is None:
+        _ensure_grouped_set()
+    if _grouped_set_ready:
+        return ["-m", "set", "!", "--match-set", GROUPED_CLIENTS_SET, "src", "-j", chain]
+    return ["-j", chain]
+
+
+def _ensure_block_hooks() -> None:
+    """Hook GLOBAL_BLOCKS, the learned chain and the group chain into the forward chain."""
+    _ensure_grouped_set()
+    for chain in (GLOBAL_BLOCKS_CHAIN, LEARNED_BLOCKS_CHAIN):
+        _ensure_chain(chain)
+        if _grouped_set_ready:
+            _delete_rule_all(HOTSPOT_FORWARD_CHAIN, ["-j", chain])
+        _ensure_rule(HOTSPOT_FORWARD_CHAIN, _block_hook_args(chain), insert_position=1)
+    if _grouped_set_ready:
+        _ensure_chain(GROUP_BLOCKS_CHAIN)
+        _ensure_rule(
+            HOTSPOT_FORWARD_CHAIN,
+            ["-m", "set", "--match-set", GROUPED_CLIENTS_SET, "src", "-j", GROUP_BLOCKS_CHAIN],
+            insert_position=1,
+        )
+
+
+def _dns_views_hook_args(manager, proto: str) -> List[str]:
+    return ["-i", manager.hotspot_interface, "-p", proto, "--dport", "53", "-j", DNS_VIEWS_CHAIN]
+
+
+def _delete_rules_matching(chain: str, needle: str, table: str = "filter") -> None:
+    """Delete every rule in chain whose spec mentions needle."""
+    result = _iptables_run(["-S", chain], table=table, check=False)
+    for line in (result.stdout or "").splitlines():
+        if line.startswith(f"-A {chain} ") and needle in line.split():
+            _iptables_run(["-D"] + shlex.split(line)[1:], table=table, check=False)
+
+
+def group_set_names(group: str) -> tuple:
+    """(member set, blocked-destination set) for a normalized group name."""
+    return f"{GROUP_MEMBER_SET_PREFIX}{group}", f"{GROUP_BLOCK_SET_PREFIX}{group}"
+
+
+def get_firewall_groups() -> Set[str]:
+    """Groups that currently have member sets in the kernel."""
+    try:
+        result = _ipset_run(["-n", "list"])
+    except OSError:
+        return set()
+    return {
+        name[len(GROUP_MEMBER_SET_PREFIX):]
+        for name in (result.stdout or "").split()
+        if name.startswith(GROUP_MEMBER_SET_PREFIX)
+    }
+
+
+def ensure_group_firewall(group: str, dns_port: Optional[int] = None) -> bool:
+    """
+    Create a group's sets and its rules: one DROP for (member src, blocked dst)
+    and, with a DNS view, one REDIRECT per protocol to the view's port. The
+    packet path is a constant number of set lookups whatever the group sizes.
+    """
+    if not _ensure_grouped_set():
+        return False
+    manager = get_firewall_manager()
+    member_set, block_set = group_set_names(group)
+    try:
+        for name in (member_set, block_set):
+            _ipset_run(["create", name, "hash:ip", "-exist"], check=True)
+        _ipset_run(["add", GROUPED_CLIENTS_SET, member_set, "-exist"], check=True)
+
+        _ensure_block_hooks()
+        _ensure_rule(
+            GROUP_BLOCKS_CHAIN,
+            ["-m", "set", "--match-set", member_set, "src", "-m", "set", "--match-set", block_set, "dst", "-j", "DROP"],
+        )
+
+        _ensure_chain(DNS_VIEWS_CHAIN, table="nat")
+        _delete_rules_matching(DNS_VIEWS_CHAIN, member_set, table="nat")
+        if dns_port:
+            for proto in ("udp", "tcp"):
+                _ensure_rule("PREROUTING", _dns_views_hook_args(manager, proto), table="nat", insert_position=1)
+                _ensure_rule(
+                    DNS_VIEWS_CHAIN,
+                    ["-p", proto, "-m", "set", "--match-set", member_set, "src",
+                     "-j", "REDIRECT", "--to-ports", str(dns_port)],
+                    table="nat",
+                )
+        return True
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to set up filter group {group}: {(e.stderr or '').strip() or e}")
+        return False
+
+
+def remove_group_firewall(group: str) -> None:
+    member_set, block_set = group_set_names(group)
+    _delete_rules_matching(GROUP_BLOCKS_CHAIN, member_set)
+    _delete_rules_matching(DNS_VIEWS_CHAIN, member_set, table="nat")
+    _ipset_run(["del", GROUPED_CLIENTS_SET, member_set, "-exist"])
+    for name in (member_set, block_set):
+        _ipset_run(["destroy", name])
+    logger.info(f"Removed filter group {group}")
+
+
+def _destroy_group_sets() -> None:
+    _ipset_run(["flush", GROUPED_CLIENTS_SET])
+    for group in get_firewall_groups():
+        for name in group_set_names(group):
+            _ipset_run(["destroy", name])
+    _ipset_run(["destroy", GROUPED_CLIENTS_SET])
+
+
+def replace_group_set(set_name: str, ips) -> bool:
+    """Atomically replace a set's contents (fill a twin set, swap, destroy)."""
+    temp_set = f"{set_name}_new"
+    lines = [f"create {temp_set} hash:ip", f"flush {temp_set}"]
+    lines.extend(f"add {temp_set} {ip}" for ip in sorted(set(ips)))
+    lines.extend([f"swap {temp_set} {set_name}", f"destroy {temp_set}"])
+    return _ipset_restore(lines, set_name)
+
+
+def set_client_groups(assignments: Dict[str, Optional[str]], groups) -> bool:
+    """
+    Put each client IP in its group's member set (and out of the others) in
+    one ipset restore; a login is a set add, no iptables rule changes.
+    """
+    groups = sorted(set(groups))
+    if not assignments or not groups:
+        return True
+    lines: List[str] = []
+    for client_ip, assigned in sorted(assignments.items()):
+        for group in groups:
+            member_set = group_set_names(group)[0]
+            lines.append(f"{'add' if group == assigned else 'del'} {member_set} {client_ip}")
+    return _ipset_restore(lines, "group membership")
+
+
+def remove_clients_from_groups(client_ips) -> bool:
+    """Drop clients from every group member set (on logout)."""
+    if _grouped_set_ready is False:
+        return True
+    ips = sorted({str(ip or "").strip() for ip in client_ips if str(ip or "").strip()})
+    groups = get_firewall_groups() if ips else set()
+    if not groups:
+        return True
+    return set_client_groups({ip: None for ip in ips}, groups)
+
+
+_usage_sets_ready = False
+
+
+def _ensure_usage_accounting(manager) -> bool:
+    """Create the counter sets once per process and hook them into the usage chain."""
+    global _usage_sets_ready
+    created = False
+    if not _usage_sets_ready:
+        try:
+            created = _ipset_run(["-n", "list", USAGE_UPLOAD_SET]).returncode != 0
+            for name in (USAGE_UPLOAD_SET, USAGE_DOWNLOAD_SET):
+                _ipset_run(["create", name, "hash:ip", "counters", "-exist"], check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Usage accounting sets unavailable (is ipset installed?): {e}")
+            return False
+        _usage_sets_ready = True
+    for rule_args in _usage_rule_args(manager.hotspot_interface, manager.internet_interface):
+        _ensure_rule(HOTSPOT_USAGE_CHAIN, rule_args, insert_position=1)
+    if created:
+        # Clients granted before the sets existed (e.g. across an upgrade from
+        # per-client counting rules) would otherwise go uncounted until re-login.
+        granted = _granted_client_ips(manager)
+        if granted and _update_usage_sets("add", granted):
+            logger.info(f"Seeded usage accounting sets with {len(granted)} granted client(s)")
+        _delete_legacy_usage_rules()
+    return True
+
+
+def _granted_client_ips(manager) -> Set[str]:
+    """Clients with an ACCEPT rule in the auth chain (outlives app restarts), plus in-memory grants."""
+    ips = set(manager.authenticated_ips)
+    result = _iptables_run(["-S", HOTSPOT_AUTH_CHAIN], check=False)
+    for line in (result.stdout or "").splitlines():
+        parts = line.split()
+        if parts[:2] == ["-A", HOTSPOT_AUTH_CHAIN] and "-s" in parts and parts[-1] == "ACCEPT":
+            ips.add(parts[parts.index("-s") + 1].split("/", 1)[0])
+    return ips
+
+
+def _delete_legacy_usage_rules() -> None:
+    """Drop the old per-client `wifi_usage_up:/down:` comment rules from the usage chain."""
+    result = _iptables_run(["-S", HOTSPOT_USAGE_CHAIN], check=False)
+    for line in (result.stdout or "").splitlines():
+        if line.startswith(f"-A {HOTSPOT_USAGE_CHAIN} ") and "--comment" in line and "wifi_usage_" in line:
+            _iptables_run(["-D"] + shlex.split(line)[1:], check=False)
+
+
+def _update_usage_sets(action: str, client_ips) -> bool:
+    """add/del clients in both usage sets; re-adding keeps an element's counters."""
+    lines = [
+        f"{action} {name} {client_ip}"
+        for client_ip in sorted(set(client_ips))
+        for name in (USAGE_UPLOAD_SET, USAGE_DOWNLOAD_SET)
+    ]
+    return _ipset_restore(lines, "usage accounting")
+
+
+def _destroy_usage_sets() -> None:
+    global _usage_sets_ready
+    for name in (USAGE_UPLOAD_SET, USAGE_DOWNLOAD_SET):
+        _ipset_run(["destroy", name])
+    _usage_sets_ready = False
+
+
 def setup_hotspot_firewall():
     """Initial setup for hotspot firewall with captive portal"""
     # This delegates to captive-portal setup so chain hooks are refreshed.
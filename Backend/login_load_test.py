@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Login Load Test - Fire a burst of concurrent student logins and report latency
+Simulates the start-of-class rush against /api/auth/login
+
+All requests come from this machine's IP, so start the backend with
+LOGIN_RATE_LIMIT_ATTEMPTS=0 (or run the test from many hosts) to measure
+the hashing pool rather than the per-IP limiter.
+"""
+
+import argparse
+import json
+import math
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def seed_users(roll_nos, password, mongo_uri):
+    """Create the load-test students (hashed in the shared password pool)."""
+    from pymongo import MongoClient
+    from password_pool import hash_passwords, shutdown_password_pool
+
+    users = MongoClient(mongo_uri)["studentapp"]["users"]
+    existing = {d["roll_no"] for d in users.find({"roll_no": {"$in": roll_nos}}, {"roll_no": 1})}
+    missing = [r for r in roll_nos if r not in existing]
+    if missing:
+        docs = [
+            {
+                "roll_no": roll_no,
+                "password": password_hash,
+                "role": "student",
+                "user_type": "student",
+                "blocked": False,
+                "activity": "Idle",
+                "bandwidth_limit": "medium",
+                "bandwidth_effective_tier": "medium",
+            }
+            for roll_no, password_hash in zip(missing, hash_passwords([password] * len(missing)))
+        ]
+        users.insert_many(docs, ordered=False)
+    shutdown_password_pool()
+    print(f"Seeded {len(missing)} user(s) ({len(existing)} already present)")
+
+
+def run_load_test(url, roll_nos, password, concurrency, timeout):
+    start_gate = threading.Event()
+
+    def one_login(roll_no):
+        body = json.dumps({"roll_no": roll_no, "password": password}).encode("utf-8")
+        req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+        # Hold the first wave until every worker thread is ready, then release together.
+        start_gate.wait()
+
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except Exception as error:
+            status = type(error).__name__
+        return status, time.perf_counter() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(one_login, roll_no) for roll_no in roll_nos]
+        time.sleep(1.0)
+        start_gate.set()
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Concurrent login load test')
+    parser.add_argument('--url', default='http://127.0.0.1:5000/api/auth/login')
+    parser.add_argument('--concurrency', type=int, default=500, help='Simultaneous logins (default: 500)')
+    parser.add_argument('--users', type=int, default=500, help='Number of distinct test students')
+    parser.add_argument('--roll-prefix', default='LOADTEST')
+    parser.add_argument('--password', default='LoadTest@123')
+    parser.add_argument('--seed', action='store_true', help='Create the test students in MongoDB first')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Per-request timeout in seconds')
+
+    args = parser.parse_args()
+
+    test_roll_nos = [f"{args.roll_prefix}{i:05d}" for i in range(args.users)]
+    if args.seed:
+        seed_users(test_roll_nos, args.password, args.mongo_uri)
+
+    wall_start = time.perf_counter()
+    results = run_load_test(args.url, test_roll_nos, args.password, args.concurrency, args.timeout)
+    wall = time.perf_counter() - wall_start
+
+    latencies = [elapsed for status, elapsed in results if status == 200]
+    statuses = Counter(status for status, _ in results)
+
+    print(f"{len(results)} logins in {wall:.2f}s with concurrency {args.concurrency}")
+    print("Status codes: " + ", ".join(f"{k}={v}" for k, v in sorted(statuses.items(), key=str)))
+    if latencies:
+        print(
+            f"Successful login latency: p50={percentile(latencies, 50) * 1000:.0f} ms "
+            f"p99={percentile(latencies, 99) * 1000:.0f} ms "
+            f"mean={statistics.mean(latencies) * 1000:.0f} ms "
+            f"max={max(latencies) * 1000:.0f} ms"
+        )
+    if statuses.get(429):
+        print("Note: 429 responses mean the per-IP limiter kicked in; set LOGIN_RATE_LIMIT_ATTEMPTS=0 on the server.")
@@ -1,5 +1,6 @@
 from db import users_collection
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash
+from password_pool import verify_password
 
 def create_user(name, roll_no, password):
     hashed_password = generate_password_hash(password)
@@ -19,7 +20,8 @@ def find_user(roll_no):
     return users_collection.find_one({"roll_no": roll_no})
 
 def validate_user(roll_no, password):
+    """Return the user on a password match; may raise PasswordPoolBusy under load."""
     user = users_collection.find_one({"roll_no": roll_no})
-    if user and check_password_hash(user["password"], password):
+    if user and verify_password(user.get("password"), password):
         return user
     return None
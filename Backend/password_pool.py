@@ -0,0 +1,92 @@
+"""
+Password Pool - Run werkzeug password hashing in worker processes
+Keeps CPU-bound PBKDF2/scrypt work off Flask request threads and the GIL
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import CancelledError, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_POOL_WORKERS = max(1, int(os.environ.get("PASSWORD_POOL_WORKERS", os.cpu_count() or 2)))
+# Verifications allowed in flight (running + queued) before callers are turned away.
+PASSWORD_VERIFY_QUEUE_SIZE = max(1, int(os.environ.get("PASSWORD_VERIFY_QUEUE_SIZE", PASSWORD_POOL_WORKERS * 16)))
+PASSWORD_VERIFY_TIMEOUT_SECONDS = float(os.environ.get("PASSWORD_VERIFY_TIMEOUT_SECONDS", "10"))
+
+_pool_lock = threading.Lock()
+_pool = None
+_verify_slots = threading.BoundedSemaphore(PASSWORD_VERIFY_QUEUE_SIZE)
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when the verification queue is full or a check timed out."""
+
+
+def get_password_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS)
+            logger.info("Started password pool with %d worker process(es)", PASSWORD_POOL_WORKERS)
+        return _pool
+
+
+def shutdown_password_pool(pool: ProcessPoolExecutor = None) -> None:
+    """
+    Drop the shared pool (only if it is still `pool`, when given). Queued
+    checks are not cancelled: other request threads may be waiting on them.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None and (pool is None or _pool is pool):
+            _pool.shutdown(wait=False)
+            _pool = None
+
+
+def hash_passwords(passwords: Iterable[str], chunksize: int = 32) -> Iterator[str]:
+    """Hash passwords in parallel, yielding results in input order."""
+    yield from get_password_pool().map(generate_password_hash, passwords, chunksize=chunksize)
+
+
+def verify_password(password_hash: str, password: str, timeout: float = PASSWORD_VERIFY_TIMEOUT_SECONDS) -> bool:
+    """
+    Check a password in the process pool.
+
+    Raises PasswordPoolBusy instead of queueing unboundedly when more than
+    PASSWORD_VERIFY_QUEUE_SIZE checks are already in flight.
+    """
+    if not password_hash or password is None:
+        return False
+
+    if not _verify_slots.acquire(blocking=False):
+        raise PasswordPoolBusy("Password verification queue is full")
+
+    pool = get_password_pool()
+    try:
+        future = pool.submit(check_password_hash, password_hash, password)
+    except (BrokenProcessPool, RuntimeError) as error:
+        _verify_slots.release()
+        logger.warning("Password pool unavailable, verifying inline: %s", error)
+        shutdown_password_pool(pool)
+        return check_password_hash(password_hash, password)
+
+    future.add_done_callback(lambda _: _verify_slots.release())
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        raise PasswordPoolBusy("Password verification timed out")
+    except BrokenProcessPool as error:
+        # A worker died (e.g. OOM-killed); rebuild the pool on the next call.
+        logger.warning("Password pool broke, verifying inline: %s", error)
+        shutdown_password_pool(pool)
+        return check_password_hash(password_hash, password)
+    except CancelledError:
+        # The pool was shut down (e.g. at exit) before this check ran.
+        return check_password_hash(password_hash, password)
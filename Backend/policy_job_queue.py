@@ -0,0 +1,194 @@
+"""
+Policy Job Queue - Apply login grants (firewall + shaping) off the request path
+A single worker drains queued grants, coalesces bursts and applies them in one batch
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from db import sessions_collection
+
+logger = logging.getLogger(__name__)
+
+# How long the worker keeps collecting grants after the first one arrives.
+POLICY_JOB_COALESCE_SECONDS = float(os.environ.get("POLICY_JOB_COALESCE_SECONDS", "0.2"))
+POLICY_JOB_RETENTION_SECONDS = 600
+
+_jobs_lock = threading.Lock()
+_jobs: Dict[str, Dict] = {}
+_job_queue: "queue.Queue[str]" = queue.Queue()
+_worker_thread: Optional[threading.Thread] = None
+
+
+def _public_job(job: Dict) -> Dict:
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+
+def _prune_jobs(now: float) -> None:
+    cutoff = now - POLICY_JOB_RETENTION_SECONDS
+    for job_id in [j for j, job in _jobs.items() if (job.get("_finished_ts") or now) < cutoff]:
+        _jobs.pop(job_id, None)
+
+
+def _ensure_worker() -> None:
+    global _worker_thread
+    if _worker_thread is not None and _worker_thread.is_alive():
+        return
+    _worker_thread = threading.Thread(target=_worker, name="policy-job-worker", daemon=True)
+    _worker_thread.start()
+
+
+def enqueue_grant(client_ip: str, roll_no: Optional[str] = None, grant_firewall: bool = True) -> Dict:
+    """Queue a grant for one client and return its job record."""
+    now = time.time()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "type": "grant",
+        "client_ip": client_ip,
+        "roll_no": roll_no,
+        "grant_firewall": bool(grant_firewall),
+        "status": "queued",
+        "queued_at": now,
+        "_finished_ts": None,
+    }
+    with _jobs_lock:
+        _prune_jobs(now)
+        _jobs[job["job_id"]] = job
+        _ensure_worker()
+    _job_queue.put(job["job_id"])
+    return _public_job(job)
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return _public_job(job) if job else None
+
+
+def _collect_batch() -> List[str]:
+    """Block for the first job, then gather everything queued within the coalesce window."""
+    batch = [_job_queue.get()]
+    deadline = time.monotonic() + POLICY_JOB_COALESCE_SECONDS
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_job_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    # Anything that arrived while we waited rides along too.
+    while True:
+        try:
+            batch.append(_job_queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _active_client_ips(client_ips: List[str]) -> set:
+    """Only grant IPs that still have an active session (a logout may have raced us)."""
+    if not client_ips:
+        return set()
+    cursor = sessions_collection.find(
+        {"client_ip": {"$in": client_ips}, "status": "active"},
+        {"client_ip": 1},
+    )
+    return {doc.get("client_ip") for doc in cursor}
+
+
+def _assign_filter_groups(jobs: List[Dict], client_ips: set) -> None:
+    """Join group member sets before access is granted, so no packet sees the wrong policy."""
+    try:
+        from filter_groups import assign_clients_to_groups
+
+        assign_clients_to_groups({
+            job["client_ip"]: job.get("roll_no") for job in jobs if job.get("client_ip") in client_ips
+        })
+    except ImportError:
+        pass
+    except Exception as e:
+        logger.error(f"Grant batch filter-group step failed: {e}")
+
+
+def _apply_batch(job_ids: List[str]) -> None:
+    started = time.time()
+    with _jobs_lock:
+        jobs = [_jobs[j] for j in job_ids if j in _jobs]
+        for job in jobs:
+            job["status"] = "running"
+            job["started_at"] = started
+
+    firewall_ips = sorted({job["client_ip"] for job in jobs if job.get("grant_firewall") and job.get("client_ip")})
+    firewall_result: Dict = {"success": True, "skipped": True}
+    bandwidth_error = None
+    skipped_ips = set()
+
+    try:
+        if firewall_ips:
+            active_ips = _active_client_ips(firewall_ips)
+            skipped_ips = set(firewall_ips) - active_ips
+            if active_ips:
+                _assign_filter_groups(jobs, active_ips)
+
+                from linux_firewall_manager import allow_authenticated_users
+
+                firewall_result = allow_authenticated_users(sorted(active_ips))
+    except Exception as e:
+        logger.error(f"Grant batch firewall step failed: {e}")
+        firewall_result = {"success": False, "error": str(e)}
+
+    try:
+        from bandwidth_manager import apply_bandwidth_for_active_users
+
+        apply_bandwidth_for_active_users()
+    except ImportError:
+        pass
+    except Exception as e:
+        logger.error(f"Grant batch bandwidth step failed: {e}")
+        bandwidth_error = str(e)
+
+    finished = time.time()
+    failed_ips = set(firewall_result.get("failed") or [])
+    if not firewall_result.get("success") and not failed_ips:
+        failed_ips = set(firewall_ips) - skipped_ips
+
+    with _jobs_lock:
+        for job in jobs:
+            client_ip = job.get("client_ip")
+            if client_ip in skipped_ips:
+                job["status"] = "skipped"
+                job["detail"] = "Session no longer active"
+            elif client_ip in failed_ips:
+                job["status"] = "failed"
+                job["detail"] = firewall_result.get("error") or "Firewall grant failed"
+            else:
+                job["status"] = "done"
+            if bandwidth_error:
+                job["bandwidth_error"] = bandwidth_error
+            job["batch_size"] = len(jobs)
+            job["finished_at"] = finished
+            job["apply_seconds"] = round(finished - started, 3)
+            job["_finished_ts"] = finished
+
+    logger.info(
+        "Applied %d grant job(s) in %.2fs (%d firewall client(s), %d skipped)",
+        len(jobs),
+        finished - started,
+        len(firewall_ips) - len(skipped_ips),
+        len(skipped_ips),
+    )
+
+
+def _worker() -> None:
+    while True:
+        batch = _collect_batch()
+        try:
+            _apply_batch(batch)
+        except Exception as e:
+            logger.error(f"Grant batch failed: {e}")
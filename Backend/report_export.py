@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Report Export - Stream detection audits as CSV / NDJSON chunks
+Iterates a Mongo cursor in batches so memory stays flat regardless of row count
+"""
+
+import csv
+import datetime
+import io
+import json
+import logging
+import zlib
+from typing import Dict, Iterable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+AUDIT_EXPORT_FIELDS = ["timestamp", "roll_no", "client_ip", "domain", "category", "app_name"]
+AUDIT_EXPORT_BATCH_SIZE = 2000
+# Flush the text buffer to the response once it grows past this size.
+AUDIT_EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def parse_export_datetime(value: Optional[str]) -> Optional[datetime.datetime]:
+    """Parse YYYY-MM-DD or ISO-8601 input into a naive UTC datetime."""
+    text = (value or "").strip()
+    if not text:
+        return None
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    try:
+        parsed = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def build_audit_query(
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    roll_no: Optional[str] = None,
+    category: Optional[str] = None,
+) -> Dict:
+    query: Dict = {}
+    time_range = {}
+    if start is not None:
+        time_range["$gte"] = start
+    if end is not None:
+        time_range["$lt"] = end
+    if time_range:
+        query["timestamp"] = time_range
+    if roll_no:
+        query["roll_no"] = roll_no
+    if category:
+        query["category"] = category.lower()
+    return query
+
+
+def _format_timestamp(value) -> str:
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+    return "" if value is None else str(value)
+
+
+def iter_audit_rows(collection, query: Dict, batch_size: int = AUDIT_EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Yield projected detection rows in (timestamp, _id) order."""
+    projection = {field: 1 for field in AUDIT_EXPORT_FIELDS}
+    projection["_id"] = 0
+    cursor = (
+        collection.find(query, projection)
+        .sort([("timestamp", 1), ("_id", 1)])
+        .batch_size(batch_size)
+    )
+    try:
+        for doc in cursor:
+            yield doc
+    finally:
+        cursor.close()
+
+
+def iter_csv_chunks(rows: Iterable[Dict], chunk_bytes: int = AUDIT_EXPORT_CHUNK_BYTES) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(AUDIT_EXPORT_FIELDS)
+
+    for row in rows:
+        writer.writerow([
+            _format_timestamp(row.get("timestamp")),
+            row.get("roll_no", ""),
+            row.get("client_ip", ""),
+            row.get("domain", ""),
+            row.get("category", ""),
+            row.get("app_name", ""),
+        ])
+        if buffer.tell() >= chunk_bytes:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson_chunks(rows: Iterable[Dict], chunk_bytes: int = AUDIT_EXPORT_CHUNK_BYTES) -> Iterator[str]:
+    parts = []
+    size = 0
+    for row in rows:
+        line = json.dumps({
+            "timestamp": _format_timestamp(row.get("timestamp")),
+            "roll_no": row.get("roll_no"),
+            "client_ip": row.get("client_ip"),
+            "domain": row.get("domain"),
+            "category": row.get("category"),
+            "app_name": row.get("app_name"),
+        }, separators=(",", ":")) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield "".join(parts)
+            parts = []
+            size = 0
+
+    if parts:
+        yield "".join(parts)
+
+
+def gzip_chunks(chunks: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """Compress text chunks into a single gzip member as they are produced."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_audit_export(
+    collection,
+    query: Dict,
+    export_format: str = "csv",
+    compress: bool = False,
+    batch_size: int = AUDIT_EXPORT_BATCH_SIZE,
+) -> Iterator:
+    rows = iter_audit_rows(collection, query, batch_size=batch_size)
+    if export_format == "ndjson":
+        chunks = iter_ndjson_chunks(rows)
+    else:
+        chunks = iter_csv_chunks(rows)
+
+    if compress:
+        return gzip_chunks(chunks)
+    return (chunk.encode("utf-8") for chunk in chunks)
+
+
+def _seed_benchmark_collection(collection, count: int, batch: int = 10000) -> None:
+    import random
+
+    categories = ["general", "social", "streaming", "gaming", "proxy", "vpn"]
+    domains = ["youtube.com", "instagram.com", "google.com", "steampowered.com", "nordvpn.com", "wikipedia.org"]
+    start = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    step = datetime.timedelta(days=30) / max(1, count)
+
+    inserted = 0
+    while inserted < count:
+        docs = []
+        for offset in range(min(batch, count - inserted)):
+            index = inserted + offset
+            domain = random.choice(domains)
+            docs.append({
+                "timestamp": start + step * index,
+                "roll_no": f"BENCH{index % 5000:05d}",
+                "client_ip": f"192.168.50.{10 + index % 90}",
+                "domain": domain,
+                "category": random.choice(categories),
+                "app_name": domain.split(".")[0].capitalize(),
+            })
+        collection.insert_many(docs, ordered=False)
+        inserted += len(docs)
+        logger.info("Seeded %s/%s detections", inserted, count)
+
+
+if __name__ == "__main__":
+    import argparse
+    import resource
+    import time
+
+    from pymongo import MongoClient
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Benchmark the streaming audit export')
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--database', default='studentapp')
+    parser.add_argument('--collection', default='detections_export_bench',
+                        help='Collection to export (default: a scratch benchmark collection)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Insert N synthetic detections first (e.g. 5000000)')
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--gzip', action='store_true', help='Gzip the stream')
+    parser.add_argument('--batch-size', type=int, default=AUDIT_EXPORT_BATCH_SIZE)
+    parser.add_argument('--output', default=None, help='Write the export here instead of discarding it')
+
+    args = parser.parse_args()
+
+    bench_collection = MongoClient(args.mongo_uri)[args.database][args.collection]
+    if args.seed:
+        _seed_benchmark_collection(bench_collection, args.seed)
+    bench_collection.create_index([("timestamp", 1), ("_id", 1)])
+
+    sink = open(args.output, "wb") if args.output else None
+    total_bytes = 0
+    started = time.perf_counter()
+    try:
+        for piece in stream_audit_export(
+            bench_collection,
+            {},
+            export_format=args.format,
+            compress=args.gzip,
+            batch_size=args.batch_size,
+        ):
+            total_bytes += len(piece)
+            if sink:
+                sink.write(piece)
+    finally:
+        if sink:
+            sink.close()
+    elapsed = time.perf_counter() - started
+
+    rows = bench_collection.estimated_document_count()
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Exported ~{rows} rows, {total_bytes / 1e6:.1f} MB in {elapsed:.1f}s "
+          f"({rows / max(elapsed, 1e-9):,.0f} rows/s), peak RSS {peak_rss_mb:.0f} MB")
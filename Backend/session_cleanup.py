@@ -5,20 +5,34 @@ Automatically detects and removes stale sessions from disconnected users
 Run this periodically (e.g., every 5 minutes via cron)
 """
 
+import asyncio
 import subprocess
 import sys
 import logging
 import os
+import re
 from datetime import datetime
+from typing import Dict, Iterable, Optional, Set
 import ipaddress
 
 # Add backend to path
 sys.path.insert(0, '/home/nikhil/wifi-management/Backend')
-from db import db
+from db import db, daily_usage_update
+from pymongo import UpdateOne
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Neighbor states that prove the client answered recently.
+NEIGH_ALIVE_STATES = {"REACHABLE", "DELAY", "PROBE", "PERMANENT"}
+# Neighbor states that prove address resolution failed.
+NEIGH_DEAD_STATES = {"FAILED", "INCOMPLETE"}
+
+PROBE_TIMEOUT_SECONDS = 1
+MAX_CONCURRENT_PROBES = int(os.environ.get("SESSION_CLEANUP_MAX_PROBES", "64"))
+
+_MAC_PATTERN = re.compile(r"^([0-9a-f]{2}(?::[0-9a-f]{2}){5})$", re.IGNORECASE)
+
 
 def _safe_non_negative_int(value):
     try:
@@ -35,20 +49,11 @@ def _is_hotspot_client_ip(client_ip: str) -> bool:
         return False
 
 
-def _persist_session_usage(session):
-    roll_no = str(session.get('roll_no') or '').strip()
-    client_ip = str(session.get('client_ip') or '').strip()
-    if not roll_no or not client_ip:
-        return
-
-    try:
-        from linux_firewall_manager import get_usage_for_client_ip
-
-        usage = get_usage_for_client_ip(client_ip) or {}
-    except Exception as error:
-        logger.warning("Failed to read usage counters for %s (%s): %s", roll_no, client_ip, error)
-        return
-
+def _session_usage_updates(session, usage, now):
+    """
+    Build the user $inc and session $set fields that account for the
+    bytes a session used since its last sync.
+    """
     current_upload = _safe_non_negative_int(usage.get('upload_bytes'))
     current_download = _safe_non_negative_int(usage.get('download_bytes'))
 
@@ -59,47 +64,268 @@ def _persist_session_usage(session):
     delta_download = current_download - accounted_download if current_download >= accounted_download else current_download
     delta_total = max(0, delta_upload + delta_download)
 
+    user_inc = None
     if delta_total > 0:
-        db['users'].update_one(
-            {'roll_no': roll_no},
-            {
-                '$inc': {
-                    'total_data_bytes': delta_total,
-                    'total_upload_bytes': max(0, delta_upload),
-                    'total_download_bytes': max(0, delta_download),
-                },
-                '$set': {'data_usage_updated_at': datetime.utcnow()},
-            },
-        )
+        user_inc = {
+            'total_data_bytes': delta_total,
+            'total_upload_bytes': max(0, delta_upload),
+            'total_download_bytes': max(0, delta_download),
+        }
 
-    db['active_sessions'].update_one(
-        {'_id': session['_id']},
-        {
-            '$set': {
-                'usage_upload_bytes': current_upload,
-                'usage_download_bytes': current_download,
-                'usage_total_bytes': current_upload + current_download,
-                'usage_accounted_upload_bytes': current_upload,
-                'usage_accounted_download_bytes': current_download,
-                'usage_last_sync': datetime.utcnow(),
-            }
-        },
-    )
-
-def is_ip_reachable(ip: str, timeout: int = 1) -> bool:
-    """Check if an IP is reachable via ping"""
+    session_set = {
+        'usage_upload_bytes': current_upload,
+        'usage_download_bytes': current_download,
+        'usage_total_bytes': current_upload + current_download,
+        'usage_accounted_upload_bytes': current_upload,
+        'usage_accounted_download_bytes': current_download,
+        'usage_last_sync': now,
+    }
+    return user_inc, session_set
+
+
+def _get_hotspot_interface() -> str:
+    return (os.environ.get('HOTSPOT_INTERFACE') or '').strip() or 'wlx782051ac644f'
+
+
+def read_neighbor_table() -> Dict[str, Dict[str, Optional[str]]]:
+    """Read the kernel IPv4 neighbor table in one call, keyed by IP."""
     try:
         result = subprocess.run(
-            ['ping', '-c', '1', '-W', str(timeout), ip],
+            ['ip', '-4', 'neigh', 'show'],
             capture_output=True,
-            timeout=timeout + 1
+            text=True,
+            timeout=5,
         )
-        return result.returncode == 0
-    except (subprocess.TimeoutExpired, Exception):
+    except Exception as error:
+        logger.warning("Failed to read neighbor table: %s", error)
+        return {}
+
+    if result.returncode != 0:
+        return {}
+
+    neighbors: Dict[str, Dict[str, Optional[str]]] = {}
+    for line in (result.stdout or '').splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+
+        mac = None
+        if 'lladdr' in parts:
+            mac_index = parts.index('lladdr') + 1
+            if mac_index < len(parts):
+                mac = parts[mac_index].lower()
+
+        neighbors[parts[0]] = {
+            'mac': mac,
+            'state': parts[-1].upper(),
+        }
+
+    return neighbors
+
+
+def read_hostapd_stations(interface: Optional[str] = None) -> Optional[Set[str]]:
+    """
+    Return MAC addresses of stations associated with hostapd, or None
+    when the control interface is unavailable.
+    """
+    interface = interface or _get_hotspot_interface()
+    commands = [['hostapd_cli', '-i', interface, 'all_sta']]
+    if os.geteuid() != 0:
+        commands.append(['sudo', '-n', 'hostapd_cli', '-i', interface, 'all_sta'])
+
+    for command in commands:
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=5)
+        except Exception:
+            continue
+
+        if result.returncode != 0:
+            continue
+
+        stations = set()
+        for line in (result.stdout or '').splitlines():
+            match = _MAC_PATTERN.match(line.strip())
+            if match:
+                stations.add(match.group(1).lower())
+        return stations
+
+    return None
+
+
+def _classify_from_tables(
+    client_ip: str,
+    neighbors: Dict[str, Dict[str, Optional[str]]],
+    stations: Optional[Set[str]],
+) -> Optional[bool]:
+    """Decide liveness from cached kernel/hostapd state; None means unknown."""
+    entry = neighbors.get(client_ip)
+    if not entry:
+        return None
+
+    mac = entry.get('mac')
+    if stations is not None and mac:
+        return mac in stations
+
+    state = entry.get('state')
+    if state in NEIGH_ALIVE_STATES:
+        return True
+    if state in NEIGH_DEAD_STATES:
         return False
+    return None
+
+
+async def _probe_ip(ip: str, timeout: int, semaphore: asyncio.Semaphore) -> bool:
+    async with semaphore:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                'ping', '-c', '1', '-W', str(timeout), ip,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except Exception:
+            return False
+
+        try:
+            return await asyncio.wait_for(process.wait(), timeout=timeout + 1) == 0
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return False
+
+
+async def _probe_all(ips: Iterable[str], timeout: int) -> Dict[str, bool]:
+    semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENT_PROBES))
+    ip_list = list(ips)
+    results = await asyncio.gather(*(_probe_ip(ip, timeout, semaphore) for ip in ip_list))
+    return dict(zip(ip_list, results))
+
+
+def probe_ips_concurrently(ips: Iterable[str], timeout: int = PROBE_TIMEOUT_SECONDS) -> Dict[str, bool]:
+    """Ping all IPs at once so a pass costs the slowest probe, not the sum."""
+    ip_list = sorted(set(ips))
+    if not ip_list:
+        return {}
+    return asyncio.run(_probe_all(ip_list, timeout))
 
 
-def cleanup_stale_sessions():
+def check_reachability(ips: Iterable[str]) -> Dict[str, bool]:
+    """
+    Resolve liveness for many IPs: neighbor table and hostapd station list
+    first, then concurrent ICMP probes only for IPs still unknown.
+    """
+    ip_list = sorted(set(ips))
+    if not ip_list:
+        return {}
+
+    neighbors = read_neighbor_table()
+    stations = read_hostapd_stations()
+
+    reachability: Dict[str, bool] = {}
+    unknown = []
+    for ip in ip_list:
+        verdict = _classify_from_tables(ip, neighbors, stations)
+        if verdict is None:
+            unknown.append(ip)
+        else:
+            reachability[ip] = verdict
+
+    if unknown:
+        logger.info(
+            "Probing %d unknown IP(s) concurrently (%d resolved from neighbor/station tables)",
+            len(unknown),
+            len(reachability),
+        )
+        reachability.update(probe_ips_concurrently(unknown))
+
+    return reachability
+
+
+def expire_sessions(sessions, reason: str = 'auto_cleanup', wait_for_bandwidth: bool = False) -> int:
+    """
+    Tear down many sessions in one batch: a single counter read, one
+    bulk_write per collection, one firewall transaction and one tc reconcile.
+
+    Short-lived callers (the cron CLI) must pass wait_for_bandwidth=True:
+    the reconcile runs on a daemon thread that dies with the process.
+    """
+    sessions = [session for session in sessions if session.get('_id') is not None]
+    if not sessions:
+        return 0
+
+    usage_by_ip = {}
+    try:
+        from linux_firewall_manager import get_usage_counters_by_ip
+
+        usage_by_ip = get_usage_counters_by_ip() or {}
+    except Exception as error:
+        logger.warning("Failed to read usage counters: %s", error)
+
+    now = datetime.utcnow()
+    user_ops = []
+    rollup_ops = []
+    session_ops = []
+    hotspot_ips = []
+
+    for session in sessions:
+        roll_no = str(session.get('roll_no') or '').strip()
+        client_ip = str(session.get('client_ip') or '').strip()
+
+        session_set = {
+            'status': 'inactive',
+            'logout_time': now,
+            'logout_reason': reason,
+            'auto_cleanup': True,
+        }
+
+        if roll_no and client_ip and usage_by_ip:
+            user_inc, usage_set = _session_usage_updates(session, usage_by_ip.get(client_ip) or {}, now)
+            session_set.update(usage_set)
+            if user_inc:
+                user_ops.append(UpdateOne(
+                    {'roll_no': roll_no},
+                    {'$inc': user_inc, '$set': {'data_usage_updated_at': now}},
+                ))
+                rollup_ops.append(UpdateOne(*daily_usage_update(roll_no, user_inc, now), upsert=True))
+
+        session_ops.append(UpdateOne({'_id': session['_id']}, {'$set': session_set}))
+
+        if _is_hotspot_client_ip(client_ip):
+            hotspot_ips.append(client_ip)
+
+    if hotspot_ips:
+        try:
+            from linux_firewall_manager import block_authenticated_users
+
+            block_authenticated_users(hotspot_ips)
+        except Exception as firewall_error:
+            logger.warning("Failed to revoke firewall access for stale sessions: %s", firewall_error)
+
+    if user_ops:
+        try:
+            db['users'].bulk_write(user_ops, ordered=False)
+            db['usage_daily'].bulk_write(rollup_ops, ordered=False)
+        except Exception as usage_error:
+            logger.warning("Failed to persist usage for stale sessions: %s", usage_error)
+
+    db['active_sessions'].bulk_write(session_ops, ordered=False)
+
+    if hotspot_ips:
+        try:
+            from bandwidth_manager import apply_bandwidth_for_active_users
+
+            apply_bandwidth_for_active_users(wait=wait_for_bandwidth)
+        except Exception as tc_error:
+            logger.warning("Failed to refresh bandwidth shaping after cleanup: %s", tc_error)
+
+    return len(session_ops)
+
+
+def expire_session(session, reason: str = 'auto_cleanup') -> None:
+    """Sync usage, revoke firewall access and mark one session inactive."""
+    expire_sessions([session], reason=reason)
+
+
+def cleanup_stale_sessions(wait_for_bandwidth: bool = False):
     """Find and deactivate sessions for disconnected users"""
     try:
         active_sessions_col = db['active_sessions']
@@ -113,9 +339,15 @@ def cleanup_stale_sessions():
         
         logger.info(f"Checking {len(active_sessions)} active session(s)...")
         
-        cleaned_count = 0
         still_active = []
-        
+        stale_sessions = []
+
+        reachability = check_reachability(
+            session.get('client_ip')
+            for session in active_sessions
+            if session.get('client_ip') and session.get('client_ip') != 'N/A'
+        )
+
         for session in active_sessions:
             roll_no = session.get('roll_no', 'Unknown')
             client_ip = session.get('client_ip', 'N/A')
@@ -125,40 +357,14 @@ def cleanup_stale_sessions():
                 continue
             
             # Check if device is still connected
-            if is_ip_reachable(client_ip):
+            if reachability.get(client_ip, False):
                 still_active.append(f"{roll_no} ({client_ip})")
             else:
-                try:
-                    _persist_session_usage(session)
-                except Exception as usage_error:
-                    logger.warning("Failed to persist usage for %s (%s): %s", roll_no, client_ip, usage_error)
-
-                if _is_hotspot_client_ip(client_ip):
-                    try:
-                        from linux_firewall_manager import block_authenticated_user
-
-                        block_authenticated_user(client_ip)
-                    except Exception as firewall_error:
-                        logger.warning(
-                            "Failed to revoke firewall access for stale session %s (%s): %s",
-                            roll_no,
-                            client_ip,
-                            firewall_error,
-                        )
-
-                # Device disconnected - mark session as inactive
-                active_sessions_col.update_one(
-                    {'_id': session['_id']},
-                    {
-                        '$set': {
-                            'status': 'inactive',
-                            'logout_time': datetime.utcnow(),
-                            'auto_cleanup': True
-                        }
-                    }
-                )
-                cleaned_count += 1
-                logger.info(f"❌ Cleaned up stale session: {roll_no} ({client_ip})")
+                stale_sessions.append(session)
+                logger.info(f"❌ Cleaning up stale session: {roll_no} ({client_ip})")
+
+        # Device(s) disconnected - tear down all stale sessions in one batch
+        cleaned_count = expire_sessions(stale_sessions, wait_for_bandwidth=wait_for_bandwidth)
         
         # Summary
         if cleaned_count > 0:
@@ -178,7 +384,7 @@ if __name__ == "__main__":
     logger.info("=" * 60)
     logger.info("Session Cleanup Service - Starting")
     logger.info("=" * 60)
-    cleanup_stale_sessions()
+    cleanup_stale_sessions(wait_for_bandwidth=True)
     logger.info("=" * 60)
     logger.info("Session Cleanup Service - Completed")
     logger.info("=" * 60)
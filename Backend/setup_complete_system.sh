@@ -29,7 +29,7 @@ fi
 
 echo "==== Step 1: Installing Required Packages ===="
 apt update
-apt install -y hostapd dnsmasq iptables wireless-tools net-tools tshark wireshark
+apt install -y hostapd dnsmasq iptables ipset wireless-tools net-tools tshark wireshark
 
 echo ""
 echo "==== Step 2: Stopping Services ===="
@@ -42,6 +42,8 @@ cat > /etc/hostapd/hostapd.conf << EOF
 # Interface configuration
 interface=$HOTSPOT_INTERFACE
 driver=nl80211
+ctrl_interface=/var/run/hostapd
+ctrl_interface_group=0
 
 # WiFi configuration
 ssid=$HOTSPOT_SSID
@@ -21,7 +21,8 @@ collections = [
     "active_sessions",
     "blocked_users",
     "web_filter",
-    "logs"
+    "logs",
+    "usage_daily"
 ]
 
 for collection_name in collections:
@@ -31,6 +32,11 @@ for collection_name in collections:
     else:
         print(f"  ⏭️  Collection already exists: {collection_name}")
 
+# One rollup document per student per day
+db["usage_daily"].create_index([("roll_no", 1), ("day", 1)], unique=True)
+db["usage_daily"].create_index([("day", 1)])
+print("  ✅ Indexed usage_daily rollups")
+
 # Create default admin user
 print("\n👤 Creating default admin user...")
 admins_collection = db["admins"]
@@ -17,16 +17,68 @@ cat > "${HELPER_PATH}" <<'EOF'
 set -euo pipefail
 
 BLOCKLIST="/etc/dnsmasq.d/blocklist.conf"
+BLOCK_HOSTS="/etc/dnsmasq.blocklist.hosts"
+BLOCK_SERVERS="/etc/dnsmasq.blocklist.servers"
+# Per-group DNS views (filter groups): one DNS-only dnsmasq per group.
+VIEW_DIR="/etc/dnsmasq.groups"
+VIEW_RUN_DIR="/run"
 
-if [[ "${1:-}" == "--clear" ]]; then
-  rm -f "${BLOCKLIST}"
-else
-  SRC="$(readlink -f "${1:?temp blocklist file required}")"
+install_from_tmp() {
+  SRC="$(readlink -f "${1:?temp file required}")"
   [[ "${SRC}" == /tmp/* ]] || { echo "Only /tmp source files are allowed"; exit 2; }
-  install -o root -g root -m 0644 "${SRC}" "${BLOCKLIST}"
-fi
+  install -D -o root -g root -m 0644 "${SRC}" "${2}"
+}
+
+view_group() {
+  GROUP="${1:?group required}"
+  [[ "${GROUP}" =~ ^[a-z0-9_-]{1,16}$ ]] || { echo "Invalid group name"; exit 2; }
+}
+
+view_pid() {
+  PID="$(cat "${VIEW_RUN_DIR}/wifi-dnsmasq-${GROUP}.pid" 2>/dev/null || true)"
+  [[ "${PID}" =~ ^[0-9]+$ ]] && [[ "$(cat "/proc/${PID}/comm" 2>/dev/null)" == "dnsmasq" ]] || PID=""
+}
 
-systemctl restart dnsmasq
+case "${1:-}" in
+  --clear)
+    rm -f "${BLOCKLIST}" "${BLOCK_HOSTS}" "${BLOCK_SERVERS}"
+    systemctl restart dnsmasq
+    ;;
+  include) install_from_tmp "${2:-}" "${BLOCKLIST}" ;;
+  hosts) install_from_tmp "${2:-}" "${BLOCK_HOSTS}" ;;
+  servers) install_from_tmp "${2:-}" "${BLOCK_SERVERS}" ;;
+  # SIGHUP re-reads addn-hosts and servers-file without dropping DHCP leases or the process
+  reload) systemctl kill -s HUP dnsmasq ;;
+  restart) systemctl restart dnsmasq ;;
+  view-install)
+    view_group "${2:-}"
+    case "${3:-}" in
+      conf|hosts|servers) install_from_tmp "${4:-}" "${VIEW_DIR}/${GROUP}.${3}" ;;
+      *) echo "Unknown view file kind"; exit 2 ;;
+    esac
+    ;;
+  view-start)
+    view_group "${2:-}"
+    dnsmasq "--conf-file=${VIEW_DIR}/${GROUP}.conf"
+    ;;
+  view-reload)
+    view_group "${2:-}"
+    view_pid
+    if [[ -z "${PID}" ]]; then echo "DNS view ${GROUP} is not running"; exit 3; fi
+    kill -HUP "${PID}"
+    ;;
+  view-stop)
+    view_group "${2:-}"
+    view_pid
+    [[ -z "${PID}" ]] || kill "${PID}"
+    rm -f "${VIEW_DIR}/${GROUP}.conf" "${VIEW_DIR}/${GROUP}.hosts" "${VIEW_DIR}/${GROUP}.servers"
+    ;;
+  *)
+    # Legacy: full blocklist.conf from a temp file
+    install_from_tmp "${1:-}" "${BLOCKLIST}"
+    systemctl restart dnsmasq
+    ;;
+esac
 EOF
 
 chown root:root "${HELPER_PATH}"
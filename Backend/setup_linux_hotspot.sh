@@ -21,7 +21,7 @@ HOTSPOT_IP="${HOTSPOT_GATEWAY_IP:-192.168.50.1}"
 # 1. Install required packages
 echo "Step 1: Installing required packages..."
 apt update
-apt install -y hostapd dnsmasq iptables iptables-persistent \
+apt install -y hostapd dnsmasq iptables iptables-persistent ipset ipset-persistent \
     python3-pip python3-venv net-tools wireless-tools \
     bridge-utils iw git dkms build-essential
 
@@ -44,6 +44,8 @@ cat > /etc/hostapd/hostapd.conf << EOF
 # WiFi Interface
 interface=$HOTSPOT_INTERFACE
 driver=nl80211
+ctrl_interface=/var/run/hostapd
+ctrl_interface_group=0
 
 # Network Settings
 ssid=MyWiFiHotspot
@@ -163,6 +165,27 @@ RestartSec=10
 WantedBy=multi-user.target
 EOF
 
+# 9b. Create systemd service for station disconnect events
+echo ""
+echo "Step 9b: Creating station event daemon service..."
+cat > /etc/systemd/system/station-event-daemon.service << EOF
+[Unit]
+Description=WiFi Station Disconnect Session Expiry
+After=network.target hostapd.service wifi-backend.service
+
+[Service]
+Type=simple
+User=root
+WorkingDirectory=$BACKEND_DIR
+Environment=HOTSPOT_INTERFACE=$HOTSPOT_INTERFACE
+ExecStart=/usr/bin/python3 $BACKEND_DIR/station_event_daemon.py
+Restart=always
+RestartSec=10
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 # 10. Create hotspot control script
 echo ""
 echo "Step 10: Creating hotspot control script..."
@@ -228,7 +251,7 @@ echo "Step 11: Installing Python dependencies..."
 if [ -f "$BACKEND_DIR/requirements.txt" ]; then
     pip3 install -r "$BACKEND_DIR/requirements.txt"
 else
-    pip3 install flask flask-cors pymongo
+    pip3 install flask flask-cors pymongo pytz
 fi
 
 # 12. Reload systemd
@@ -105,6 +105,16 @@ if update_dnsmasq_blocklist():
 else:
     print("  ⚠️  DNS blocklist sync failed (check sudo/helper permissions if backend runs as non-root)")
 
+print("  🔧 Applying per-group filtering policies...")
+from db import web_filter_collection
+from filter_groups import apply_group_policies
+
+group_result = apply_group_policies(web_filter_collection.find_one({"type": "config"}))
+if group_result.get("success"):
+    print(f"  ✅ Filter groups applied: {', '.join(group_result.get('groups') or []) or 'none configured'}")
+else:
+    print(f"  ⚠️  Filter group apply incomplete: {'; '.join(group_result.get('errors') or [])}")
+
 print("  ✅ Firewall is ready")
 PYEOF
 
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Station Event Daemon - Expire sessions the moment a client leaves the AP
+Subscribes to hostapd's control interface for AP-STA-DISCONNECTED events
+"""
+
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from session_cleanup import expire_sessions, read_neighbor_table
+from db import sessions_collection
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+HOSTAPD_CTRL_DIR = os.environ.get("HOSTAPD_CTRL_DIR", "/var/run/hostapd")
+DNSMASQ_LEASE_FILE = os.environ.get("DNSMASQ_LEASE_FILE", "/var/lib/misc/dnsmasq.leases")
+DISCONNECT_GRACE_SECONDS = float(os.environ.get("STATION_DISCONNECT_GRACE_SECONDS", "5"))
+HOSTAPD_KEEPALIVE_SECONDS = 30.0
+HOSTAPD_RECONNECT_DELAY_SECONDS = 5.0
+
+_EVENT_PATTERN = re.compile(
+    r"(AP-STA-CONNECTED|AP-STA-DISCONNECTED)\s+([0-9a-f]{2}(?::[0-9a-f]{2}){5})",
+    re.IGNORECASE,
+)
+
+
+def read_dhcp_leases(lease_file: str = DNSMASQ_LEASE_FILE) -> Dict[str, str]:
+    """Map client MAC -> IP from a dnsmasq lease file."""
+    leases: Dict[str, str] = {}
+    try:
+        with open(lease_file, "r") as handle:
+            for line in handle:
+                # Format: <expiry> <mac> <ip> <hostname> <client-id>
+                parts = line.split()
+                if len(parts) >= 3:
+                    leases[parts[1].lower()] = parts[2]
+    except OSError as error:
+        logger.warning("Unable to read DHCP leases from %s: %s", lease_file, error)
+    return leases
+
+
+def parse_station_event(line: str):
+    """Return (event, mac) for station events, or None for anything else."""
+    match = _EVENT_PATTERN.search(line or "")
+    if not match:
+        return None
+    return match.group(1).upper(), match.group(2).lower()
+
+
+class HostapdControlClient:
+    """Minimal client for hostapd's UNIX datagram control socket."""
+
+    def __init__(self, interface: str, ctrl_dir: str = HOSTAPD_CTRL_DIR, poll_timeout: float = 1.0,
+                 keepalive_seconds: float = HOSTAPD_KEEPALIVE_SECONDS):
+        self.ctrl_path = os.path.join(ctrl_dir, interface)
+        self.poll_timeout = poll_timeout
+        self.keepalive_seconds = keepalive_seconds
+        self.sock: Optional[socket.socket] = None
+        self.local_path: Optional[str] = None
+        self._backlog = []
+
+    def connect(self) -> None:
+        self.local_path = os.path.join(
+            tempfile.gettempdir(), f"wifi_mgmt_hostapd_{os.getpid()}"
+        )
+        if os.path.exists(self.local_path):
+            os.unlink(self.local_path)
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.local_path)
+        self.sock.connect(self.ctrl_path)
+        self.sock.settimeout(5)
+        self.sock.send(b"ATTACH")
+        reply = self.sock.recv(4096).strip()
+        # Unsolicited "<level>" events can arrive ahead of the reply; keep them.
+        while reply.startswith(b"<"):
+            self._backlog.append(reply.decode("utf-8", errors="replace"))
+            reply = self.sock.recv(4096).strip()
+        if reply != b"OK":
+            raise RuntimeError(f"hostapd refused ATTACH: {reply!r}")
+        self.sock.settimeout(self.poll_timeout)
+        logger.info("Attached to hostapd control interface %s", self.ctrl_path)
+
+    def events(self) -> Iterator[Optional[str]]:
+        """Yield event lines, or None on each idle poll tick."""
+        while self._backlog:
+            yield self._backlog.pop(0)
+        idle_ticks = 0
+        while True:
+            try:
+                data = self.sock.recv(4096)
+            except socket.timeout:
+                idle_ticks += 1
+                # Keep-alive so a restarted hostapd is noticed within ~30 s.
+                if idle_ticks * self.poll_timeout >= self.keepalive_seconds:
+                    idle_ticks = 0
+                    self.sock.send(b"PING")
+                yield None
+                continue
+
+            idle_ticks = 0
+            text = data.decode("utf-8", errors="replace").strip()
+            if text == "PONG":
+                continue
+            yield text
+
+    def close(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.send(b"DETACH")
+            except OSError:
+                pass
+            self.sock.close()
+            self.sock = None
+        if self.local_path and os.path.exists(self.local_path):
+            os.unlink(self.local_path)
+
+
+class FakeHostapdServer:
+    """
+    Scripted stand-in for hostapd's control socket, for tests and --fake-hostapd.
+
+    Binds <ctrl_dir>/<interface> as an AF_UNIX datagram socket, answers
+    ATTACH/DETACH with OK and PING with PONG (as hostapd does), and sends
+    queued event lines to attached clients as "<3>AP-STA-..." messages.
+    restart() rebinds the socket like a restarted hostapd, which drops
+    every attachment and makes the client's next send fail.
+    """
+
+    def __init__(self, ctrl_dir: str, interface: str):
+        self.ctrl_path = os.path.join(ctrl_dir, interface)
+        self.attached = set()
+        self.commands = []
+        self._sock: Optional[socket.socket] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._attach_event = threading.Event()
+
+    def _serve(self, sock: socket.socket) -> None:
+        while True:
+            try:
+                data, address = sock.recvfrom(4096)
+            except OSError:
+                return  # closed by restart()/stop()
+            command = data.decode("utf-8", errors="replace").strip()
+            try:
+                sock.sendto(b"PONG" if command == "PING" else b"OK", address)
+            except OSError:
+                pass
+            # Like hostapd, the ATTACH reply goes out before any event does.
+            with self._lock:
+                self.commands.append(command)
+                if command == "ATTACH":
+                    self.attached.add(address)
+                    self._attach_event.set()
+                elif command == "DETACH":
+                    self.attached.discard(address)
+
+    def start(self) -> "FakeHostapdServer":
+        os.makedirs(os.path.dirname(self.ctrl_path), exist_ok=True)
+        if os.path.exists(self.ctrl_path):
+            os.unlink(self.ctrl_path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.ctrl_path)
+        self._thread = threading.Thread(target=self._serve, args=(self._sock,), name="fake-hostapd", daemon=True)
+        self._thread.start()
+        return self
+
+    def wait_attached(self, timeout: float = 10.0) -> bool:
+        return self._attach_event.wait(timeout)
+
+    def send_event(self, line: str) -> int:
+        """Send one event to every attached client; returns how many got it."""
+        message = line if line.startswith("<") else f"<3>{line}"
+        with self._lock:
+            clients = list(self.attached)
+        sent = 0
+        for address in clients:
+            try:
+                self._sock.sendto(message.encode("utf-8"), address)
+                sent += 1
+            except OSError:
+                with self._lock:
+                    self.attached.discard(address)
+        return sent
+
+    def restart(self) -> None:
+        self.stop()
+        with self._lock:
+            self.attached.clear()
+        self._attach_event.clear()
+        self.start()
+
+    def run_script(self, lines: Iterable[str]) -> None:
+        """
+        Play a script: event lines are sent as-is; "sleep <s>", "restart"
+        and "wait-attach" are directives. Blank lines and #comments are skipped.
+        """
+        for raw in lines:
+            line = raw.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("sleep "):
+                time.sleep(float(line.split()[1]))
+            elif line == "restart":
+                self.restart()
+            elif line == "wait-attach":
+                self.wait_attached()
+            else:
+                self.send_event(line)
+
+    def stop(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if os.path.exists(self.ctrl_path):
+            os.unlink(self.ctrl_path)
+
+
+class StationEventDaemon:
+    def __init__(
+        self,
+        interface: Optional[str] = None,
+        lease_file: str = DNSMASQ_LEASE_FILE,
+        grace_seconds: float = DISCONNECT_GRACE_SECONDS,
+        event_source: Optional[Callable[[], Iterator[Optional[str]]]] = None,
+        ctrl_dir: str = HOSTAPD_CTRL_DIR,
+        keepalive_seconds: float = HOSTAPD_KEEPALIVE_SECONDS,
+        reconnect_delay: float = HOSTAPD_RECONNECT_DELAY_SECONDS,
+    ):
+        """
+        Initialize the daemon
+
+        Args:
+            interface: hostapd interface name (defaults to HOTSPOT_INTERFACE)
+            lease_file: dnsmasq lease file used to map MAC -> IP
+            grace_seconds: delay before expiring, so quick roams/reconnects are ignored
+            event_source: callable returning an iterator of event lines
+                (None = idle tick); defaults to the hostapd control socket
+            ctrl_dir: hostapd control directory (a FakeHostapdServer's, in tests)
+            keepalive_seconds: idle time before the control socket is PINGed
+            reconnect_delay: wait before re-attaching after the socket is lost
+        """
+        self.interface = interface or (os.environ.get("HOTSPOT_INTERFACE") or "").strip() or "wlx782051ac644f"
+        self.lease_file = lease_file
+        self.grace_seconds = max(0.0, float(grace_seconds))
+        self.event_source = event_source
+        self.ctrl_dir = ctrl_dir
+        self.keepalive_seconds = keepalive_seconds
+        self.reconnect_delay = reconnect_delay
+        self.pending: Dict[str, float] = {}
+        self.running = False
+
+    def resolve_client_ip(self, mac: str) -> Optional[str]:
+        client_ip = read_dhcp_leases(self.lease_file).get(mac)
+        if client_ip:
+            return client_ip
+
+        for ip, entry in read_neighbor_table().items():
+            if entry.get("mac") == mac:
+                return ip
+        return None
+
+    def expire_station(self, mac: str) -> bool:
+        client_ip = self.resolve_client_ip(mac)
+        if not client_ip:
+            logger.info("No DHCP lease for disconnected station %s", mac)
+            return False
+
+        # Every active session on the IP, duplicates included, in one batch.
+        sessions = list(sessions_collection.find({"client_ip": client_ip, "status": "active"}))
+        if not sessions:
+            return False
+
+        expire_sessions(sessions, reason="station_disconnected")
+        logger.info(
+            "❌ Expired session(s) %s (%s) after station %s disconnected",
+            ", ".join(str(session.get("roll_no", "Unknown")) for session in sessions),
+            client_ip,
+            mac,
+        )
+        return True
+
+    def handle_event(self, line: str) -> None:
+        event = parse_station_event(line)
+        if not event:
+            return
+
+        kind, mac = event
+        if kind == "AP-STA-CONNECTED":
+            self.pending.pop(mac, None)
+            return
+
+        self.pending[mac] = time.monotonic() + self.grace_seconds
+
+    def flush_due(self, now: Optional[float] = None) -> int:
+        now = time.monotonic() if now is None else now
+        due = [mac for mac, deadline in self.pending.items() if deadline <= now]
+        expired = 0
+        for mac in due:
+            self.pending.pop(mac, None)
+            try:
+                if self.expire_station(mac):
+                    expired += 1
+            except Exception as e:
+                logger.error(f"Failed to expire station {mac}: {e}")
+        return expired
+
+    def _default_event_source(self) -> Iterator[Optional[str]]:
+        client = HostapdControlClient(self.interface, self.ctrl_dir, keepalive_seconds=self.keepalive_seconds)
+        client.connect()
+        try:
+            yield from client.events()
+        finally:
+            client.close()
+
+    def run(self):
+        """Main service loop"""
+        self.running = True
+        logger.info(f"Station Event Daemon started on {self.interface} (grace {self.grace_seconds}s)")
+
+        source_factory = self.event_source or self._default_event_source
+
+        while self.running:
+            try:
+                for line in source_factory():
+                    if line:
+                        self.handle_event(line)
+                    self.flush_due()
+                    if not self.running:
+                        break
+                else:
+                    # Finite (scripted) sources end here.
+                    self.flush_due(now=float("inf"))
+                    break
+            except KeyboardInterrupt:
+                logger.info("Received stop signal")
+                self.running = False
+                break
+            except Exception as e:
+                logger.error(f"Lost hostapd control interface: {e}")
+                time.sleep(self.reconnect_delay)  # Wait before re-attaching
+
+        logger.info("Station Event Daemon stopped")
+
+    def stop(self):
+        """Stop the service"""
+        self.running = False
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Station Event Daemon')
+    parser.add_argument('--interface', default=None, help='hostapd interface (default: HOTSPOT_INTERFACE)')
+    parser.add_argument('--leases', default=DNSMASQ_LEASE_FILE, help='dnsmasq lease file')
+    parser.add_argument(
+        '--grace',
+        type=float,
+        default=DISCONNECT_GRACE_SECONDS,
+        help='Seconds to wait for a reconnect before expiring (default: 5)'
+    )
+    parser.add_argument(
+        '--replay',
+        default=None,
+        help='Replay hostapd event lines from a file instead of the control socket'
+    )
+    parser.add_argument(
+        '--fake-hostapd',
+        default=None,
+        metavar='SCRIPT',
+        help='Run against a scripted fake hostapd control socket (events, "sleep N", "restart", "wait-attach")'
+    )
+
+    args = parser.parse_args()
+
+    if args.fake_hostapd:
+        with open(args.fake_hostapd, "r") as script_handle:
+            script = script_handle.read().splitlines()
+        fake_dir = tempfile.mkdtemp(prefix="fake-hostapd-")
+        daemon = StationEventDaemon(
+            interface=args.interface,
+            lease_file=args.leases,
+            grace_seconds=args.grace,
+            ctrl_dir=fake_dir,
+            keepalive_seconds=2,
+            reconnect_delay=1,
+        )
+        server = FakeHostapdServer(fake_dir, daemon.interface).start()
+
+        def play():
+            server.wait_attached()
+            server.run_script(script)
+            time.sleep(daemon.grace_seconds + 2)
+            daemon.stop()
+
+        threading.Thread(target=play, name="fake-hostapd-script", daemon=True).start()
+        try:
+            daemon.run()
+        finally:
+            server.stop()
+            logger.info("Fake hostapd saw commands: %s", ", ".join(server.commands))
+        sys.exit(0)
+
+    event_source = None
+    if args.replay:
+        def event_source():
+            with open(args.replay, "r") as handle:
+                for replay_line in handle:
+                    yield replay_line.strip()
+
+    daemon = StationEventDaemon(
+        interface=args.interface,
+        lease_file=args.leases,
+        grace_seconds=args.grace,
+        event_source=event_source,
+    )
+
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        logger.info("Service interrupted by user")
+        sys.exit(0)
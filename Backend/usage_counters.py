@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Usage Counters - per-client byte counters from ipset per-element counters
+
+Usage accounting matches two `hash:ip counters` sets (upload by source,
+download by destination) instead of two iptables rules per client. Each set
+is read with one netlink IPSET_CMD_LIST dump into a reused buffer and the
+binary attributes are decoded in place through a memoryview, so there is no
+iptables-save text to regex through. Processes without CAP_NET_ADMIN fall
+back to `sudo -n ipset save`.
+
+Element counters, like the per-client rule counters before them, only grow
+while the client stays in the set and restart at zero after it is removed.
+Conntrack accounting (nf_conntrack_acct) is not used: its per-flow totals
+vanish when flows expire, so sums by client IP would go backwards.
+
+Sources share one interface, read(set_names) -> {set: {ip: (packets, bytes)}}:
+  NetlinkCounterSource  kernel dump (default, needs CAP_NET_ADMIN)
+  IpsetSaveCounterSource  `ipset save` text (fallback)
+  FakeCounterSource     canned counters, encoded as kernel dump messages
+"""
+
+import errno
+import logging
+import os
+import socket
+import struct
+import subprocess
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+USAGE_COUNTER_SOURCE = os.environ.get("USAGE_COUNTER_SOURCE", "auto").strip().lower()  # auto|netlink|ipset
+USAGE_COUNTER_RECV_BUFFER = 65536
+
+NETLINK_NETFILTER = 12
+NFNL_SUBSYS_IPSET = 6
+NFNETLINK_V0 = 0
+IPSET_CMD_LIST = 7
+IPSET_PROTOCOL = 6  # oldest protocol still accepted by every kernel that has ipset counters
+
+NLM_F_REQUEST = 0x01
+NLM_F_MULTI = 0x02
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLA_F_NESTED = 0x8000
+NLA_F_NET_BYTEORDER = 0x4000
+NLA_TYPE_MASK = 0x3FFF
+
+IPSET_ATTR_PROTOCOL = 1
+IPSET_ATTR_SETNAME = 2
+IPSET_ATTR_TYPENAME = 3
+IPSET_ATTR_REVISION = 4
+IPSET_ATTR_FAMILY = 5
+IPSET_ATTR_DATA = 7
+IPSET_ATTR_ADT = 8
+IPSET_ATTR_IP = 1
+IPSET_ATTR_IPADDR_IPV4 = 1
+IPSET_ATTR_BYTES = 24
+IPSET_ATTR_PACKETS = 25
+
+_NLMSG = struct.Struct("=IHHII")
+_NFGENMSG = struct.Struct("=BBH")
+_NLATTR = struct.Struct("=HH")
+_U32_BE = struct.Struct(">I")
+_U64_BE = struct.Struct(">Q")
+_ERRNO = struct.Struct("=i")
+_MSG_LIST = (NFNL_SUBSYS_IPSET << 8) | IPSET_CMD_LIST
+
+Counters = Dict[str, Dict[str, Tuple[int, int]]]
+
+
+def _align4(length: int) -> int:
+    return (length + 3) & ~3
+
+
+def _nlattr(attr_type: int, payload: bytes) -> bytes:
+    header = _NLATTR.pack(_NLATTR.size + len(payload), attr_type)
+    return header + payload + b"\0" * (_align4(len(payload)) - len(payload))
+
+
+def _nlmsg(msg_type: int, flags: int, seq: int, payload: bytes) -> bytes:
+    return _NLMSG.pack(_NLMSG.size + len(payload), msg_type, flags, seq, 0) + payload
+
+
+def build_list_request(set_name: str, seq: int) -> bytes:
+    """IPSET_CMD_LIST dump request for one set."""
+    payload = (
+        _NFGENMSG.pack(socket.AF_INET, NFNETLINK_V0, 0)
+        + _nlattr(IPSET_ATTR_PROTOCOL, bytes([IPSET_PROTOCOL]))
+        + _nlattr(IPSET_ATTR_SETNAME, set_name.encode("ascii") + b"\0")
+    )
+    return _nlmsg(_MSG_LIST, NLM_F_REQUEST | NLM_F_DUMP, seq, payload)
+
+
+def _parse_elements(view: memoryview, offset: int, end: int, members: Dict[str, Tuple[int, int]]) -> None:
+    """Decode the IPSET_ATTR_DATA entries nested in an IPSET_ATTR_ADT attribute."""
+    unpack_attr = _NLATTR.unpack_from
+    while offset + 4 <= end:
+        length, attr_type = unpack_attr(view, offset)
+        if length < 4:
+            break
+        if attr_type & NLA_TYPE_MASK == IPSET_ATTR_DATA:
+            ip = None
+            packets = byte_count = 0
+            inner, inner_end = offset + 4, offset + length
+            while inner + 4 <= inner_end:
+                inner_length, inner_type = unpack_attr(view, inner)
+                if inner_length < 4:
+                    break
+                inner_type &= NLA_TYPE_MASK
+                if inner_type == IPSET_ATTR_IP:
+                    address_length, address_type = unpack_attr(view, inner + 4)
+                    if address_type & NLA_TYPE_MASK == IPSET_ATTR_IPADDR_IPV4 and address_length == 8:
+                        ip = socket.inet_ntoa(view[inner + 8:inner + 12])
+                elif inner_type == IPSET_ATTR_BYTES:
+                    byte_count = _U64_BE.unpack_from(view, inner + 4)[0]
+                elif inner_type == IPSET_ATTR_PACKETS:
+                    packets = _U64_BE.unpack_from(view, inner + 4)[0]
+                inner += _align4(inner_length)
+            if ip is not None:
+                members[ip] = (packets, byte_count)
+        offset += _align4(length)
+
+
+def parse_list_messages(buffer, counters: Counters) -> bool:
+    """
+    Decode a run of IPSET_CMD_LIST reply messages into counters, in place.
+    Returns True once the dump's NLMSG_DONE is seen; raises OSError for a
+    netlink error reply.
+    """
+    view = memoryview(buffer)
+    total = len(view)
+    offset = 0
+    while offset + _NLMSG.size <= total:
+        msg_length, msg_type, _flags, _seq, _pid = _NLMSG.unpack_from(view, offset)
+        if msg_length < _NLMSG.size or offset + msg_length > total:
+            break
+        msg_end = offset + msg_length
+        if msg_type == NLMSG_DONE:
+            return True
+        if msg_type == NLMSG_ERROR:
+            error = -_ERRNO.unpack_from(view, offset + _NLMSG.size)[0]
+            if error:
+                raise OSError(error, os.strerror(error))
+        elif msg_type == _MSG_LIST:
+            members = None
+            attr = offset + _NLMSG.size + _NFGENMSG.size
+            while attr + 4 <= msg_end:
+                length, attr_type = _NLATTR.unpack_from(view, attr)
+                if length < 4:
+                    break
+                attr_type &= NLA_TYPE_MASK
+                if attr_type == IPSET_ATTR_SETNAME:
+                    name = bytes(view[attr + 4:attr + length]).split(b"\0", 1)[0].decode("ascii", "replace")
+                    members = counters.setdefault(name, {})
+                elif attr_type == IPSET_ATTR_ADT and members is not None:
+                    _parse_elements(view, attr + 4, attr + length, members)
+                attr += _align4(length)
+        offset += _align4(msg_length)
+    return False
+
+
+def encode_list_dump(set_name: str, members: Dict[str, Tuple[int, int]], seq: int = 1,
+                     per_message: int = 256) -> bytes:
+    """Kernel-shaped IPSET_CMD_LIST reply (header, element batches, NLMSG_DONE)."""
+    nested_data = IPSET_ATTR_DATA | NLA_F_NESTED
+    header = (
+        _NFGENMSG.pack(socket.AF_INET, NFNETLINK_V0, 0)
+        + _nlattr(IPSET_ATTR_PROTOCOL, bytes([IPSET_PROTOCOL]))
+        + _nlattr(IPSET_ATTR_SETNAME, set_name.encode("ascii") + b"\0")
+    )
+    first = header + (
+        _nlattr(IPSET_ATTR_TYPENAME, b"hash:ip\0")
+        + _nlattr(IPSET_ATTR_REVISION, bytes([4]))
+        + _nlattr(IPSET_ATTR_FAMILY, bytes([socket.AF_INET]))
+        + _nlattr(nested_data, b"")
+    )
+    messages = [_nlmsg(_MSG_LIST, NLM_F_MULTI, seq, first)]
+    items = sorted(members.items())
+    for start in range(0, len(items), per_message):
+        elements = b"".join(
+            _nlattr(nested_data, (
+                _nlattr(IPSET_ATTR_IP | NLA_F_NESTED,
+                        _nlattr(IPSET_ATTR_IPADDR_IPV4 | NLA_F_NET_BYTEORDER, socket.inet_aton(ip)))
+                + _nlattr(IPSET_ATTR_BYTES | NLA_F_NET_BYTEORDER, _U64_BE.pack(byte_count))
+                + _nlattr(IPSET_ATTR_PACKETS | NLA_F_NET_BYTEORDER, _U64_BE.pack(packets))
+            ))
+            for ip, (packets, byte_count) in items[start:start + per_message]
+        )
+        messages.append(_nlmsg(_MSG_LIST, NLM_F_MULTI, seq, header + _nlattr(IPSET_ATTR_ADT | NLA_F_NESTED, elements)))
+    messages.append(_nlmsg(NLMSG_DONE, NLM_F_MULTI, seq, _ERRNO.pack(0)))
+    return b"".join(messages)
+
+
+class NetlinkCounterSource:
+    """Dump set counters straight from the kernel over NETLINK_NETFILTER."""
+
+    def __init__(self, buffer_size: int = USAGE_COUNTER_RECV_BUFFER):
+        self._buffer = bytearray(buffer_size)
+        self._seq = int(time.time()) & 0xFFFF
+
+    def read(self, set_names: Iterable[str]) -> Counters:
+        counters: Counters = {}
+        view = memoryview(self._buffer)
+        with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_NETFILTER) as sock:
+            sock.settimeout(2.0)
+            sock.bind((0, 0))
+            for set_name in set_names:
+                self._seq = (self._seq + 1) & 0xFFFFFFFF
+                sock.send(build_list_request(set_name, self._seq))
+                try:
+                    while True:
+                        received = sock.recv_into(self._buffer)
+                        if not received or parse_list_messages(view[:received], counters):
+                            break
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    # Set does not exist (yet): no counters.
+                counters.setdefault(set_name, {})
+        return counters
+
+
+class IpsetSaveCounterSource:
+    """Read counters from `ipset save` output (no netlink privileges needed)."""
+
+    def read(self, set_names: Iterable[str]) -> Counters:
+        counters: Counters = {}
+        for set_name in set_names:
+            members = counters.setdefault(set_name, {})
+            try:
+                result = subprocess.run(
+                    ["sudo", "-n", "ipset", "save", set_name],
+                    capture_output=True,
+                    text=True,
+                    check=False,
+                )
+            except OSError:
+                continue
+            if result.returncode != 0:
+                continue
+            for line in result.stdout.splitlines():
+                # add <set> <ip> packets <n> bytes <n>
+                parts = line.split()
+                if len(parts) >= 7 and parts[0] == "add" and parts[3] == "packets" and parts[5] == "bytes":
+                    members[parts[2]] = (int(parts[4]), int(parts[6]))
+        return counters
+
+
+class FakeCounterSource:
+    """Canned counters served through the binary dump parser, for tests and benchmarks."""
+
+    def __init__(self, counters: Optional[Counters] = None):
+        self.counters: Counters = {name: dict(members) for name, members in (counters or {}).items()}
+
+    def set_counter(self, set_name: str, ip: str, byte_count: int, packets: int = 0) -> None:
+        self.counters.setdefault(set_name, {})[ip] = (packets, byte_count)
+
+    def read(self, set_names: Iterable[str]) -> Counters:
+        counters: Counters = {}
+        for seq, set_name in enumerate(set_names, start=1):
+            if set_name in self.counters:
+                parse_list_messages(encode_list_dump(set_name, self.counters[set_name], seq), counters)
+            counters.setdefault(set_name, {})
+        return counters
+
+
+_netlink_source: Optional[NetlinkCounterSource] = None
+_netlink_unavailable = False
+
+
+def read_set_counters(set_names: Iterable[str], source=None) -> Counters:
+    """Counters of the given sets from source, or from the configured default."""
+    global _netlink_source, _netlink_unavailable
+    set_names = list(set_names)
+    if source is not None:
+        return source.read(set_names)
+
+    if USAGE_COUNTER_SOURCE != "ipset" and not _netlink_unavailable:
+        try:
+            if _netlink_source is None:
+                _netlink_source = NetlinkCounterSource()
+            return _netlink_source.read(set_names)
+        except OSError as e:
+            if USAGE_COUNTER_SOURCE == "netlink":
+                raise
+            # EPERM without CAP_NET_ADMIN; stop retrying for this process.
+            _netlink_unavailable = e.errno in (errno.EPERM, errno.EACCES, errno.EPROTONOSUPPORT)
+            logger.info(f"Netlink ipset dump unavailable ({e}); using ipset save")
+    return IpsetSaveCounterSource().read(set_names)
+
+
+def run_benchmark(clients: int, rounds: int = 5) -> Dict:
+    """Parse fake dumps for N clients and report the decode rate."""
+    fake = FakeCounterSource()
+    for index in range(clients):
+        ip = f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"
+        fake.set_counter("bench_up", ip, index * 1500, index)
+        fake.set_counter("bench_down", ip, index * 9000, index * 6)
+    dumps = [encode_list_dump(name, fake.counters[name], seq) for seq, name in enumerate(("bench_up", "bench_down"), 1)]
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        counters: Counters = {}
+        for dump in dumps:
+            parse_list_messages(dump, counters)
+    elapsed = (time.perf_counter() - started) / rounds
+    assert counters["bench_down"] == fake.counters["bench_down"]
+    return {
+        "clients": clients,
+        "dump_bytes": sum(len(dump) for dump in dumps),
+        "parse_ms": round(elapsed * 1000, 2),
+        "elements_per_second": int(2 * clients / elapsed) if elapsed else None,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    parser = argparse.ArgumentParser(description='Read ipset per-element usage counters')
+    parser.add_argument('sets', nargs='*', default=['wifi_usage_up', 'wifi_usage_down'], help='Set names to read')
+    parser.add_argument('--source', choices=['auto', 'netlink', 'ipset'], default='auto')
+    parser.add_argument('--bench', type=int, metavar='N', help='Benchmark the dump parser with N fake clients')
+
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(run_benchmark(args.bench), indent=2))
+    else:
+        chosen = {"netlink": NetlinkCounterSource(), "ipset": IpsetSaveCounterSource()}.get(args.source)
+        result = read_set_counters(args.sets, chosen)
+        print(json.dumps({name: {ip: {"packets": p, "bytes": b} for ip, (p, b) in members.items()}
+                          for name, members in result.items()}, indent=2))